@@ -0,0 +1,472 @@
+#!/usr/bin/env python3
+"""Microbenchmarks for the scanner hot paths, with JSON baselines.
+
+  python3 attendance_scanner/bench.py run --out bench/baseline.json
+  python3 attendance_scanner/bench.py run --out bench/new.json
+  python3 attendance_scanner/bench.py compare bench/baseline.json bench/new.json
+
+Each benchmark times one batch of pre-built inputs per repeat (setup is not
+timed) and records ns/op for every repeat. compare flags a benchmark as a
+regression only when its median slowed down by more than --threshold *and*
+a Mann-Whitney U test says the two sets of repeats differ (p < --alpha), so
+ordinary run-to-run noise doesn't fail a build. It exits 1 on any regression.
+"""
+
+import argparse
+import atexit
+import gc
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from scanner import (
+    APPLE_COMPANY_ID,
+    IBEACON_PREFIX,
+    AttendanceGateway,
+    AttendancePipeline,
+    BeaconFrame,
+    CaptureStats,
+    FairVerifyQueue,
+    NullVerifySink,
+    PresenceTracker,
+    open_event_logger,
+    parse_advertisement,
+    parse_ibeacon,
+    take_dashboard_snapshot,
+)
+
+BASELINE_VERSION = 1
+
+
+@dataclass
+class Benchmark:
+    name: str
+    description: str
+    # setup(rng, scale) -> (run, ops): run() processes `ops` operations once.
+    setup: Callable[[random.Random, float], Tuple[Callable[[], None], int]]
+
+
+# Inputs.
+
+
+def _ibeacon_payload(rng: random.Random, user: Optional[bytes] = None) -> bytes:
+    user = user if user is not None else rng.randbytes(16)
+    return IBEACON_PREFIX + user + rng.randbytes(4) + b"\xc5"
+
+
+def _noise_payload(rng: random.Random) -> Tuple[int, bytes]:
+    """Manufacturer data a gym floor is full of: Apple Continuity, Microsoft CDP, assorted wearables."""
+    kind = rng.random()
+    if kind < 0.6:
+        # Apple Nearby Info / Handoff etc.: same company ID as iBeacon, different type byte.
+        return APPLE_COMPANY_ID, bytes([rng.choice((0x0C, 0x10, 0x12, 0x16)), 0x05]) + rng.randbytes(rng.randint(3, 25))
+    if kind < 0.8:
+        return 0x0006, rng.randbytes(27)
+    return rng.choice((0x0075, 0x0157, 0x02E5)), rng.randbytes(rng.randint(2, 20))
+
+
+def _advertisement_mix(rng: random.Random, count: int, ibeacon_share: float, members: int) -> List[dict]:
+    users = [rng.randbytes(16) for _ in range(max(1, members))]
+    token = rng.randbytes(4)
+    ads: List[dict] = []
+    for _ in range(count):
+        r = rng.random()
+        if r < ibeacon_share:
+            ads.append({APPLE_COMPANY_ID: IBEACON_PREFIX + rng.choice(users) + token + b"\xc5"})
+        elif r < ibeacon_share + 0.1:
+            ads.append({})
+        else:
+            company_id, payload = _noise_payload(rng)
+            ads.append({company_id: payload})
+    return ads
+
+
+def _frames(rng: random.Random, count: int, users: int, rssi: int = -60) -> List[BeaconFrame]:
+    ids = [str(uuid.UUID(bytes=rng.randbytes(16))) for _ in range(max(1, users))]
+    token = rng.getrandbits(32)
+    return [
+        BeaconFrame(user_id=ids[i % len(ids)], token_u32=token, major=token >> 16, minor=token & 0xFFFF, rssi=rssi)
+        for i in range(count)
+    ]
+
+
+def _gateway() -> AttendanceGateway:
+    return AttendanceGateway(
+        supabase_url="https://bench.invalid",
+        gym_id=1,
+        scanner_key="bench",
+        scanner_id="bench",
+        min_rssi=-100,
+        http_timeout_seconds=1.0,
+        http_retries=1,
+    )
+
+
+def _scaled(scale: float, count: int) -> int:
+    return max(10, int(count * scale))
+
+
+# Benchmarks.
+
+
+def _parse_ibeacon(share: float) -> Callable:
+    def setup(rng: random.Random, scale: float):
+        payloads = [
+            _ibeacon_payload(rng) if rng.random() < share else _noise_payload(rng)[1] for _ in range(_scaled(scale, 50_000))
+        ]
+
+        def run() -> None:
+            for payload in payloads:
+                parse_ibeacon(payload, -60)
+
+        return run, len(payloads)
+
+    return setup
+
+
+def _parse_advertisement(rng: random.Random, scale: float):
+    ads = _advertisement_mix(rng, _scaled(scale, 50_000), ibeacon_share=0.15, members=200)
+    stats = CaptureStats()
+
+    def run() -> None:
+        for md in ads:
+            parse_advertisement(stats, md, -60)
+
+    return run, len(ads)
+
+
+def _should_send(users: int, prefill: int) -> Callable:
+    """users=0: every frame is a new (user, token) and gets sent (the table grows by one per op)."""
+
+    def setup(rng: random.Random, scale: float):
+        gateway = _gateway()
+        now = gateway.clock.time()
+        for i in range(prefill):
+            gateway._last_sent[(str(uuid.UUID(int=i)), i)] = now - rng.uniform(0, gateway.throttle_seconds)
+        count = _scaled(scale, 100_000)
+        frames = _frames(rng, count, users if users else count)
+        if users:
+            # Seed the window so the timed pass is all throttle hits.
+            for frame in frames[:users]:
+                gateway.should_send(frame)
+
+        def run() -> None:
+            for frame in frames:
+                gateway.should_send(frame)
+
+        return run, len(frames)
+
+    return setup
+
+
+def _submit_advertisement(rng: random.Random, scale: float):
+    ads = _advertisement_mix(rng, _scaled(scale, 50_000), ibeacon_share=0.15, members=200)
+    gateway = _gateway()
+    pipeline = AttendancePipeline(
+        gateway,
+        verify_sink=NullVerifySink(gateway),
+        queue=FairVerifyQueue(maxsize=4096),
+        presence=PresenceTracker(),
+    )
+
+    def run() -> None:
+        for i, md in enumerate(ads):
+            pipeline.submit_advertisement("AA:BB:CC:DD:EE:FF", -60 - (i & 15), md)
+
+    return run, len(ads)
+
+
+def _jsonl_log(max_bytes: int, log_format: str = "jsonl") -> Callable:
+    def setup(rng: random.Random, scale: float):
+        directory = Path(tempfile.mkdtemp(prefix="liftco-bench-"))
+        atexit.register(shutil.rmtree, directory, ignore_errors=True)
+        logger = open_event_logger(directory / f"bench.{log_format}", log_format, max_bytes=max_bytes, backups=3)
+        atexit.register(logger.close)
+        # The shape of AttendancePipeline's attendance_verified event.
+        events = []
+        for _ in range(_scaled(scale, 5_000)):
+            ok = rng.random() < 0.9
+            event = {
+                "event": "attendance_verified",
+                "ok": ok,
+                "status_code": 200 if ok else 404,
+                "gym_id": 1,
+                "scanner_id": "front-desk-1",
+                "user_id": str(uuid.UUID(bytes=rng.randbytes(16))),
+                "token_u32": rng.getrandbits(32),
+                "rssi": -rng.randint(40, 90),
+            }
+            if not ok:
+                event["error"] = "No active attendance window"
+            events.append(event)
+
+        def run() -> None:
+            for event in events:
+                logger.log(event)
+
+        return run, len(events)
+
+    return setup
+
+
+def _fill_gateway_for_ui(rng: random.Random, gateway: AttendanceGateway, presence: PresenceTracker) -> None:
+    for frame in _frames(rng, 500, 500):
+        presence.seen(frame)
+    for i in range(5):
+        gateway.recent_verified.appendleft(
+            {"at": time.strftime("%H:%M:%S"), "user": str(uuid.UUID(int=i)), "rssi": -60, "status": 200}
+        )
+    gateway.adv_seen, gateway.frames_parsed, gateway.enqueued = 123_456, 23_456, 3_456
+
+
+def _dashboard_snapshot(rng: random.Random, scale: float):
+    gateway, presence, queue = _gateway(), PresenceTracker(), FairVerifyQueue()
+    _fill_gateway_for_ui(rng, gateway, presence)
+    count = _scaled(scale, 2_000)
+
+    def run() -> None:
+        for i in range(count):
+            take_dashboard_snapshot(gateway, queue, presence=presence, page=i % 10)
+
+    return run, count
+
+
+def _render_dashboard(rng: random.Random, scale: float):
+    import io
+
+    from rich.console import Console
+
+    from scanner import render_dashboard
+
+    gateway, presence, queue = _gateway(), PresenceTracker(), FairVerifyQueue()
+    _fill_gateway_for_ui(rng, gateway, presence)
+    snapshot = take_dashboard_snapshot(gateway, queue, presence=presence)
+    console = Console(file=io.StringIO(), width=140, force_terminal=True)
+    count = _scaled(scale, 100)
+
+    def run() -> None:
+        for _ in range(count):
+            console.file = io.StringIO()
+            console.print(render_dashboard(snapshot))
+
+    return run, count
+
+
+BENCHMARKS: List[Benchmark] = [
+    Benchmark("parse_ibeacon.ibeacon", "parse_ibeacon, all valid iBeacon payloads", _parse_ibeacon(1.0)),
+    Benchmark("parse_ibeacon.noise", "parse_ibeacon, non-iBeacon manufacturer data", _parse_ibeacon(0.0)),
+    Benchmark("parse_advertisement.gym_mix", "15% member iBeacons, Apple/Microsoft/wearable noise, 10% no data", _parse_advertisement),
+    Benchmark("should_send.hit", "new (user, token) every frame; throttle table grows", _should_send(users=0, prefill=0)),
+    Benchmark("should_send.throttled", "200 members re-advertising inside the window", _should_send(users=200, prefill=0)),
+    Benchmark("should_send.throttled_table_100k", "as throttled, with 100k stale entries in the table", _should_send(users=200, prefill=100_000)),
+    Benchmark("submit_advertisement.gym_mix", "AttendancePipeline.submit_advertisement end to end (dry-run sink)", _submit_advertisement),
+    Benchmark("jsonl_log.append", "JsonlLogger.log without rotation", _jsonl_log(max_bytes=1_000_000_000)),
+    Benchmark("jsonl_log.rotating", "JsonlLogger.log rotating every ~100 kB (3 backups)", _jsonl_log(max_bytes=100_000)),
+    Benchmark("binary_log.append", "BinaryEventLogger.log without rotation", _jsonl_log(max_bytes=1_000_000_000, log_format="binary")),
+    Benchmark("binary_log.rotating", "BinaryEventLogger.log rotating every ~100 kB (3 backups)", _jsonl_log(max_bytes=100_000, log_format="binary")),
+    Benchmark("dashboard.snapshot", "take_dashboard_snapshot with 500 present members", _dashboard_snapshot),
+    Benchmark("dashboard.render", "render_dashboard + Rich console print", _render_dashboard),
+]
+
+
+# Running.
+
+
+def run_benchmark(bench: Benchmark, repeats: int, scale: float, seed: int) -> dict:
+    samples: List[float] = []
+    for repeat in range(repeats + 1):
+        run, ops = bench.setup(random.Random(seed + repeat), scale)
+        gc.collect()
+        started = time.perf_counter_ns()
+        run()
+        elapsed = time.perf_counter_ns() - started
+        if repeat:  # the first pass warms caches and is discarded
+            samples.append(elapsed / ops)
+    quartiles = statistics.quantiles(samples, n=4) if len(samples) > 1 else [samples[0]] * 3
+    return {
+        "description": bench.description,
+        "unit": "ns/op",
+        "ops": ops,
+        "median": round(statistics.median(samples), 2),
+        "iqr": round(quartiles[2] - quartiles[0], 2),
+        "samples": [round(s, 2) for s in samples],
+    }
+
+
+def _git_commit() -> Optional[str]:
+    import subprocess
+
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).resolve().parent,
+            capture_output=True,
+            text=True,
+            timeout=5,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def run_suite(names: List[str], repeats: int, scale: float, seed: int, progress=None) -> dict:
+    results: Dict[str, dict] = {}
+    for bench in BENCHMARKS:
+        if names and not any(bench.name.startswith(name) for name in names):
+            continue
+        try:
+            results[bench.name] = run_benchmark(bench, repeats, scale, seed)
+        except ImportError as e:
+            results[bench.name] = {"description": bench.description, "skipped": f"missing dependency: {e.name}"}
+        if progress is not None:
+            progress(bench.name, results[bench.name])
+    return {
+        "version": BASELINE_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "repeats": repeats,
+        "scale": scale,
+        "seed": seed,
+        "benchmarks": results,
+    }
+
+
+# Comparing.
+
+
+def mann_whitney_p(a: List[float], b: List[float]) -> float:
+    """Two-sided Mann-Whitney U p-value (normal approximation with tie correction)."""
+    n1, n2 = len(a), len(b)
+    if n1 < 2 or n2 < 2:
+        return 1.0
+    combined = sorted([(v, 0) for v in a] + [(v, 1) for v in b])
+    ranks = [0.0] * len(combined)
+    tie_term = 0.0
+    i = 0
+    while i < len(combined):
+        j = i
+        while j + 1 < len(combined) and combined[j + 1][0] == combined[i][0]:
+            j += 1
+        rank = (i + j) / 2.0 + 1.0
+        for k in range(i, j + 1):
+            ranks[k] = rank
+        t = j - i + 1
+        tie_term += t**3 - t
+        i = j + 1
+    r1 = sum(rank for rank, (_v, group) in zip(ranks, combined) if group == 0)
+    u1 = r1 - n1 * (n1 + 1) / 2.0
+    n = n1 + n2
+    sigma = math.sqrt(n1 * n2 / 12.0 * ((n + 1) - tie_term / (n * (n - 1))))
+    if sigma == 0:
+        return 1.0
+    z = (abs(u1 - n1 * n2 / 2.0) - 0.5) / sigma
+    return math.erfc(max(0.0, z) / math.sqrt(2.0))
+
+
+def compare(base: dict, new: dict, threshold: float, alpha: float) -> List[dict]:
+    rows = []
+    for name, after in new["benchmarks"].items():
+        before = base["benchmarks"].get(name)
+        if before is None or "skipped" in before or "skipped" in after:
+            rows.append({"name": name, "verdict": "skipped" if before is not None else "new"})
+            continue
+        change = after["median"] / before["median"] - 1.0 if before["median"] else 0.0
+        p = mann_whitney_p(before["samples"], after["samples"])
+        verdict = "~"
+        if p < alpha and change > threshold:
+            verdict = "REGRESSION"
+        elif p < alpha and change < -threshold:
+            verdict = "faster"
+        rows.append(
+            {"name": name, "before": before["median"], "after": after["median"], "change": change, "p": p, "verdict": verdict}
+        )
+    return rows
+
+
+def _load(path: Path) -> dict:
+    data = json.loads(path.read_text(encoding="utf-8"))
+    if data.get("version") != BASELINE_VERSION:
+        raise SystemExit(f"{path}: unsupported baseline version {data.get('version')!r}")
+    return data
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Scanner hot-path microbenchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_p = sub.add_parser("run", help="Run benchmarks and optionally save a JSON baseline")
+    run_p.add_argument("names", nargs="*", help="Only run benchmarks whose name starts with one of these")
+    run_p.add_argument("--out", help="Write results to this JSON file")
+    run_p.add_argument("--repeats", type=int, default=15, help="Timed repeats per benchmark (default: %(default)s)")
+    run_p.add_argument("--scale", type=float, default=1.0, help="Multiply batch sizes, e.g. 0.1 for a quick run (default: %(default)s)")
+    run_p.add_argument("--seed", type=int, default=1, help="Input generator seed (default: %(default)s)")
+    run_p.add_argument("--list", action="store_true", help="List benchmarks and exit")
+
+    cmp_p = sub.add_parser("compare", help="Compare two result files; exit 1 on significant slowdowns")
+    cmp_p.add_argument("baseline", help="Baseline JSON (from `run --out`)")
+    cmp_p.add_argument("candidate", help="JSON to check against the baseline")
+    cmp_p.add_argument("--threshold", type=float, default=0.05, help="Minimum median slowdown to flag (default: %(default)s = 5%%)")
+    cmp_p.add_argument("--alpha", type=float, default=0.05, help="Significance level (default: %(default)s)")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        if args.list:
+            for bench in BENCHMARKS:
+                print(f"{bench.name:<36} {bench.description}")
+            return 0
+
+        def progress(name: str, result: dict) -> None:
+            if "skipped" in result:
+                print(f"{name:<36} skipped ({result['skipped']})", flush=True)
+            else:
+                print(f"{name:<36} {result['median']:>12,.1f} ns/op  ±{result['iqr']:,.1f} (IQR)", flush=True)
+
+        report = run_suite(args.names, max(2, args.repeats), args.scale, args.seed, progress)
+        if args.out:
+            out = Path(args.out).expanduser()
+            out.parent.mkdir(parents=True, exist_ok=True)
+            out.write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+            print(f"Wrote {out}")
+        return 0
+
+    base, new = _load(Path(args.baseline).expanduser()), _load(Path(args.candidate).expanduser())
+    for key in ("python", "machine", "scale"):
+        if base.get(key) != new.get(key):
+            print(f"warning: {key} differs ({base.get(key)} vs {new.get(key)}); numbers may not be comparable")
+    rows = compare(base, new, args.threshold, args.alpha)
+    for row in rows:
+        if "change" not in row:
+            print(f"{row['name']:<36} {row['verdict']}")
+            continue
+        print(
+            f"{row['name']:<36} {row['before']:>12,.1f} -> {row['after']:>12,.1f} ns/op "
+            f"{row['change'] * 100:+7.1f}%  p={row['p']:.4f}  {row['verdict']}"
+        )
+    regressions = [row for row in rows if row["verdict"] == "REGRESSION"]
+    if regressions:
+        print(f"\n{len(regressions)} significant regression(s) (> {args.threshold * 100:.0f}%, p < {args.alpha})")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    except KeyboardInterrupt:
+        sys.exit(130)
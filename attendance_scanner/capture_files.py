@@ -0,0 +1,398 @@
+"""Offline advertisement sources for the scanner pipeline.
+
+These feed recorded radio traffic into AttendancePipeline (scanner.py) through
+the same submit_advertisement() path live BLE uses, so incidents can be
+replayed and throughput measured on any box without a Bluetooth adapter.
+AdvertisementRecorder writes the compact recordings RecordingSource replays.
+"""
+
+import asyncio
+import mmap
+import os
+import struct
+import time
+import uuid
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, Optional, Tuple
+
+
+# btsnoop: https://www.fte.com/webhelp/bpa600/Content/Technical_Information/BT_Snoop_File_Format.htm
+BTSNOOP_MAGIC = b"btsnoop\x00"
+BTSNOOP_DATALINK_HCI = 1001  # un-encapsulated HCI (hcidump --btsnoop)
+BTSNOOP_DATALINK_H4 = 1002  # HCI UART, first byte is the packet indicator
+BTSNOOP_DATALINK_MONITOR = 2001  # Linux monitor channel (btmon -w)
+
+# Microseconds between 0000-01-01 (btsnoop epoch) and 1970-01-01.
+_BTSNOOP_EPOCH_DELTA_US = 0x00DCDDB30F2F8000
+
+_H4_EVENT = 0x04
+_MONITOR_OPCODE_EVENT = 0x0003
+
+_HCI_EVT_LE_META = 0x3E
+_LE_ADVERTISING_REPORT = 0x02
+_LE_EXTENDED_ADVERTISING_REPORT = 0x0D
+
+_AD_MANUFACTURER_SPECIFIC = 0xFF
+
+_FILE_HEADER = struct.Struct(">8sII")
+_RECORD_HEADER = struct.Struct(">IIIIq")
+_EXT_REPORT = struct.Struct("<HB6sBBBbbHB6sB")
+
+
+def _format_address(addr: bytes) -> str:
+    # HCI carries BD_ADDR little endian.
+    return ":".join(f"{b:02X}" for b in reversed(addr))
+
+
+def parse_ad_structures(data: bytes) -> Dict[int, bytes]:
+    """Extract {company_id: payload} from raw AD structures (like Bleak's manufacturer_data)."""
+    manufacturer_data: Dict[int, bytes] = {}
+    offset = 0
+    end = len(data)
+    while offset < end:
+        length = data[offset]
+        if length == 0 or offset + 1 + length > end:
+            break
+        ad_type = data[offset + 1]
+        if ad_type == _AD_MANUFACTURER_SPECIFIC and length >= 3:
+            company_id = data[offset + 2] | (data[offset + 3] << 8)
+            manufacturer_data[company_id] = bytes(data[offset + 4 : offset + 1 + length])
+        offset += 1 + length
+    return manufacturer_data
+
+
+def iter_le_advertising_reports(event: bytes) -> Iterator[Tuple[str, int, bytes]]:
+    """Yield (address, rssi, ad_data) from one HCI event packet (event code first)."""
+    if len(event) < 3 or event[0] != _HCI_EVT_LE_META:
+        return
+    params = event[2 : 2 + event[1]]
+    if not params:
+        return
+
+    subevent = params[0]
+    if subevent == _LE_ADVERTISING_REPORT:
+        yield from _iter_legacy_reports(params)
+    elif subevent == _LE_EXTENDED_ADVERTISING_REPORT:
+        yield from _iter_extended_reports(params)
+
+
+def _iter_legacy_reports(params: bytes) -> Iterator[Tuple[str, int, bytes]]:
+    # Fields are laid out as arrays: event_type[n], addr_type[n], addr[n], len[n], data[...], rssi[n].
+    if len(params) < 2:
+        return
+    n = params[1]
+    offset = 2
+    offset += n  # event types
+    offset += n  # address types
+    addrs = [params[offset + 6 * i : offset + 6 * (i + 1)] for i in range(n)]
+    offset += 6 * n
+    lengths = list(params[offset : offset + n])
+    offset += n
+    datas = []
+    for length in lengths:
+        datas.append(params[offset : offset + length])
+        offset += length
+    rssis = params[offset : offset + n]
+    if len(rssis) < n or any(len(a) < 6 for a in addrs):
+        return
+    for i in range(n):
+        rssi = rssis[i] - 256 if rssis[i] > 127 else rssis[i]
+        yield _format_address(addrs[i]), rssi, bytes(datas[i])
+
+
+def _iter_extended_reports(params: bytes) -> Iterator[Tuple[str, int, bytes]]:
+    if len(params) < 2:
+        return
+    n = params[1]
+    offset = 2
+    for _ in range(n):
+        if offset + _EXT_REPORT.size > len(params):
+            return
+        (
+            _event_type,
+            _addr_type,
+            addr,
+            _primary_phy,
+            _secondary_phy,
+            _sid,
+            _tx_power,
+            rssi,
+            _interval,
+            _direct_addr_type,
+            _direct_addr,
+            length,
+        ) = _EXT_REPORT.unpack_from(params, offset)
+        offset += _EXT_REPORT.size
+        data = params[offset : offset + length]
+        offset += length
+        yield _format_address(addr), rssi, bytes(data)
+
+
+def iter_btsnoop_events(f: BinaryIO) -> Iterator[Tuple[float, bytes]]:
+    """Stream (unix_ts, hci_event) pairs from an open btsnoop file.
+
+    Supports un-encapsulated HCI (1001), H4 (1002) and the Linux monitor
+    format written by `btmon -w` (2001). Non-event packets are skipped.
+    """
+    header = f.read(_FILE_HEADER.size)
+    if len(header) < _FILE_HEADER.size:
+        raise ValueError("not a btsnoop file (truncated header)")
+    magic, version, datalink = _FILE_HEADER.unpack(header)
+    if magic != BTSNOOP_MAGIC or version != 1:
+        raise ValueError("not a btsnoop v1 file")
+    if datalink not in (BTSNOOP_DATALINK_HCI, BTSNOOP_DATALINK_H4, BTSNOOP_DATALINK_MONITOR):
+        raise ValueError(f"unsupported btsnoop datalink type {datalink}")
+
+    while True:
+        raw = f.read(_RECORD_HEADER.size)
+        if len(raw) < _RECORD_HEADER.size:
+            return
+        _orig_len, incl_len, flags, _drops, ts_us = _RECORD_HEADER.unpack(raw)
+        packet = f.read(incl_len)
+        if len(packet) < incl_len:
+            return
+
+        if datalink == BTSNOOP_DATALINK_H4:
+            if not packet or packet[0] != _H4_EVENT:
+                continue
+            event = packet[1:]
+        elif datalink == BTSNOOP_DATALINK_HCI:
+            # bit 1 set = command/event, bit 0 set = received: both means HCI event.
+            if flags & 0x03 != 0x03:
+                continue
+            event = packet
+        else:
+            if flags & 0xFFFF != _MONITOR_OPCODE_EVENT:
+                continue
+            event = packet
+
+        yield (ts_us - _BTSNOOP_EPOCH_DELTA_US) / 1_000_000.0, event
+
+
+class _Pacer:
+    """Replays timestamps at `speed`x wall clock (0 or less = as fast as possible)."""
+
+    def __init__(self, speed: float) -> None:
+        self.speed = float(speed)
+        self._first_ts: Optional[float] = None
+        self._started = 0.0
+        self._since_yield = 0
+
+    async def wait_for(self, ts: float) -> None:
+        if self.speed <= 0:
+            # Let verify workers and the UI run now and then.
+            self._since_yield += 1
+            if self._since_yield >= 256:
+                self._since_yield = 0
+                await asyncio.sleep(0)
+            return
+
+        now = time.monotonic()
+        if self._first_ts is None:
+            self._first_ts = ts
+            self._started = now
+        delay = self._started + (ts - self._first_ts) / self.speed - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class BtsnoopSource:
+    """Advertisement source that streams LE advertising reports out of a btsnoop capture."""
+
+    def __init__(self, path, speed: float = 1.0) -> None:
+        self.path = path
+        self.speed = float(speed)
+        self.events = 0
+        self.reports = 0
+
+    async def run(self, pipeline) -> None:
+        pacer = _Pacer(self.speed)
+        with open(self.path, "rb") as f:
+            for ts, event in iter_btsnoop_events(f):
+                self.events += 1
+                for address, rssi, ad_data in iter_le_advertising_reports(event):
+                    self.reports += 1
+                    await pacer.wait_for(ts)
+                    pipeline.submit_advertisement(address, rssi, parse_ad_structures(ad_data))
+
+
+# Advertisement recordings (--record / --replay): a 64-byte header followed by
+# fixed 64-byte records, append-only. Fixed records keep replay a plain mmap
+# walk (record i lives at HEADER + i * 64) and a crash loses at most the tail.
+RECORDING_MAGIC = b"LCAR"
+RECORDING_VERSION = 1
+RECORDING_PAYLOAD_MAX = 32  # legacy AD is 31 bytes; iBeacon payloads are 23
+
+RECORD_ADDR_MAC = 0x00  # first 6 bytes are a BD_ADDR (BlueZ / Windows)
+RECORD_ADDR_UUID = 0x01  # 16-byte CoreBluetooth identifier (macOS)
+RECORD_ADDR_TEXT = 0x02  # anything else, utf-8, cut to 16 bytes
+RECORD_CONTINUES = 0x40  # the next record is another manufacturer entry of the same advertisement
+RECORD_TRUNCATED = 0x80  # payload was longer than RECORDING_PAYLOAD_MAX
+
+_RECORDING_HEADER = struct.Struct("<4sHHd48x")
+# captured_at, address, rssi, flags, payload_len, pad, company_id | payload
+_RECORD_FIXED = struct.Struct("<d16sbBBxH")
+_RECORD = struct.Struct(_RECORD_FIXED.format + f"{RECORDING_PAYLOAD_MAX}s2x")
+_RECORD_HEAD = struct.Struct("<d16s")
+
+
+def _encode_address(address: str) -> Tuple[bytes, int]:
+    if len(address) == 17 and address.count(":") == 5:
+        try:
+            return bytes.fromhex(address.replace(":", "")), RECORD_ADDR_MAC
+        except ValueError:
+            pass
+    try:
+        return uuid.UUID(address).bytes, RECORD_ADDR_UUID
+    except ValueError:
+        return address.encode("utf-8")[:16], RECORD_ADDR_TEXT
+
+
+def _decode_address(raw: bytes, flags: int) -> str:
+    kind = flags & 0x0F
+    if kind == RECORD_ADDR_MAC:
+        return ":".join(f"{b:02X}" for b in raw[:6])
+    if kind == RECORD_ADDR_UUID:
+        return str(uuid.UUID(bytes=raw)).upper()
+    return raw.rstrip(b"\x00").decode("utf-8", "replace")
+
+
+class AdvertisementRecorder:
+    """Append every raw advertisement the pipeline sees to a fixed-record file.
+
+    One record per manufacturer data entry; all but the last entry of an
+    advertisement carry RECORD_CONTINUES so replay can rebuild the whole
+    manufacturer_data dict. Writes are buffered and flushed
+    at most every `flush_interval` seconds, so recording stays cheap enough to
+    call from the Bleak callback.
+    """
+
+    def __init__(self, path, flush_interval: float = 1.0) -> None:
+        self.path = Path(path)
+        self.flush_interval = float(flush_interval)
+        self.records = 0
+        self.truncated = 0
+        self._last_flush = time.monotonic()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._f = open(self.path, "a+b", buffering=1 << 16)
+        self._f.seek(0, os.SEEK_END)
+        size = self._f.tell()
+        if size == 0:
+            self._f.write(_RECORDING_HEADER.pack(RECORDING_MAGIC, RECORDING_VERSION, _RECORD.size, time.time()))
+            self._f.flush()
+        else:
+            self._f.seek(0)
+            _read_recording_header(self._f.read(_RECORDING_HEADER.size))
+            # Drop a torn record left by a crash so new records stay aligned.
+            whole = _RECORDING_HEADER.size + (size - _RECORDING_HEADER.size) // _RECORD.size * _RECORD.size
+            if whole != size:
+                self._f.truncate(whole)
+            self._f.seek(0, os.SEEK_END)
+
+    def record(self, address: str, rssi: int, manufacturer_data, captured_at: Optional[float] = None) -> None:
+        if not manufacturer_data:
+            return
+        ts = time.time() if captured_at is None else captured_at
+        raw_addr, flags = _encode_address(address)
+        rssi = max(-128, min(127, int(rssi)))
+        last = len(manufacturer_data) - 1
+        for i, (company_id, payload) in enumerate(manufacturer_data.items()):
+            payload = bytes(payload)
+            rec_flags = flags if i == last else flags | RECORD_CONTINUES
+            if len(payload) > RECORDING_PAYLOAD_MAX:
+                rec_flags |= RECORD_TRUNCATED
+                self.truncated += 1
+            self._f.write(
+                _RECORD.pack(
+                    ts,
+                    raw_addr,
+                    rssi,
+                    rec_flags,
+                    min(len(payload), RECORDING_PAYLOAD_MAX),
+                    company_id & 0xFFFF,
+                    payload,
+                )
+            )
+            self.records += 1
+
+        now = time.monotonic()
+        if now - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        self._f.flush()
+        self._last_flush = time.monotonic()
+
+    def close(self) -> None:
+        if not self._f.closed:
+            self._f.flush()
+            self._f.close()
+
+
+def _read_recording_header(header: bytes) -> float:
+    if len(header) < _RECORDING_HEADER.size:
+        raise ValueError("not an advertisement recording (truncated header)")
+    magic, version, record_size, created_at = _RECORDING_HEADER.unpack(header)
+    if magic != RECORDING_MAGIC:
+        raise ValueError("not an advertisement recording")
+    if version != RECORDING_VERSION or record_size != _RECORD.size:
+        raise ValueError(f"unsupported recording version {version} (record size {record_size})")
+    return created_at
+
+
+class RecordingSource:
+    """Advertisement source that replays a --record file straight out of an mmap.
+
+    Records chained with RECORD_CONTINUES are submitted together as one
+    advertisement. Payloads are handed to the pipeline as memoryview slices of
+    the mapping, so the source itself copies nothing per record (parsing
+    still takes one bytes() copy of each payload it inspects).
+    """
+
+    def __init__(self, path, speed: float = 1.0) -> None:
+        self.path = path
+        self.speed = float(speed)
+        self.records = 0
+        self.advertisements = 0
+
+    async def run(self, pipeline) -> None:
+        pacer = _Pacer(self.speed)
+        addresses: Dict[Tuple[bytes, int], str] = {}
+        with open(self.path, "rb") as f:
+            _read_recording_header(f.read(_RECORDING_HEADER.size))
+            size = os.fstat(f.fileno()).st_size
+            count = (size - _RECORDING_HEADER.size) // _RECORD.size
+            if count <= 0:
+                return
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(mm)
+            try:
+                offset = _RECORDING_HEADER.size
+                payload_at = _RECORD_FIXED.size
+                manufacturer_data: Dict[int, memoryview] = {}
+                for i in range(count):
+                    ts, raw_addr, rssi, flags, length, company_id = _RECORD_FIXED.unpack_from(view, offset)
+                    manufacturer_data[company_id] = view[offset + payload_at : offset + payload_at + length]
+                    offset += _RECORD.size
+                    self.records += 1
+                    # Entries of one advertisement share its timestamp and address; a chain cut short
+                    # by a crash (end of file, or a resumed recording) is replayed as far as it got.
+                    if flags & RECORD_CONTINUES and i + 1 < count:
+                        next_ts, next_addr = _RECORD_HEAD.unpack_from(view, offset)
+                        if next_ts == ts and next_addr == raw_addr:
+                            continue
+
+                    key = (raw_addr, flags & 0x0F)
+                    address = addresses.get(key)
+                    if address is None:
+                        address = addresses[key] = _decode_address(raw_addr, flags)
+                    self.advertisements += 1
+                    await pacer.wait_for(ts)
+                    pipeline.submit_advertisement(address, rssi, manufacturer_data)
+                    for payload in manufacturer_data.values():
+                        payload.release()
+                    manufacturer_data = {}
+            finally:
+                view.release()
+                mm.close()
@@ -0,0 +1,760 @@
+#!/usr/bin/env python3
+"""Headless attendance scanner for unattended installs (systemd).
+
+Same pipeline as scanner.py, without Rich, prompts or the dashboard: config
+comes only from the environment and an optional KEY=VALUE file (the format
+systemd's EnvironmentFile= uses), events go to journald as structured
+fields, and readiness/watchdog are reported over sd_notify. See
+systemd/liftco-scanner.service for an example unit.
+
+  python3 attendance_scanner/daemon.py --config /etc/liftco/scanner.env
+  python3 attendance_scanner/daemon.py --footprint   # import time / RSS vs scanner.py
+"""
+
+import time
+
+_IMPORT_STARTED = time.perf_counter()
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import signal
+import socket
+import struct
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from scanner import (
+    DEFAULT_GOSSIP_GROUP,
+    DEFAULT_GOSSIP_PORT,
+    DEFAULT_SUPABASE_URL,
+    LIVE_SETTINGS,
+    LOAD_LEVELS,
+    LOG_DEFER_SECONDS,
+    LOG_FORMATS,
+    SCAN_FILTER_MODES,
+    AttendanceGateway,
+    AttendancePipeline,
+    BleakAdvertisementSource,
+    ConfigError,
+    ConfigWatcher,
+    FairVerifyQueue,
+    GatewayStateStore,
+    HeartbeatReporter,
+    GatewayVerifySink,
+    JsonlLogger,
+    LiveConfig,
+    LoopLagMonitor,
+    RingFrameSource,
+    ScannerGossip,
+    _safe_filename,
+    open_event_logger,
+    open_multicast_gossip,
+    profiling_gauges,
+    read_env_file,
+)
+from profiling import PROFILE_MODES, ProfilingHooks
+
+IMPORT_MS = (time.perf_counter() - _IMPORT_STARTED) * 1000.0
+
+
+# Exit codes: 2 = bad config/credentials (don't restart), 1 = transient failure.
+EXIT_CONFIG = 2
+EXIT_FAILURE = 1
+
+JOURNAL_SOCKET = "/run/systemd/journal/socket"
+SYSLOG_IDENTIFIER = "liftco-scanner"
+
+_JOURNAL_FIELD_RE = re.compile(r"[^A-Z0-9_]")
+
+
+@dataclass
+class DaemonConfig:
+    supabase_url: str
+    gym_id: int
+    scanner_id: str
+    scanner_key: str
+    adapter: Optional[str]
+    scan_filter: str
+    stall_seconds: float
+    min_rssi: int
+    strict_apple_id: bool
+    http_timeout: float
+    http_retries: int
+    verify_rps: float
+    verify_burst: float
+    per_user_pending: int
+    hedge_budget: float
+    hedge_percentile: float
+    hedge_min_ms: float
+    log_path: Optional[Path]
+    log_format: str
+    log_max_bytes: int
+    log_backups: int
+    state_path: Optional[Path]
+    state_interval: float
+    gossip: bool
+    gossip_group: str
+    gossip_port: int
+    gossip_secret: Optional[str]
+    split_process: bool
+    ring_capacity: int
+    stats_interval: float
+    profiling: bool
+    profile_dir: Path
+    profile_mode: str
+    profile_max_seconds: float
+    profile_max_bytes: int
+    heartbeat_seconds: float
+    heartbeat_idle_seconds: float
+    heartbeat_spool_path: Path
+    config_poll_seconds: float
+    load_shedding: bool
+    loop_lag_degrade_ms: float
+    loop_lag_shed_ms: float
+    loop_lag_recover_seconds: float
+
+    @classmethod
+    def from_env(cls, env: Dict[str, str]) -> "DaemonConfig":
+        def get(name: str, default: Optional[str] = None) -> Optional[str]:
+            value = env.get(name)
+            return value.strip() if value is not None and value.strip() != "" else default
+
+        def number(name: str, default: str, kind=float):
+            raw = get(name, default)
+            try:
+                return kind(raw)
+            except ValueError:
+                raise ConfigError(f"{name} must be a number, got {raw!r}") from None
+
+        def flag(name: str, default: str = "0") -> bool:
+            return get(name, default).lower() in ("1", "true", "yes", "on")
+
+        supabase_url = get("SUPABASE_URL", DEFAULT_SUPABASE_URL)
+        if not supabase_url.startswith("https://"):
+            raise ConfigError(f"SUPABASE_URL should start with https:// (got {supabase_url!r})")
+        if get("ATTENDANCE_GYM_ID") is None:
+            raise ConfigError("ATTENDANCE_GYM_ID is required")
+        scanner_key = get("ATTENDANCE_SCANNER_KEY")
+        if not scanner_key:
+            raise ConfigError("ATTENDANCE_SCANNER_KEY is required")
+
+        scan_filter = get("ATTENDANCE_SCAN_FILTER", "off")
+        if scan_filter not in SCAN_FILTER_MODES:
+            raise ConfigError(f"ATTENDANCE_SCAN_FILTER must be one of {', '.join(SCAN_FILTER_MODES)}")
+
+        gym_id = number("ATTENDANCE_GYM_ID", "0", int)
+        scanner_id = get("ATTENDANCE_SCANNER_ID", "laptop-1")
+        default_name = f"scanner_gym{gym_id}_{_safe_filename(scanner_id)}"
+        base = Path.home() / ".liftco" / "attendance_scanner"
+
+        log_format = get("ATTENDANCE_SCANNER_LOG_FORMAT", "jsonl")
+        if log_format not in LOG_FORMATS:
+            raise ConfigError(f"ATTENDANCE_SCANNER_LOG_FORMAT must be one of {', '.join(LOG_FORMATS)}")
+        log_raw = get("ATTENDANCE_SCANNER_LOG_PATH")
+        if flag("ATTENDANCE_DAEMON_FILE_LOG", "1"):
+            suffix = ".lcev" if log_format == "binary" else ".jsonl"
+            log_path = Path(log_raw).expanduser() if log_raw else base / "logs" / f"{default_name}{suffix}"
+        else:
+            log_path = None
+
+        profile_mode = get("ATTENDANCE_PROFILE_MODE", "sample")
+        if profile_mode not in PROFILE_MODES:
+            raise ConfigError(f"ATTENDANCE_PROFILE_MODE must be one of {', '.join(PROFILE_MODES)}")
+
+        state_raw = get("ATTENDANCE_SCANNER_STATE_PATH")
+        if flag("ATTENDANCE_SCANNER_STATE", "1"):
+            state_path = Path(state_raw).expanduser() if state_raw else base / "state" / f"{default_name}.state"
+        else:
+            state_path = None
+
+        return cls(
+            supabase_url=supabase_url,
+            gym_id=gym_id,
+            scanner_id=scanner_id,
+            scanner_key=scanner_key,
+            adapter=get("ATTENDANCE_BLE_ADAPTER"),
+            scan_filter=scan_filter,
+            stall_seconds=number("ATTENDANCE_STALL_SECONDS", "30"),
+            min_rssi=number("ATTENDANCE_MIN_RSSI", "-85", int),
+            strict_apple_id=flag("ATTENDANCE_STRICT_APPLE_ID"),
+            http_timeout=number("ATTENDANCE_HTTP_TIMEOUT_SECONDS", "12"),
+            http_retries=number("ATTENDANCE_HTTP_RETRIES", "3", int),
+            verify_rps=number("ATTENDANCE_VERIFY_RPS", "10"),
+            verify_burst=number("ATTENDANCE_VERIFY_BURST", "20"),
+            per_user_pending=number("ATTENDANCE_VERIFY_PER_USER_PENDING", "4", int),
+            hedge_budget=number("ATTENDANCE_VERIFY_HEDGE_BUDGET", "0.1"),
+            hedge_percentile=number("ATTENDANCE_VERIFY_HEDGE_PERCENTILE", "95"),
+            hedge_min_ms=number("ATTENDANCE_VERIFY_HEDGE_MIN_MS", "250"),
+            log_path=log_path,
+            log_format=log_format,
+            log_max_bytes=number("ATTENDANCE_SCANNER_LOG_MAX_BYTES", "5000000", int),
+            log_backups=number("ATTENDANCE_SCANNER_LOG_BACKUPS", "3", int),
+            state_path=state_path,
+            state_interval=number("ATTENDANCE_SCANNER_STATE_INTERVAL_SECONDS", "15"),
+            gossip=flag("ATTENDANCE_GOSSIP"),
+            gossip_group=get("ATTENDANCE_GOSSIP_GROUP", DEFAULT_GOSSIP_GROUP),
+            gossip_port=number("ATTENDANCE_GOSSIP_PORT", str(DEFAULT_GOSSIP_PORT), int),
+            gossip_secret=get("ATTENDANCE_GOSSIP_SECRET"),
+            split_process=flag("ATTENDANCE_SPLIT_PROCESS"),
+            ring_capacity=number("ATTENDANCE_RING_CAPACITY", "4096", int),
+            stats_interval=number("ATTENDANCE_DAEMON_STATS_SECONDS", "60"),
+            profiling=flag("ATTENDANCE_PROFILING"),
+            profile_dir=(log_path.parent if log_path is not None else base / "logs") / "profiles",
+            heartbeat_seconds=number("ATTENDANCE_HEARTBEAT_SECONDS", "60"),
+            heartbeat_idle_seconds=number("ATTENDANCE_HEARTBEAT_IDLE_SECONDS", "600"),
+            heartbeat_spool_path=(log_path.parent if log_path is not None else base / "logs")
+            / f"{default_name}.heartbeats.gz",
+            profile_mode=profile_mode,
+            profile_max_seconds=number("ATTENDANCE_PROFILE_MAX_SECONDS", "120"),
+            profile_max_bytes=number("ATTENDANCE_PROFILE_MAX_BYTES", "20000000", int),
+            config_poll_seconds=number("ATTENDANCE_CONFIG_POLL_SECONDS", "2"),
+            load_shedding=flag("ATTENDANCE_LOAD_SHEDDING", "1"),
+            loop_lag_degrade_ms=number("ATTENDANCE_LOOP_LAG_DEGRADE_MS", "50"),
+            loop_lag_shed_ms=number("ATTENDANCE_LOOP_LAG_SHED_MS", "250"),
+            loop_lag_recover_seconds=number("ATTENDANCE_LOOP_LAG_RECOVER_SECONDS", "10"),
+        )
+
+
+def memory_kb() -> Dict[str, int]:
+    """Current and peak resident set size in KiB (Linux /proc, getrusage elsewhere)."""
+    out: Dict[str, int] = {}
+    try:
+        with open("/proc/self/status", "r", encoding="ascii") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    name, value = line.split(":", 1)
+                    out["rss_kb" if name == "VmRSS" else "rss_peak_kb"] = int(value.split()[0])
+    except OSError:
+        import resource
+
+        out["rss_peak_kb"] = int(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+    return out
+
+
+class JournalEventSink:
+    """EventSink sending each event to journald as structured fields.
+
+    Event keys become LIFTCO_<KEY> fields (nested values as JSON) next to a
+    readable MESSAGE, so `journalctl -u liftco-scanner LIFTCO_EVENT=attendance_verified`
+    works. Without a journal socket (not under systemd) events are written to
+    stderr as JSON lines instead. `file_logger` keeps the usual JSONL (or binary) audit log.
+    """
+
+    def __init__(self, file_logger: Optional[JsonlLogger] = None, socket_path: str = JOURNAL_SOCKET) -> None:
+        self.file_logger = file_logger
+        self.socket_path = socket_path
+        self.journal_errors = 0
+        self._sock: Optional[socket.socket] = None
+        if os.path.exists(socket_path):
+            try:
+                self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            except OSError:
+                self._sock = None
+
+    @staticmethod
+    def _field(name: str, value) -> bytes:
+        if not isinstance(value, str):
+            value = json.dumps(value, separators=(",", ":"), default=str)
+        data = value.encode("utf-8")
+        key = name.encode("ascii")
+        if b"\n" in data:
+            # Binary-safe form of the native protocol.
+            return key + b"\n" + struct.pack("<Q", len(data)) + data + b"\n"
+        return key + b"=" + data + b"\n"
+
+    @staticmethod
+    def _priority(event: dict) -> int:
+        if event.get("ok") is False or "error" in event:
+            return 4  # warning
+        return 6  # info
+
+    @staticmethod
+    def _message(event: dict) -> str:
+        name = event.get("event", "event")
+        if name == "attendance_verified":
+            outcome = "OK" if event.get("ok") else f"ERR {event.get('status_code')}"
+            return f"verify {outcome} user={event.get('user_id')} token={event.get('token_u32')} rssi={event.get('rssi')}"
+        details = " ".join(
+            f"{k}={v}" for k, v in event.items() if k != "event" and not isinstance(v, (dict, list))
+        )
+        return f"{name} {details}".strip()
+
+    def log(self, event: dict) -> None:
+        if self.file_logger is not None:
+            self.file_logger.log(event)
+
+        if self._sock is None:
+            sys.stderr.write(json.dumps(event, default=str) + "\n")
+            sys.stderr.flush()
+            return
+
+        parts = [
+            self._field("MESSAGE", self._message(event)),
+            self._field("PRIORITY", str(self._priority(event))),
+            self._field("SYSLOG_IDENTIFIER", SYSLOG_IDENTIFIER),
+        ]
+        for key, value in event.items():
+            if value is None:
+                continue
+            name = "LIFTCO_" + _JOURNAL_FIELD_RE.sub("_", str(key).upper())
+            parts.append(self._field(name, value))
+        try:
+            self._sock.sendto(b"".join(parts), self.socket_path)
+        except OSError:
+            self.journal_errors += 1
+            sys.stderr.write(json.dumps(event, default=str) + "\n")
+
+    def defer(self, seconds: float) -> None:
+        """Batch the file log (see JsonlLogger.defer()); journald takes one datagram per entry, so it isn't held."""
+        if self.file_logger is not None:
+            self.file_logger.defer(seconds)
+
+    def close(self) -> None:
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        if self.file_logger is not None:
+            self.file_logger.close()
+
+
+class SystemdNotifier:
+    """Minimal sd_notify(3): READY/STATUS/WATCHDOG/STOPPING over $NOTIFY_SOCKET."""
+
+    def __init__(self) -> None:
+        address = os.environ.get("NOTIFY_SOCKET", "")
+        if address.startswith("@"):
+            address = "\0" + address[1:]
+        self._address = address or None
+        self._sock: Optional[socket.socket] = None
+        if self._address:
+            try:
+                self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            except OSError:
+                self._sock = None
+
+        self.watchdog_seconds: Optional[float] = None
+        usec = os.environ.get("WATCHDOG_USEC")
+        pid = os.environ.get("WATCHDOG_PID")
+        if usec and (not pid or pid == str(os.getpid())):
+            try:
+                self.watchdog_seconds = int(usec) / 1_000_000.0
+            except ValueError:
+                self.watchdog_seconds = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._sock is not None
+
+    def notify(self, *lines: str) -> bool:
+        if self._sock is None:
+            return False
+        try:
+            self._sock.sendto("\n".join(lines).encode("utf-8"), self._address)
+            return True
+        except OSError:
+            return False
+
+    def close(self) -> None:
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+def _status_line(gateway: AttendanceGateway, queue: FairVerifyQueue) -> str:
+    return (
+        f"adv={gateway.adv_seen} frames={gateway.frames_parsed} "
+        f"verify ok={gateway.requests_ok} err={gateway.requests_err} queue={queue.qsize()}"
+    )
+
+
+async def run_daemon(
+    config: DaemonConfig,
+    events: JournalEventSink,
+    notifier: SystemdNotifier,
+    config_file: Optional[Path] = None,
+    config_values: Optional[Dict[str, str]] = None,
+    config_pinned: Tuple[str, ...] = (),
+) -> int:
+    startup_started = time.perf_counter()
+    gateway = AttendanceGateway(
+        supabase_url=config.supabase_url,
+        gym_id=config.gym_id,
+        scanner_key=config.scanner_key,
+        scanner_id=config.scanner_id,
+        min_rssi=config.min_rssi,
+        http_timeout_seconds=config.http_timeout,
+        http_retries=config.http_retries,
+        hedge_budget=config.hedge_budget,
+        hedge_percentile=config.hedge_percentile,
+        hedge_min_ms=config.hedge_min_ms,
+    )
+
+    notifier.notify("STATUS=Validating scanner credentials")
+    ok = await asyncio.to_thread(gateway.validate_scanner_key)
+    events.log(
+        {
+            "event": "scanner_key_validation",
+            "ok": bool(ok),
+            "gym_id": config.gym_id,
+            "scanner_id": config.scanner_id,
+            "status_code": gateway.last_status_code,
+            "error": gateway.last_err,
+        }
+    )
+    if not ok:
+        # No status code = network trouble: let systemd retry. Anything else won't fix itself.
+        return EXIT_FAILURE if gateway.last_status_code is None else EXIT_CONFIG
+
+    state_store: Optional[GatewayStateStore] = None
+    if config.state_path is not None:
+        state_store = GatewayStateStore(config.state_path)
+        restored = state_store.load(gateway)
+        events.log({"event": "state_restored", "path": str(state_store.path), "throttle_entries": restored})
+
+    gossip_transport = None
+    if config.gossip:
+        gossip = ScannerGossip(config.gym_id, secret=config.gossip_secret, max_ttl_seconds=gateway.throttle_seconds)
+        try:
+            gossip_transport = await open_multicast_gossip(gossip, group=config.gossip_group, port=config.gossip_port)
+            gateway.gossip = gossip
+        except OSError as e:
+            gateway.last_err = f"gossip disabled: {e}"
+        events.log(
+            {
+                "event": "gossip_started",
+                "ok": gateway.gossip is not None,
+                "group": config.gossip_group,
+                "port": config.gossip_port,
+            }
+        )
+
+    queue = FairVerifyQueue(
+        maxsize=256,
+        rate_per_second=config.verify_rps,
+        burst=config.verify_burst,
+        per_user_limit=config.per_user_pending,
+    )
+    pipeline = AttendancePipeline(
+        gateway,
+        verify_sink=GatewayVerifySink(gateway),
+        log_sink=events,
+        queue=queue,
+        strict_apple_id=config.strict_apple_id,
+    )
+    if config.split_process:
+        source = RingFrameSource(
+            adapter=config.adapter,
+            strict_apple_id=config.strict_apple_id,
+            capacity=config.ring_capacity,
+            scan_filter=config.scan_filter,
+            stall_seconds=config.stall_seconds,
+        )
+    else:
+        source = BleakAdvertisementSource(
+            adapter=config.adapter,
+            scan_filter=config.scan_filter,
+            strict_apple_id=config.strict_apple_id,
+            stall_seconds=config.stall_seconds,
+        )
+
+    loop = asyncio.get_running_loop()
+    pipeline_task = asyncio.create_task(pipeline.run(source))
+    stop_reason = {"signal": None}
+
+    def request_stop(signame: str) -> None:
+        stop_reason["signal"] = signame
+        pipeline_task.cancel()
+
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, request_stop, sig.name)
+
+    async def watchdog_worker() -> None:
+        # Pings come from the event loop itself, so a wedged loop gets the unit restarted.
+        interval = max(0.5, notifier.watchdog_seconds / 2.0)
+        while True:
+            await asyncio.sleep(interval)
+            notifier.notify("WATCHDOG=1", f"STATUS=Scanning: {_status_line(gateway, queue)}")
+
+    async def state_worker() -> None:
+        while True:
+            await asyncio.sleep(max(1.0, config.state_interval))
+            try:
+                await state_store.save_async(gateway)
+            except Exception as e:
+                gateway.last_err_at = gateway.clock.time()
+                gateway.last_err = f"state snapshot error: {e}"
+
+    async def stats_worker() -> None:
+        while True:
+            await asyncio.sleep(max(5.0, config.stats_interval))
+            events.log(
+                {
+                    "event": "daemon_stats",
+                    "scan_mode": gateway.scan_mode,
+                    "adv_seen": gateway.adv_seen,
+                    "adv_per_second": round(gateway.adv_rate, 2),
+                    "ibeacon_per_second": round(gateway.ibeacon_rate, 2),
+                    "scanner_stalls": gateway.scanner_stalls,
+                    "scanner_restarts": gateway.scanner_restarts,
+                    "scanner_stalled": gateway.scanner_stalled,
+                    "frames_parsed": gateway.frames_parsed,
+                    "requests_ok": gateway.requests_ok,
+                    "requests_err": gateway.requests_err,
+                    **gateway.hedge_stats(),
+                    "queue_depth": queue.qsize(),
+                    "throttle_entries": len(gateway._last_sent),
+                    "heartbeat_pending": len(heartbeat.pending) if heartbeat is not None else None,
+                    "config_reloads": config_watcher.reloads if config_watcher is not None else None,
+                    "load_level": LOAD_LEVELS[lag_monitor.level],
+                    **lag_monitor.percentiles(),
+                    **memory_kb(),
+                }
+            )
+
+    profiling = None
+    if config.profiling:
+        profiling = ProfilingHooks(
+            config.profile_dir,
+            prefix=f"scanner_gym{config.gym_id}_{_safe_filename(config.scanner_id)}",
+            log=events.log,
+            gauges=lambda: profiling_gauges(gateway, queue),
+            mode=config.profile_mode,
+            max_seconds=config.profile_max_seconds,
+            max_bytes=config.profile_max_bytes,
+        )
+        profiling.install(loop)
+
+    heartbeat = None
+    if config.heartbeat_seconds > 0:
+        heartbeat = HeartbeatReporter(
+            gateway,
+            queue,
+            interval=config.heartbeat_seconds,
+            idle_interval=config.heartbeat_idle_seconds,
+            spool_path=config.heartbeat_spool_path,
+            extra=lambda: {"rss_kb": memory_kb().get("rss_kb")},
+        )
+        spooled = heartbeat.load_spool()
+        if spooled:
+            events.log({"event": "heartbeat_spool_loaded", "rows": spooled})
+
+    config_watcher = None
+    if config_file is not None:
+        config_watcher = ConfigWatcher(
+            config_file,
+            LiveConfig(gateway, pipeline, queue, events.file_logger, source, pinned=config_pinned),
+            events.log,
+            interval=config.config_poll_seconds,
+            initial=config_values,
+        )
+        config_watcher.install(loop)
+
+    # Sheds the discovered-map poll and batches file log writes (never scanning or verifying) while the loop is behind.
+    lag_monitor = LoopLagMonitor(
+        events.log,
+        degrade_ms=config.loop_lag_degrade_ms,
+        shed_ms=config.loop_lag_shed_ms,
+        recover_seconds=config.loop_lag_recover_seconds,
+        shedding=config.load_shedding,
+    )
+    if isinstance(source, BleakAdvertisementSource):
+        lag_monitor.add_action("poll", lambda level: setattr(source, "shed_level", level))
+    lag_monitor.add_action("log_defer", lambda level: events.defer(LOG_DEFER_SECONDS[level]))
+
+    helpers = [asyncio.create_task(stats_worker()), asyncio.create_task(lag_monitor.run())]
+    if config_watcher is not None:
+        helpers.append(asyncio.create_task(config_watcher.run()))
+    if heartbeat is not None:
+        helpers.append(asyncio.create_task(heartbeat.run()))
+    if notifier.watchdog_seconds:
+        helpers.append(asyncio.create_task(watchdog_worker()))
+    if state_store is not None:
+        helpers.append(asyncio.create_task(state_worker()))
+
+    events.log(
+        {
+            "event": "daemon_started",
+            "gym_id": config.gym_id,
+            "scanner_id": config.scanner_id,
+            "adapter": config.adapter,
+            "split_process": config.split_process,
+            "import_ms": round(IMPORT_MS, 1),
+            "startup_ms": round((time.perf_counter() - startup_started) * 1000.0, 1),
+            "watchdog_seconds": notifier.watchdog_seconds,
+            **memory_kb(),
+        }
+    )
+    notifier.notify("READY=1", f"STATUS=Scanning gym {config.gym_id} as {config.scanner_id}")
+
+    exit_code = 0
+    try:
+        await pipeline_task
+    except asyncio.CancelledError:
+        if stop_reason["signal"] is None:
+            raise
+    except Exception as e:
+        # BlueZ gone, adapter unplugged, ...: exit non-zero so systemd restarts us.
+        events.log({"event": "daemon_failed", "error": f"{type(e).__name__}: {e}"})
+        exit_code = EXIT_FAILURE
+    finally:
+        notifier.notify("STOPPING=1", "STATUS=Stopping")
+        for task in helpers:
+            task.cancel()
+        await asyncio.gather(*helpers, return_exceptions=True)
+        if profiling is not None:
+            profiling.close()
+        if config_watcher is not None:
+            config_watcher.close()
+        if heartbeat is not None:
+            heartbeat.sample()
+            heartbeat.save_spool()
+            events.log(
+                {
+                    "event": "heartbeat_stats",
+                    "rows_sent": heartbeat.rows_sent,
+                    "upload_errors": heartbeat.upload_errors,
+                    "rows_dropped": heartbeat.rows_dropped,
+                    "pending": len(heartbeat.pending),
+                }
+            )
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.remove_signal_handler(sig)
+        if gossip_transport is not None:
+            gossip_transport.close()
+        events.log({"event": "pipeline_stats", "stages": pipeline.stats()})
+        loop_stats = {"event": "loop_lag_stats", **lag_monitor.stats()}
+        if isinstance(source, BleakAdvertisementSource):
+            loop_stats["polls_shed"] = source.polls_shed
+        events.log(loop_stats)
+        gateway.close()
+        events.log({"event": "verify_hedge_stats", **gateway.hedge_stats()})
+        if state_store is not None:
+            try:
+                gateway.prune_throttle()
+                size = state_store.save(gateway)
+                events.log({"event": "state_saved", "path": str(state_store.path), "bytes": size})
+            except Exception:
+                pass
+        events.log({"event": "daemon_stopped", "signal": stop_reason["signal"], "exit_code": exit_code})
+    return exit_code
+
+
+_FOOTPRINT_PROBE = """
+import json, sys, time
+sys.path.insert(0, {here!r})
+started = time.perf_counter()
+error = None
+try:
+    for name in {modules!r}:
+        __import__(name)
+except Exception as e:
+    error = f"{{type(e).__name__}}: {{e}}"
+import_ms = (time.perf_counter() - started) * 1000.0
+rss = {{}}
+with open("/proc/self/status") as f:
+    for line in f:
+        if line.startswith(("VmRSS:", "VmHWM:")):
+            rss[line.split(":")[0]] = int(line.split()[1])
+print(json.dumps({{"import_ms": round(import_ms, 1), "rss_kb": rss.get("VmRSS"), "rss_peak_kb": rss.get("VmHWM"), "error": error}}))
+"""
+
+# What each entry point imports before it can scan and verify.
+FOOTPRINT_PROFILES = {
+    "python": [],
+    "daemon": ["daemon", "bleak", "requests"],
+    "interactive": [
+        "scanner",
+        "bleak",
+        "requests",
+        "rich.console",
+        "rich.layout",
+        "rich.live",
+        "rich.panel",
+        "rich.table",
+        "rich.prompt",
+    ],
+}
+
+
+def measure_footprint(repeats: int = 3) -> Dict[str, dict]:
+    """Import time and RSS of each profile in fresh interpreters (best of `repeats`)."""
+    import subprocess
+
+    here = str(Path(__file__).resolve().parent)
+    results: Dict[str, dict] = {}
+    for profile, modules in FOOTPRINT_PROFILES.items():
+        best: Optional[dict] = None
+        for _ in range(max(1, repeats)):
+            proc = subprocess.run(
+                [sys.executable, "-c", _FOOTPRINT_PROBE.format(here=here, modules=modules)],
+                capture_output=True,
+                text=True,
+                check=False,
+            )
+            try:
+                sample = json.loads(proc.stdout.strip().splitlines()[-1])
+            except (IndexError, ValueError):
+                sample = {"error": proc.stderr.strip()[-200:] or f"exit {proc.returncode}"}
+            if best is None or (sample.get("import_ms") or 0) < (best.get("import_ms") or float("inf")):
+                best = sample
+        results[profile] = best or {}
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="LiftCo attendance scanner (headless daemon)")
+    parser.add_argument(
+        "--config",
+        default=os.environ.get("ATTENDANCE_CONFIG"),
+        help="KEY=VALUE file with ATTENDANCE_* settings; real environment variables win. Live settings "
+        "(min RSSI, HTTP timeout/retries, verify rate, log rotation, ...) are re-applied when the file changes or on "
+        "SIGHUP. Env: ATTENDANCE_CONFIG",
+    )
+    parser.add_argument(
+        "--footprint",
+        action="store_true",
+        help="Print import time and RSS for the daemon vs the interactive scanner as JSON, then exit.",
+    )
+    args = parser.parse_args()
+
+    if args.footprint:
+        print(json.dumps(measure_footprint(), indent=2))
+        return 0
+
+    env = dict(os.environ)
+    config_file = Path(args.config).expanduser() if args.config else None
+    config_values: Dict[str, str] = {}
+    try:
+        if config_file is not None:
+            config_values = read_env_file(config_file)
+            for key, value in config_values.items():
+                env.setdefault(key, value)
+        config = DaemonConfig.from_env(env)
+    except (ConfigError, OSError) as e:
+        print(f"liftco-scanner: configuration error: {e}", file=sys.stderr)
+        return EXIT_CONFIG
+
+    file_logger = None
+    if config.log_path is not None:
+        file_logger = open_event_logger(
+            config.log_path, config.log_format, max_bytes=config.log_max_bytes, backups=config.log_backups
+        )
+    events = JournalEventSink(file_logger=file_logger)
+    notifier = SystemdNotifier()
+    try:
+        # systemd's EnvironmentFile= puts the same file into the environment; only
+        # variables that differ from the file override it on reload.
+        pinned = tuple(name for name in LIVE_SETTINGS if name in os.environ and os.environ[name] != config_values.get(name))
+        return asyncio.run(run_daemon(config, events, notifier, config_file, config_values, pinned))
+    finally:
+        notifier.close()
+        events.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""Binary event log: a compact, cheaper-to-write alternative to the JSONL log.
+
+  python3 attendance_scanner/scanner.py --log-format binary    # or ATTENDANCE_SCANNER_LOG_FORMAT=binary
+  python3 attendance_scanner/event_log.py cat ~/.liftco/attendance_scanner/logs/scanner_gym1_front-1.lcev
+  python3 attendance_scanner/event_log.py convert scanner_gym1_front-1.lcev* --out-dir ./jsonl
+  python3 attendance_scanner/event_log.py stats scanner_gym1_front-1.lcev
+
+File: a 16-byte header (magic, version, creation time) followed by records
+
+  u32 length | u32 crc32(body) | body = u8 tag | f64 unix time | payload
+
+all little-endian. attendance_verified events with the usual fields are
+packed into a fixed struct (user_id as 16 raw bytes); every other event is
+compact JSON. The timestamp is stored as a float instead of a formatted
+string. The reader skips records whose CRC doesn't match and re-synchronises
+after a damaged length prefix, and `cat`/`convert` print the same JSON lines
+JsonlLogger would have written.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import struct
+import sys
+import time
+import uuid
+import zlib
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterator, List, Optional, Tuple
+
+EVENT_LOG_MAGIC = b"LCEV"
+EVENT_LOG_VERSION = 1
+EVENT_LOG_SUFFIX = ".lcev"
+
+TAG_JSON = 0
+TAG_VERIFIED = 1
+
+# Anything claiming to be longer is a damaged length prefix.
+MAX_RECORD_BYTES = 1 << 20
+
+# As in scanner.JsonlLogger: a deferring logger writes once this many records are held.
+MAX_DEFERRED_EVENTS = 1000
+
+
+def _call_later(delay: float, callback: Callable[[], None]) -> Optional[asyncio.TimerHandle]:
+    """Schedule `callback` on the running event loop; None when called off the loop (e.g. a worker thread)."""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+    return loop.call_later(delay, callback)
+
+
+_FILE_HEADER = struct.Struct("<4sHxxd")
+_PREFIX = struct.Struct("<II")
+_BODY_HEADER = struct.Struct("<Bd")
+# ok, status_code (-1 = none), gym_id, token_u32, rssi, user_id bytes, scanner_id length
+_VERIFIED = struct.Struct("<?hqIb16sB")
+_U16 = struct.Struct("<H")
+_NO_ERROR = 0xFFFF
+
+_VERIFIED_KEYS = frozenset(("event", "ok", "status_code", "gym_id", "scanner_id", "user_id", "token_u32", "rssi"))
+
+
+def _encode_verified(event: dict) -> Optional[bytes]:
+    """Fixed-layout payload for an attendance_verified event, or None if it wouldn't round-trip exactly."""
+    error = event.get("error")
+    if event.keys() - {"error"} != _VERIFIED_KEYS:
+        return None
+    user_id, status, ok = event["user_id"], event["status_code"], event["ok"]
+    # Only the canonical lowercase form scanner.parse_ibeacon produces is rebuilt byte-for-byte.
+    if not isinstance(user_id, str) or len(user_id) != 36 or user_id != user_id.lower() or ok not in (True, False):
+        return None
+    if error is None and "error" in event:
+        return None
+    try:
+        if status is not None and not 0 <= status < 0x8000:
+            return None
+        scanner_id = event["scanner_id"].encode("utf-8")
+        error_bytes = error.encode("utf-8") if error is not None else b""
+        if len(scanner_id) > 0xFF or len(error_bytes) >= _NO_ERROR:
+            return None
+        return (
+            _VERIFIED.pack(
+                ok,
+                -1 if status is None else status,
+                event["gym_id"],
+                event["token_u32"],
+                event["rssi"],
+                bytes.fromhex(user_id.replace("-", "")),
+                len(scanner_id),
+            )
+            + scanner_id
+            + _U16.pack(_NO_ERROR if error is None else len(error_bytes))
+            + error_bytes
+        )
+    except (struct.error, ValueError, TypeError, AttributeError):
+        return None
+
+
+def encode_event(event: dict, ts: float) -> bytes:
+    """One complete record (length, CRC, body) for `event` logged at unix time `ts`."""
+    payload = _encode_verified(event) if event.get("event") == "attendance_verified" else None
+    if payload is not None:
+        body = _BODY_HEADER.pack(TAG_VERIFIED, ts) + payload
+    else:
+        text = json.dumps(event, separators=(",", ":"), ensure_ascii=False, default=str)
+        body = _BODY_HEADER.pack(TAG_JSON, ts) + text.encode("utf-8")
+    return _PREFIX.pack(len(body), zlib.crc32(body)) + body
+
+
+def decode_event(body: bytes) -> dict:
+    """The event dict for one record body, with `ts` formatted as JsonlLogger writes it."""
+    tag, ts = _BODY_HEADER.unpack_from(body)
+    offset = _BODY_HEADER.size
+    if tag == TAG_VERIFIED:
+        ok, status, gym_id, token_u32, rssi, user, scanner_len = _VERIFIED.unpack_from(body, offset)
+        offset += _VERIFIED.size
+        scanner_id = body[offset : offset + scanner_len].decode("utf-8")
+        offset += scanner_len
+        (error_len,) = _U16.unpack_from(body, offset)
+        offset += _U16.size
+        event = {
+            "event": "attendance_verified",
+            "ok": ok,
+            "status_code": None if status == -1 else status,
+            "gym_id": gym_id,
+            "scanner_id": scanner_id,
+            "user_id": str(uuid.UUID(bytes=user)),
+            "token_u32": token_u32,
+            "rssi": rssi,
+        }
+        if error_len != _NO_ERROR:
+            event["error"] = body[offset : offset + error_len].decode("utf-8")
+    elif tag == TAG_JSON:
+        event = json.loads(body[offset:])
+    else:
+        event = {"event": "unknown_record", "tag": tag}
+    event.setdefault("ts", time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(ts)))
+    return event
+
+
+def _rotate_files(path: Path, backups: int) -> None:
+    """path -> path.1, path.1 -> path.2, ... dropping the oldest (JsonlLogger's scheme)."""
+    for idx in range(backups, 0, -1):
+        src = path.with_suffix(path.suffix + f".{idx}")
+        if not src.exists():
+            continue
+        try:
+            if idx == backups:
+                src.unlink()
+            else:
+                src.rename(path.with_suffix(path.suffix + f".{idx + 1}"))
+        except OSError:
+            pass
+    try:
+        path.rename(path.with_suffix(path.suffix + ".1"))
+    except OSError:
+        # If rename fails, just keep appending.
+        pass
+
+
+class BinaryEventLogger:
+    """Drop-in for JsonlLogger (log(), max_bytes, backups, same rotation) writing binary records.
+
+    The file stays open and each record is one unbuffered write(), so nothing
+    is re-opened or stat()ed per event and a crash loses at most the record
+    being written; the reader detects and skips that torn record. defer()
+    batches records into one write while the scanner is shedding load.
+    """
+
+    def __init__(self, path: Path, max_bytes: int = 5_000_000, backups: int = 3) -> None:
+        self.path = path
+        self.max_bytes = max(100_000, int(max_bytes))
+        self.backups = max(0, int(backups))
+        self.records = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._f: Optional[BinaryIO] = None
+        self._size = 0
+        self.defer_seconds = 0.0
+        self._pending: List[bytes] = []
+        self._pending_since = 0.0
+        self._flush_timer: Optional[asyncio.TimerHandle] = None
+
+    def _open(self) -> None:
+        f = open(self.path, "ab", buffering=0)
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            size = f.write(_FILE_HEADER.pack(EVENT_LOG_MAGIC, EVENT_LOG_VERSION, time.time()))
+        self._f, self._size = f, size
+
+    def log(self, event: dict) -> None:
+        self._pending.append(encode_event(event, time.time()))
+        if self.defer_seconds > 0:
+            now = time.monotonic()
+            if len(self._pending) == 1:
+                self._pending_since = now
+                self._flush_timer = _call_later(self.defer_seconds, self.flush)
+            if len(self._pending) < MAX_DEFERRED_EVENTS and now - self._pending_since < self.defer_seconds:
+                return
+        self.flush()
+
+    def flush(self) -> None:
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        if not self._pending:
+            return
+        records, self._pending = self._pending, []
+        if self._f is None:
+            self._open()
+        elif self.backups > 0 and self._size >= self.max_bytes:
+            self._f.close()
+            _rotate_files(self.path, self.backups)
+            self._open()
+        data = records[0] if len(records) == 1 else b"".join(records)
+        self._f.write(data)
+        self._size += len(data)
+        self.records += len(records)
+
+    def defer(self, seconds: float) -> None:
+        """Same as JsonlLogger.defer(): hold records for up to `seconds`, then write them in one go."""
+        self.defer_seconds = max(0.0, float(seconds))
+        if self.defer_seconds == 0:
+            self.flush()
+
+    def close(self) -> None:
+        self.flush()
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+
+class EventLogReader:
+    """Streams events out of one binary log file in `chunk_size` reads.
+
+    `bad_records` counts records dropped for a CRC mismatch and
+    `skipped_bytes` everything stepped over to find the next valid record
+    (including a torn final record left by a crash).
+    """
+
+    def __init__(self, path: Path, chunk_size: int = 1 << 20) -> None:
+        self.path = path
+        self.chunk_size = max(4096, int(chunk_size))
+        self.created_at: Optional[float] = None
+        self.records = 0
+        self.bad_records = 0
+        self.skipped_bytes = 0
+
+    def bodies(self) -> Iterator[bytes]:
+        with open(self.path, "rb") as f:
+            header = f.read(_FILE_HEADER.size)
+            if len(header) < _FILE_HEADER.size:
+                raise ValueError(f"{self.path}: not a binary event log (truncated header)")
+            magic, version, self.created_at = _FILE_HEADER.unpack(header)
+            if magic != EVENT_LOG_MAGIC:
+                raise ValueError(f"{self.path}: not a binary event log")
+            if version != EVENT_LOG_VERSION:
+                raise ValueError(f"{self.path}: unsupported event log version {version}")
+
+            buf = b""
+            pos = 0
+            eof = False
+            while not eof:
+                chunk = f.read(self.chunk_size)
+                eof = not chunk
+                buf = buf[pos:] + chunk
+                pos = 0
+                while len(buf) - pos >= _PREFIX.size:
+                    length, crc = _PREFIX.unpack_from(buf, pos)
+                    end = pos + _PREFIX.size + length
+                    if _BODY_HEADER.size <= length <= MAX_RECORD_BYTES:
+                        if end > len(buf) and not eof:
+                            break  # the rest of this record is in the next chunk
+                        if end <= len(buf):
+                            body = buf[pos + _PREFIX.size : end]
+                            if zlib.crc32(body) == crc:
+                                self.records += 1
+                                pos = end
+                                yield body
+                                continue
+                            self.bad_records += 1
+                    # Damaged record: step forward until a length + CRC check out again.
+                    pos += 1
+                    self.skipped_bytes += 1
+            self.skipped_bytes += len(buf) - pos
+
+    def __iter__(self) -> Iterator[dict]:
+        for body in self.bodies():
+            yield decode_event(body)
+
+
+def _oldest_first(paths: List[Path]) -> List[Path]:
+    def rotation(p: Path) -> Tuple[str, int]:
+        stem, _, number = p.name.partition(EVENT_LOG_SUFFIX)
+        return (stem, -int(number[1:]) if number[1:].isdigit() else 0)
+
+    return sorted(paths, key=rotation)
+
+
+def _write_jsonl(reader: EventLogReader, out) -> None:
+    for event in reader:
+        out.write(json.dumps(event, separators=(",", ":"), ensure_ascii=False) + "\n")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Read LiftCo binary event logs (.lcev)")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    cat = sub.add_parser("cat", help="Print events as JSON lines (rotated files oldest first)")
+    cat.add_argument("paths", nargs="+", type=Path)
+    convert = sub.add_parser("convert", help="Write a .jsonl next to (or under --out-dir) each log file")
+    convert.add_argument("paths", nargs="+", type=Path)
+    convert.add_argument("--out-dir", type=Path, help="Directory for the .jsonl files (default: beside the input)")
+    stats = sub.add_parser("stats", help="Record counts, size per event and damage per file")
+    stats.add_argument("paths", nargs="+", type=Path)
+    args = parser.parse_args()
+
+    damaged = False
+    for path in _oldest_first([p.expanduser() for p in args.paths]):
+        reader = EventLogReader(path)
+        try:
+            if args.cmd == "cat":
+                try:
+                    _write_jsonl(reader, sys.stdout)
+                except BrokenPipeError:
+                    os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+                    return 0
+            elif args.cmd == "convert":
+                # scanner_gym1_a.lcev.2 -> scanner_gym1_a.jsonl.2, the JsonlLogger name for the same segment.
+                target = path.name.replace(EVENT_LOG_SUFFIX, ".jsonl", 1)
+                out_path = (args.out_dir.expanduser() if args.out_dir else path.parent) / target
+                out_path.parent.mkdir(parents=True, exist_ok=True)
+                with open(out_path, "w", encoding="utf-8") as out:
+                    _write_jsonl(reader, out)
+                print(f"{path} -> {out_path} ({reader.records} events)", file=sys.stderr)
+            else:
+                events = {}
+                for body in reader.bodies():
+                    name = decode_event(body)["event"]
+                    events[name] = events.get(name, 0) + 1
+                size = path.stat().st_size
+                summary = {
+                    "path": str(path),
+                    "bytes": size,
+                    "records": reader.records,
+                    "bytes_per_record": round(size / reader.records, 1) if reader.records else None,
+                    "bad_records": reader.bad_records,
+                    "skipped_bytes": reader.skipped_bytes,
+                    "events": events,
+                }
+                print(json.dumps(summary))
+        except (OSError, ValueError) as e:
+            print(f"{path}: {e}", file=sys.stderr)
+            damaged = True
+            continue
+        if reader.bad_records or reader.skipped_bytes:
+            print(
+                f"{path}: skipped {reader.bad_records} bad record(s), {reader.skipped_bytes} byte(s)",
+                file=sys.stderr,
+            )
+            damaged = True
+    return 1 if damaged else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""Export attendance_verified events from the scanner JSONL logs to Parquet or Arrow.
+
+  python3 attendance_scanner/export_logs.py --out ~/liftco-attendance
+  python3 attendance_scanner/export_logs.py /mnt/backup/logs --out ./attendance --format arrow
+
+Inputs are the scanner_gym*.jsonl logs (the live file, rotated .jsonl.N
+segments and any .gz copies of them). Output is Hive-partitioned,
+gym_id=<id>/scanner_id=<id>/date=<YYYY-MM-DD>/part-*.parquet, which pandas,
+DuckDB and pyarrow.dataset read as one table.
+
+Runs are incremental: a segment is identified by a hash of its first bytes
+(which survives rotation renames and gzip), and _export_state.json records
+how far into it the last run got, so only new lines are converted. Rows are
+streamed in --batch-size row groups per partition; memory does not grow
+with the size of the logs. Needs pyarrow (pip install pyarrow).
+"""
+
+import argparse
+import calendar
+import gzip
+import hashlib
+import json
+import os
+import sys
+import time
+import uuid
+from pathlib import Path
+from typing import IO, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote
+
+DEFAULT_LOG_DIR = Path.home() / ".liftco" / "attendance_scanner" / "logs"
+STATE_FILE = "_export_state.json"
+# How much of a segment's start identifies it (less while it is still short).
+PREFIX_BYTES = 64 * 1024
+FORMATS = ("parquet", "arrow")
+
+PartitionKey = Tuple[int, str, str]  # gym_id, scanner_id, date
+
+
+def _schema(pa):
+    return pa.schema(
+        [
+            ("ts", pa.timestamp("s", tz="UTC")),
+            ("user_id", pa.binary(16)),
+            ("token_u32", pa.uint32()),
+            ("rssi", pa.int16()),
+            ("status_code", pa.int16()),
+            ("ok", pa.bool_()),
+            ("error", pa.string()),
+        ]
+    )
+
+
+def find_segments(paths: List[Path]) -> List[Path]:
+    """Expand directories to their scanner_gym*.jsonl* segments, oldest rotation first."""
+    found: List[Path] = []
+    for path in paths:
+        if path.is_dir():
+            found.extend(p for p in path.glob("scanner_gym*.jsonl*") if p.is_file())
+        elif path.is_file():
+            found.append(path)
+
+    def rotation(p: Path) -> Tuple[str, int]:
+        # scanner_gym1_a.jsonl.3.gz -> ("scanner_gym1_a", 3); the live file is 0.
+        parts = p.name.split(".")
+        number = next((int(part) for part in parts[2:] if part.isdigit()), 0)
+        return (parts[0], -number)
+
+    return sorted(set(found), key=rotation)
+
+
+def _open(path: Path) -> IO[bytes]:
+    return gzip.open(path, "rb") if path.suffix == ".gz" else path.open("rb")
+
+
+def _prefix_sha(path: Path, length: int) -> Optional[str]:
+    with _open(path) as f:
+        data = f.read(length)
+    return hashlib.sha256(data).hexdigest() if len(data) == length else None
+
+
+def _row(line: bytes) -> Optional[Tuple[PartitionKey, tuple]]:
+    event = json.loads(line)
+    if event.get("event") != "attendance_verified":
+        return None
+    ts = event["ts"]
+    epoch = calendar.timegm(time.strptime(ts, "%Y-%m-%dT%H:%M:%SZ"))
+    status = event.get("status_code")
+    key = (int(event["gym_id"]), str(event["scanner_id"]), ts[:10])
+    return key, (
+        epoch,
+        uuid.UUID(event["user_id"]).bytes,
+        int(event["token_u32"]),
+        int(event["rssi"]),
+        int(status) if status is not None else None,
+        bool(event.get("ok")),
+        event.get("error"),
+    )
+
+
+class _PartitionWriter:
+    """One output file for one partition, written in row groups and renamed into place on close."""
+
+    def __init__(self, pa, out: Path, key: PartitionKey, fmt: str, name: str) -> None:
+        gym_id, scanner_id, date = key
+        directory = out / f"gym_id={gym_id}" / f"scanner_id={quote(scanner_id, safe='')}" / f"date={date}"
+        directory.mkdir(parents=True, exist_ok=True)
+        self.pa = pa
+        self.path = directory / f"{name}.{fmt}"
+        self.tmp = directory / f".{name}.{fmt}.tmp"
+        self.schema = _schema(pa)
+        if fmt == "parquet":
+            import pyarrow.parquet as pq
+
+            self.writer = pq.ParquetWriter(self.tmp, self.schema, compression="zstd")
+        else:
+            self.writer = pa.ipc.new_file(str(self.tmp), self.schema)
+        self.rows = 0
+
+    def write(self, rows: List[tuple]) -> None:
+        columns = list(zip(*rows))
+        batch = self.pa.record_batch(
+            [self.pa.array(values, type=field.type) for values, field in zip(columns, self.schema)],
+            schema=self.schema,
+        )
+        if isinstance(self.writer, self.pa.ipc.RecordBatchFileWriter):
+            self.writer.write_batch(batch)
+        else:
+            self.writer.write_batch(batch, row_group_size=len(rows))
+        self.rows += len(rows)
+
+    def close(self) -> None:
+        self.writer.close()
+        os.replace(self.tmp, self.path)
+
+    def discard(self) -> None:
+        self.writer.close()
+        self.tmp.unlink()
+
+
+class Exporter:
+    def __init__(self, out: Path, fmt: str = "parquet", batch_size: int = 50_000) -> None:
+        if fmt not in FORMATS:
+            raise ValueError(f"format must be one of {FORMATS}, got {fmt!r}")
+        try:
+            import pyarrow as pa
+        except ModuleNotFoundError:
+            print("Export needs pyarrow: pip install pyarrow", file=sys.stderr)
+            sys.exit(2)
+        self.pa = pa
+        self.out = out
+        self.fmt = fmt
+        self.batch_size = max(1000, int(batch_size))
+        self.state_path = out / STATE_FILE
+        self.state: List[dict] = []
+        if self.state_path.exists():
+            self.state = json.loads(self.state_path.read_text(encoding="utf-8")).get("segments", [])
+        self.run = f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}-{uuid.uuid4().hex[:6]}"
+        self._files = 0
+
+        self.segments_read = 0
+        self.segments_skipped = 0
+        self.rows_written = 0
+        self.bad_lines = 0
+        self.files_written = 0
+
+    def _save_state(self) -> None:
+        tmp = self.state_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"version": 1, "segments": self.state}, indent=1, sort_keys=True), encoding="utf-8")
+        os.replace(tmp, self.state_path)
+
+    def _lines(self, path: Path, offset: int) -> Iterator[Tuple[int, bytes]]:
+        """(end offset, line) for complete lines after `offset`; a trailing partial line is left for next time."""
+        with _open(path) as f:
+            if path.suffix == ".gz":
+                remaining = offset
+                while remaining > 0:
+                    chunk = f.read(min(remaining, 1 << 20))
+                    if not chunk:
+                        return
+                    remaining -= len(chunk)
+            else:
+                f.seek(offset)
+            position = offset
+            for line in f:
+                if not line.endswith(b"\n"):
+                    return
+                position += len(line)
+                yield position, line
+
+    def _find(self, path: Path) -> Optional[dict]:
+        """The state entry whose recorded prefix this segment starts with (longest wins)."""
+        cache: Dict[int, Optional[str]] = {}
+        for entry in sorted(self.state, key=lambda e: -e["prefix"]):
+            length = entry["prefix"]
+            if length not in cache:
+                cache[length] = _prefix_sha(path, length)
+            if cache[length] == entry["prefix_sha"]:
+                return entry
+        return None
+
+    def export_segment(self, path: Path) -> int:
+        done = self._find(path)
+        # Rotated segments never change again; only the live .jsonl can grow.
+        live = path.name.endswith(".jsonl")
+        if done is not None and done["complete"]:
+            self.segments_skipped += 1
+            return 0
+
+        self.segments_read += 1
+        offset = done["offset"] if done is not None else 0
+        buffers: Dict[PartitionKey, List[tuple]] = {}
+        writers: Dict[PartitionKey, _PartitionWriter] = {}
+        rows = 0
+
+        def flush(key: PartitionKey) -> None:
+            if key not in writers:
+                self._files += 1
+                writers[key] = _PartitionWriter(self.pa, self.out, key, self.fmt, f"part-{self.run}-{self._files:05d}")
+            writers[key].write(buffers.pop(key))
+
+        try:
+            for offset, line in self._lines(path, offset):
+                if b'"attendance_verified"' not in line:
+                    continue
+                try:
+                    parsed = _row(line)
+                except (ValueError, KeyError, TypeError):
+                    self.bad_lines += 1
+                    continue
+                if parsed is None:
+                    continue
+                key, row = parsed
+                buffer = buffers.setdefault(key, [])
+                buffer.append(row)
+                rows += 1
+                if len(buffer) >= self.batch_size:
+                    flush(key)
+            for key in list(buffers):
+                flush(key)
+        except BaseException:
+            for writer in writers.values():
+                writer.discard()
+            raise
+        for writer in writers.values():
+            writer.close()
+        self.files_written += len(writers)
+        self.rows_written += rows
+
+        if offset == 0:
+            return rows
+        # Only recorded once the files above are in place: a crash re-exports this segment's tail.
+        if done is None:
+            done = {"rows": 0}
+            self.state.append(done)
+        prefix = min(offset, PREFIX_BYTES)
+        done.update(
+            prefix=prefix,
+            prefix_sha=_prefix_sha(path, prefix),
+            offset=offset,
+            rows=done["rows"] + rows,
+            source=path.name,
+            complete=not live,
+        )
+        self._save_state()
+        return rows
+
+    def export(self, segments: List[Path]) -> None:
+        self.out.mkdir(parents=True, exist_ok=True)
+        # Leftovers of an interrupted run; their segments were not marked as exported.
+        for stale in self.out.glob(f"**/.part-*.{self.fmt}.tmp"):
+            stale.unlink()
+        for path in segments:
+            self.export_segment(path)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Export scanner JSONL logs to partitioned Parquet/Arrow")
+    parser.add_argument("inputs", nargs="*", type=Path, help=f"Log files or directories (default: {DEFAULT_LOG_DIR})")
+    parser.add_argument("--out", type=Path, required=True, help="Output dataset directory")
+    parser.add_argument("--format", choices=FORMATS, default="parquet")
+    parser.add_argument("--batch-size", type=int, default=50_000, help="Rows per row group / record batch (default: 50000)")
+    args = parser.parse_args()
+
+    segments = find_segments([p.expanduser() for p in (args.inputs or [DEFAULT_LOG_DIR])])
+    if not segments:
+        print("No scanner_gym*.jsonl logs found", file=sys.stderr)
+        return 1
+
+    started = time.perf_counter()
+    exporter = Exporter(args.out.expanduser(), fmt=args.format, batch_size=args.batch_size)
+    exporter.export(segments)
+    print(
+        json.dumps(
+            {
+                "segments_read": exporter.segments_read,
+                "segments_skipped": exporter.segments_skipped,
+                "rows_written": exporter.rows_written,
+                "files_written": exporter.files_written,
+                "bad_lines": exporter.bad_lines,
+                "seconds": round(time.perf_counter() - started, 2),
+            }
+        )
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
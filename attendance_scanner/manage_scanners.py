@@ -6,7 +6,8 @@ import secrets
 import sys
 import time
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
 
 def sha256_hex(value: str) -> str:
@@ -163,6 +164,37 @@ def postgrest_request(method: str, url: str, headers: Dict[str, str], json: Any
     return requests.request(method, url, headers=headers, json=json, timeout=10)
 
 
+def postgrest_session(headers: Dict[str, str], pool_size: int = 8):
+    """requests.Session with keep-alive connections for commands that make many calls."""
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    session.headers.update(headers)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def fetch_pages(session, url: str, page_size: int = 1000) -> Iterator[dict]:
+    """Yield every row of a PostgREST GET, one Range-header page at a time.
+
+    The server's max-rows setting can return fewer rows than asked for, so a
+    short page isn't the end: only an empty page is.
+    """
+    start = 0
+    while True:
+        res = session.get(url, headers={"Range-Unit": "items", "Range": f"{start}-{start + page_size - 1}"}, timeout=30)
+        if res.status_code not in (200, 206):
+            raise RuntimeError(f"List failed ({res.status_code}): {res.text}")
+        rows = res.json()
+        if not rows:
+            return
+        yield from rows
+        start += len(rows)
+
+
 def make_headers(service_role_key: str) -> Dict[str, str]:
     return {
         "apikey": service_role_key,
@@ -212,6 +244,112 @@ def list_scanners(base_url: str, headers: Dict[str, str], gym_id: int) -> List[S
     ]
 
 
+SCANNER_COLUMNS = ("id", "gym_id", "scanner_id", "key_hint", "is_active", "created_at", "revoked_at")
+
+
+def iter_scanners(
+    session,
+    base_url: str,
+    gym_ids: Optional[List[int]] = None,
+    active: Optional[bool] = None,
+    page_size: int = 1000,
+    scanner_like: Optional[str] = None,
+) -> Iterator[ScannerRow]:
+    """Stream scanners for `gym_ids` (None = every gym) page by page.
+
+    gym_ids go out as gym_id=in.(...) filters, 200 per query to keep URLs
+    short; ordering by id keeps Range pagination stable while rows change.
+    scanner_like is a PostgREST like pattern (`*` wildcard), e.g. "front-*".
+    """
+    from urllib.parse import quote
+
+    chunks: List[Optional[List[int]]] = [None]
+    if gym_ids is not None:
+        ids = sorted(set(gym_ids))
+        chunks = [ids[i : i + 200] for i in range(0, len(ids), 200)]
+    for chunk in chunks:
+        url = f"{base_url}/rest/v1/attendance_scanners?select={','.join(SCANNER_COLUMNS)}&order=id"
+        if chunk is not None:
+            url += f"&gym_id=in.({','.join(str(g) for g in chunk)})"
+        if active is not None:
+            url += f"&is_active=is.{'true' if active else 'false'}"
+        if scanner_like:
+            url += f"&scanner_id=like.{quote(scanner_like, safe='*')}"
+        for r in fetch_pages(session, url, page_size=page_size):
+            yield ScannerRow(
+                id=r["id"],
+                gym_id=r["gym_id"],
+                scanner_id=r["scanner_id"],
+                key_hint=r.get("key_hint"),
+                is_active=r.get("is_active", False),
+                created_at=r.get("created_at", ""),
+                revoked_at=r.get("revoked_at"),
+            )
+
+
+def write_scanners(rows: Iterator[ScannerRow], fmt: str, out=None, rich_chunk: int = 500) -> int:
+    """Write streamed rows as csv, ndjson or Rich tables; returns the row count.
+
+    Rich output prints one table per `rich_chunk` rows so memory stays flat.
+    """
+    import json
+
+    out = out if out is not None else sys.stdout
+    count = 0
+    if fmt == "csv":
+        import csv
+
+        writer = csv.writer(out)
+        writer.writerow(SCANNER_COLUMNS)
+        for r in rows:
+            values = (getattr(r, name) for name in SCANNER_COLUMNS)
+            writer.writerow(["" if v is None else str(v).lower() if isinstance(v, bool) else v for v in values])
+            count += 1
+        return count
+    if fmt == "ndjson":
+        for r in rows:
+            out.write(json.dumps({name: getattr(r, name) for name in SCANNER_COLUMNS}, separators=(",", ":")) + "\n")
+            count += 1
+        return count
+
+    try:
+        from rich.console import Console
+        from rich.table import Table
+    except ModuleNotFoundError:
+        print("Install UI deps: pip install -r attendance_scanner/requirements.txt", file=sys.stderr)
+        sys.exit(2)
+
+    console = Console(file=out)
+
+    def new_table():
+        table = Table(show_header=True)
+        for column in ("gym_id", "scanner_id", "active", "key_hint", "created_at", "revoked_at"):
+            table.add_column(column)
+        return table
+
+    table = new_table()
+    for r in rows:
+        table.add_row(str(r.gym_id), r.scanner_id, "yes" if r.is_active else "no", r.key_hint or "", r.created_at, r.revoked_at or "")
+        count += 1
+        if count % rich_chunk == 0:
+            console.print(table)
+            table = new_table()
+    if table.row_count or not count:
+        console.print(table)
+    console.print(f"{count} scanner(s)")
+    return count
+
+
+def parse_gym_ids(value: str) -> List[int]:
+    try:
+        ids = [int(part) for part in value.replace(" ", "").split(",") if part]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected comma-separated gym ids, got {value!r}") from None
+    if not ids or any(i <= 0 for i in ids):
+        raise argparse.ArgumentTypeError("gym ids must be positive integers")
+    return ids
+
+
 def _normalize_hint(hint: Optional[str]) -> Optional[str]:
     if hint is None:
         return None
@@ -324,6 +462,696 @@ def add_scanner(
     )
 
 
+SCANNER_ID_MAX = 64
+
+
+@dataclass
+class ManifestRow:
+    line: int
+    gym_id: int
+    scanner_id: str
+    key_hint: Optional[str]
+    key: str = ""
+    status: str = "pending"
+    detail: str = ""
+
+
+def read_manifest(path: Path) -> Tuple[List[ManifestRow], List[Tuple[int, str]]]:
+    """Parse a CSV (header: gym_id,scanner_id[,key_hint]) or JSON manifest.
+
+    JSON may be a list of objects or {"scanners": [...]}. Returns (rows, errors)
+    where errors are (line/index, message) for rows that can't be used.
+    """
+    import csv
+    import json
+
+    text = path.read_text(encoding="utf-8-sig")
+    if path.suffix.lower() == ".json" or text.lstrip().startswith(("[", "{")):
+        data = json.loads(text)
+        records = data.get("scanners", []) if isinstance(data, dict) else data
+        numbered = list(enumerate(records, start=1))
+    else:
+        numbered = list(enumerate(csv.DictReader(text.splitlines()), start=2))
+
+    rows: List[ManifestRow] = []
+    errors: List[Tuple[int, str]] = []
+    seen: Dict[Tuple[int, str], int] = {}
+    for line, record in numbered:
+        if not isinstance(record, dict):
+            errors.append((line, "not an object"))
+            continue
+        try:
+            gym_id = int(str(record.get("gym_id", "")).strip())
+        except ValueError:
+            errors.append((line, f"invalid gym_id {record.get('gym_id')!r}"))
+            continue
+        scanner_id = str(record.get("scanner_id") or "").strip()
+        if gym_id <= 0:
+            errors.append((line, f"invalid gym_id {gym_id}"))
+            continue
+        if not scanner_id or len(scanner_id) > SCANNER_ID_MAX:
+            errors.append((line, f"scanner_id must be 1..{SCANNER_ID_MAX} characters"))
+            continue
+        first = seen.setdefault((gym_id, scanner_id), line)
+        if first != line:
+            errors.append((line, f"duplicate of line {first} (gym_id={gym_id}, scanner_id={scanner_id})"))
+            continue
+        hint = record.get("key_hint")
+        rows.append(ManifestRow(line, gym_id, scanner_id, _normalize_hint(str(hint) if hint is not None else None)))
+    return rows, errors
+
+
+def open_secret_file(path: Path):
+    """Create `path` for writing with mode 0600; refuses to overwrite an existing file."""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    return os.fdopen(fd, "w", encoding="utf-8", newline="")
+
+
+def active_scanner_ids(session, base_url: str, gym_ids: List[int]) -> set:
+    """(gym_id, scanner_id) pairs that already have an active key."""
+    return {(int(r.gym_id), r.scanner_id) for r in iter_scanners(session, base_url, gym_ids, active=True)}
+
+
+def _is_unique_violation(res) -> bool:
+    if res.status_code == 409:
+        return True
+    try:
+        return (res.json() or {}).get("code") == "23505"
+    except Exception:
+        return False
+
+
+def _insert_batch(session, endpoint: str, rows: List[ManifestRow]) -> None:
+    """POST rows as one array; on a unique-key conflict, bisect to find the offending rows."""
+    payload = [
+        {
+            "gym_id": r.gym_id,
+            "scanner_id": r.scanner_id,
+            "key_hash_sha256_hex": sha256_hex(r.key),
+            "key_hint": r.key_hint or r.key[-6:],
+            "is_active": True,
+        }
+        for r in rows
+    ]
+    try:
+        res = session.post(endpoint, json=payload, headers={"Prefer": "return=minimal"}, timeout=30)
+    except Exception as e:
+        for r in rows:
+            r.status, r.detail = "error", f"network error: {e}"
+        return
+
+    if res.status_code in (200, 201, 204):
+        for r in rows:
+            r.status = "inserted"
+        return
+    # A unique violation (409 / 23505) names one bad row and the rest may be fine. Other
+    # errors (400 check/not-null, 401, ...) would fail every half too, so don't bisect those.
+    if _is_unique_violation(res) and len(rows) > 1:
+        mid = len(rows) // 2
+        _insert_batch(session, endpoint, rows[:mid])
+        _insert_batch(session, endpoint, rows[mid:])
+        return
+    for r in rows:
+        r.status = "conflict" if res.status_code == 409 else "error"
+        r.detail = f"{res.status_code}: {res.text[:200]}"
+
+
+def bulk_add_scanners(
+    base_url: str,
+    headers: Dict[str, str],
+    manifest: Path,
+    keys_out: Path,
+    batch_size: int = 500,
+    dry_run: bool = False,
+) -> int:
+    """Register every scanner in `manifest`; returns how many rows were not inserted."""
+    try:
+        from rich.console import Console
+        from rich.panel import Panel
+        from rich.table import Table
+    except ModuleNotFoundError:
+        print("Install UI deps: pip install -r attendance_scanner/requirements.txt", file=sys.stderr)
+        sys.exit(2)
+
+    console = Console()
+    rows, invalid = read_manifest(manifest)
+
+    # Fail before touching the database if the key file can't be created.
+    out = None if dry_run else open_secret_file(keys_out)
+    try:
+        session = postgrest_session(headers)
+        existing = active_scanner_ids(session, base_url, sorted({r.gym_id for r in rows})) if rows else set()
+        todo: List[ManifestRow] = []
+        for r in rows:
+            if (r.gym_id, r.scanner_id) in existing:
+                r.status, r.detail = "conflict", "already has an active key (use rotate)"
+            else:
+                r.key = secrets.token_hex(32)
+                todo.append(r)
+
+        if not dry_run:
+            import csv
+
+            # Each batch's keys are on disk before it is POSTed, so a crash or a lost
+            # response can't leave a registered key nobody has: rows are written as
+            # "pending", then again as "inserted" or "failed" once the outcome is known.
+            writer = csv.writer(out)
+            writer.writerow(["gym_id", "scanner_id", "scanner_key", "key_hint", "status", "detail"])
+            endpoint = f"{base_url}/rest/v1/attendance_scanners"
+            for i in range(0, len(todo), max(1, batch_size)):
+                batch = todo[i : i + batch_size]
+                for r in batch:
+                    writer.writerow([r.gym_id, r.scanner_id, r.key, r.key_hint or r.key[-6:], "pending", ""])
+                out.flush()
+                os.fsync(out.fileno())
+                _insert_batch(session, endpoint, batch)
+                for r in batch:
+                    status = "inserted" if r.status == "inserted" else "failed"
+                    writer.writerow([r.gym_id, r.scanner_id, r.key, r.key_hint or r.key[-6:], status, r.detail])
+                out.flush()
+    finally:
+        if out is not None:
+            out.close()
+
+    inserted = sum(1 for r in rows if r.status == "inserted")
+    problems = [(r.line, r.gym_id, r.scanner_id, r.status, r.detail) for r in rows if r.status not in ("inserted", "pending")]
+    problems += [(line, "", "", "invalid", message) for line, message in invalid]
+    if problems:
+        table = Table(title="Rows not inserted")
+        for column in ("line", "gym_id", "scanner_id", "status", "detail"):
+            table.add_column(column)
+        for line, gym_id, scanner_id, status, detail in sorted(problems, key=lambda p: p[0]):
+            table.add_row(str(line), str(gym_id), scanner_id, status, detail)
+        console.print(table)
+
+    if dry_run:
+        console.print(
+            Panel(
+                f"{len(todo)} would be inserted, {len(problems)} skipped. Nothing was written.",
+                title="Dry run",
+            )
+        )
+    else:
+        console.print(
+            Panel(
+                "\n".join(
+                    [
+                        f"[green]{inserted} scanner(s) registered[/green], {len(problems)} not inserted.",
+                        f"Plaintext keys: {keys_out} (mode 600; use the rows with status inserted). "
+                        "Move them into each scanner's env and delete the file.",
+                    ]
+                ),
+                title="Bulk add",
+            )
+        )
+    return len(problems)
+
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+def _request_with_retries(session, method: str, url: str, retries: int, **kwargs):
+    """One PostgREST call, retried with backoff on network errors, 429 and 5xx."""
+    for attempt in range(retries + 1):
+        try:
+            res = session.request(method, url, timeout=15, **kwargs)
+        except Exception:
+            if attempt == retries:
+                raise
+        else:
+            if res.status_code not in RETRY_STATUS or attempt == retries:
+                return res
+        time.sleep(min(8.0, 0.5 * 2**attempt) * (0.5 + secrets.randbelow(1000) / 1000.0))
+    raise AssertionError("unreachable")
+
+
+@dataclass
+class FleetResult:
+    row: ScannerRow
+    status: str  # pending (rotate: key written, not yet inserted) / rotated / revoked / skipped / failed
+    detail: str = ""
+    new_key: Optional[str] = None
+    new_hint: Optional[str] = None
+
+
+def _revoke_payload(reason: str) -> Dict[str, Any]:
+    from datetime import datetime, timezone
+
+    return {
+        "is_active": False,
+        # Microseconds make the timestamp identify this revoke, so a retry can recognise it (see _revoke_row).
+        "revoked_at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+        "revoked_reason": reason or None,
+    }
+
+
+def _revoke_row(session, base_url: str, row: ScannerRow, reason: str, retries: int) -> Optional[str]:
+    """Revoke one key row; returns None on success, "skipped" if someone else revoked it, or an error.
+
+    The PATCH matches the row while it is still active *or* already carries
+    this call's revoked_at, so a retry after a lost response finds its own
+    revoke instead of reporting the row as no longer active.
+    """
+    payload = _revoke_payload(reason)
+    res = _request_with_retries(
+        session,
+        "PATCH",
+        f"{base_url}/rest/v1/attendance_scanners?id=eq.{row.id}"
+        f"&or=(is_active.is.true,revoked_at.eq.\"{payload['revoked_at']}\")",
+        retries,
+        json=payload,
+        headers={"Prefer": "return=representation"},
+    )
+    if res.status_code not in (200, 204):
+        return f"{res.status_code}: {res.text[:200]}"
+    if res.status_code == 200 and res.json() == []:
+        return "skipped"
+    return None
+
+
+def _insert_key(session, endpoint: str, payload: Dict[str, Any], retries: int) -> Optional[str]:
+    """POST one key row; returns None once it is stored, else the last error.
+
+    Before any retry the key hash is looked up, so an insert that committed
+    but lost its response is neither reported as failed nor inserted twice.
+    """
+    lookup = f"{endpoint}?key_hash_sha256_hex=eq.{payload['key_hash_sha256_hex']}&select=id"
+    error = "insert not attempted"
+    for attempt in range(retries + 1):
+        try:
+            res = session.post(endpoint, json=payload, headers={"Prefer": "return=minimal"}, timeout=15)
+            if res.status_code in (200, 201, 204):
+                return None
+            error = f"{res.status_code}: {res.text[:200]}"
+            retriable = res.status_code in RETRY_STATUS
+        except Exception as e:
+            error, retriable = f"network error: {e}", True
+        try:
+            found = _request_with_retries(session, "GET", lookup, retries)
+            if found.status_code == 200 and found.json():
+                return None
+        except Exception:
+            pass
+        if not retriable or attempt == retries:
+            break
+        time.sleep(min(8.0, 0.5 * 2**attempt) * (0.5 + secrets.randbelow(1000) / 1000.0))
+    return error
+
+
+def _rotate_one(
+    session, base_url: str, row: ScannerRow, reason: str, retries: int, record: Callable[[FleetResult], None]
+) -> FleetResult:
+    """Revoke the old key, then register a fresh one under the same (gym_id, scanner_id).
+
+    The new key is passed to `record` (the manifest) as "pending" before it is
+    inserted, so it is on disk even if the run dies mid-insert.
+    """
+    endpoint = f"{base_url}/rest/v1/attendance_scanners"
+    try:
+        error = _revoke_row(session, base_url, row, reason, retries)
+    except Exception as e:
+        return FleetResult(row, "failed", f"network error: {e}")
+    if error == "skipped":
+        return FleetResult(row, "skipped", "no longer active")
+    if error is not None:
+        return FleetResult(row, "failed", f"revoke {error}")
+
+    key = secrets.token_hex(32)
+    record(FleetResult(row, "pending", "old key revoked, inserting this key", new_key=key, new_hint=key[-6:]))
+    payload = {
+        "gym_id": row.gym_id,
+        "scanner_id": row.scanner_id,
+        "key_hash_sha256_hex": sha256_hex(key),
+        "key_hint": key[-6:],
+        "is_active": True,
+    }
+    error = _insert_key(session, endpoint, payload, retries)
+    if error is not None:
+        # The old key is already revoked: this scanner is offline until re-provisioned.
+        return FleetResult(row, "failed", f"old key revoked but insert failed {error}", new_key=key, new_hint=key[-6:])
+    return FleetResult(row, "rotated", new_key=key, new_hint=key[-6:])
+
+
+def _revoke_one(
+    session, base_url: str, row: ScannerRow, reason: str, retries: int, record: Callable[[FleetResult], None]
+) -> FleetResult:
+    try:
+        error = _revoke_row(session, base_url, row, reason, retries)
+    except Exception as e:
+        return FleetResult(row, "failed", f"network error: {e}")
+    if error == "skipped":
+        return FleetResult(row, "skipped", "no longer active")
+    if error is not None:
+        return FleetResult(row, "failed", error)
+    return FleetResult(row, "revoked")
+
+
+def fleet_update(
+    base_url: str,
+    headers: Dict[str, str],
+    action: str,
+    gym_ids: Optional[List[int]],
+    scanner_like: Optional[str],
+    manifest_path: Path,
+    reason: str,
+    concurrency: int = 8,
+    retries: int = 3,
+    dry_run: bool = False,
+) -> int:
+    """Rotate or revoke every active scanner matching the filters; returns the failure count.
+
+    Each row is handled independently on a bounded thread pool and the
+    manifest (mode 600; for rotate it holds the new plaintext keys) is written
+    as results arrive, so an interrupted run still records what changed.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    try:
+        from rich.console import Console
+        from rich.panel import Panel
+        from rich.progress import BarColumn, MofNCompleteColumn, Progress, TextColumn, TimeElapsedColumn
+        from rich.table import Table
+    except ModuleNotFoundError:
+        print("Install UI deps: pip install -r attendance_scanner/requirements.txt", file=sys.stderr)
+        sys.exit(2)
+
+    import csv
+
+    console = Console()
+    concurrency = max(1, concurrency)
+    session = postgrest_session(headers, pool_size=concurrency)
+    # Materialise first: revoking while paging through is_active=true would shift the pages.
+    targets = list(iter_scanners(session, base_url, gym_ids, active=True, scanner_like=scanner_like))
+    gyms = len({t.gym_id for t in targets})
+    if dry_run or not targets:
+        console.print(Panel(f"{len(targets)} active scanner(s) in {gyms} gym(s) would be {action}d.", title="Dry run" if dry_run else action))
+        return 0
+
+    import threading
+
+    worker = _rotate_one if action == "rotate" else _revoke_one
+    failures: List[FleetResult] = []
+    counts: Dict[str, int] = {}
+    with open_secret_file(manifest_path) as out:
+        writer = csv.writer(out)
+        writer.writerow(["gym_id", "scanner_id", "old_id", "status", "scanner_key", "key_hint", "detail"])
+        lock = threading.Lock()
+
+        def record(result: FleetResult) -> None:
+            # Called from the workers too (pending keys), so one row at a time.
+            with lock:
+                writer.writerow(
+                    [
+                        result.row.gym_id,
+                        result.row.scanner_id,
+                        result.row.id,
+                        result.status,
+                        result.new_key or "",
+                        result.new_hint or "",
+                        result.detail,
+                    ]
+                )
+                out.flush()
+
+        with Progress(
+            TextColumn(f"{action.capitalize()}"),
+            BarColumn(),
+            MofNCompleteColumn(),
+            TextColumn("{task.fields[failed]} failed"),
+            TimeElapsedColumn(),
+            console=console,
+        ) as progress:
+            task = progress.add_task(action, total=len(targets), failed=0)
+            with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=action) as pool:
+                futures = [pool.submit(worker, session, base_url, row, reason, retries, record) for row in targets]
+                for future in as_completed(futures):
+                    result = future.result()
+                    counts[result.status] = counts.get(result.status, 0) + 1
+                    record(result)
+                    if result.status == "failed":
+                        failures.append(result)
+                    progress.update(task, advance=1, failed=len(failures))
+
+    if failures:
+        table = Table(title="Failed")
+        for column in ("gym_id", "scanner_id", "detail"):
+            table.add_column(column)
+        for f in sorted(failures, key=lambda f: (f.row.gym_id, f.row.scanner_id)):
+            table.add_row(str(f.row.gym_id), f.row.scanner_id, f.detail)
+        console.print(table)
+    summary = ", ".join(f"{name} {count}" for name, count in sorted(counts.items()))
+    lines = [f"{summary} across {gyms} gym(s).", f"Manifest: {manifest_path} (mode 600)."]
+    if action == "rotate":
+        lines.append("It holds the new plaintext keys: deploy them to each scanner, then delete the file.")
+    console.print(Panel("\n".join(lines), title=f"{action.capitalize()} finished"))
+    return len(failures)
+
+
+PROBE_ENDPOINTS = {
+    "validate": "attendance-validate-scanner",
+    "verify": "attendance-verify-scan",
+}
+
+# A nil user and token 0 get through the scanner-key lookup and stop at
+# "Token mismatch" (400) before any session or attendance query, so a verify
+# probe measures the authenticated path without writing anything.
+PROBE_USER_ID = "00000000-0000-4000-8000-000000000000"
+
+
+@dataclass
+class ProbeSample:
+    endpoint: str
+    ok: bool
+    status: Optional[int] = None
+    error: Optional[str] = None
+    connect_ms: Optional[float] = None
+    tls_ms: Optional[float] = None
+    ttfb_ms: Optional[float] = None
+    total_ms: Optional[float] = None
+    reused: bool = False
+
+
+def _probe_error(exc: BaseException) -> str:
+    import socket
+    import ssl
+
+    if isinstance(exc, (socket.timeout, TimeoutError)):
+        return "timeout"
+    if isinstance(exc, socket.gaierror):
+        return "dns"
+    if isinstance(exc, ssl.SSLError):
+        return "tls"
+    if isinstance(exc, ConnectionRefusedError):
+        return "connect refused"
+    if isinstance(exc, (ConnectionResetError, BrokenPipeError)):
+        return "connection reset"
+    return type(exc).__name__
+
+
+class _ProbeConnection:
+    """One keep-alive http.client connection that times each phase separately."""
+
+    def __init__(self, url: str, timeout: float) -> None:
+        from urllib.parse import urlsplit
+
+        parts = urlsplit(url)
+        self.tls = parts.scheme == "https"
+        self.host = parts.hostname or ""
+        self.port = parts.port or (443 if self.tls else 80)
+        self.prefix = parts.path.rstrip("/")
+        self.timeout = timeout
+        self.conn = None
+
+    def _connect(self, sample: ProbeSample) -> None:
+        import http.client
+        import socket
+        import ssl
+
+        started = time.perf_counter()
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sample.connect_ms = (time.perf_counter() - started) * 1000.0
+        # http.client sends headers and body separately; without this Nagle + delayed ACK adds ~40 ms.
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.tls:
+            started = time.perf_counter()
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=self.host)
+            sample.tls_ms = (time.perf_counter() - started) * 1000.0
+            conn = http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        else:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        conn.sock = sock
+        self.conn = conn
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def request(self, endpoint: str, body: bytes, headers: Dict[str, str], sample: ProbeSample) -> None:
+        for attempt in range(2):
+            started = time.perf_counter()
+            try:
+                sample.reused = self.conn is not None
+                if self.conn is None:
+                    self._connect(sample)
+                sent = time.perf_counter()
+                self.conn.request("POST", f"{self.prefix}/functions/v1/{endpoint}", body=body, headers=headers)
+                res = self.conn.getresponse()
+                sample.ttfb_ms = (time.perf_counter() - sent) * 1000.0
+                payload = res.read()
+                sample.total_ms = (time.perf_counter() - started) * 1000.0
+                sample.status = res.status
+                if res.will_close:
+                    self.close()
+                break
+            except Exception as exc:
+                self.close()
+                # A kept-alive connection the server already dropped gets one fresh retry.
+                if sample.reused and attempt == 0:
+                    continue
+                sample.error = _probe_error(exc)
+                return
+
+        import json
+
+        if sample.endpoint == "verify":
+            # Anything but the designed "Token mismatch" means the probe didn't reach the auth'd path.
+            sample.ok = res.status == 400 and b"Token mismatch" in payload
+        else:
+            sample.ok = res.status == 200
+        if not sample.ok:
+            detail = ""
+            try:
+                detail = str(json.loads(payload).get("error") or "")[:60]
+            except Exception:
+                pass
+            sample.error = f"http {res.status}" + (f" {detail}" if detail else "")
+
+
+def _percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    values = sorted(values)
+    out: Dict[str, Optional[float]] = {}
+    for name, q in (("p50", 0.50), ("p90", 0.90), ("p99", 0.99), ("max", 1.0)):
+        out[name] = round(values[min(len(values) - 1, int(q * len(values)))], 1) if values else None
+    return out
+
+
+def run_probe(
+    base_url: str,
+    endpoints: List[str],
+    gym_id: int,
+    scanner_id: str,
+    scanner_key: str,
+    requests_per_endpoint: int = 50,
+    concurrency: int = 4,
+    rate: float = 0.0,
+    timeout: float = 10.0,
+    reuse: bool = True,
+) -> Tuple[List[ProbeSample], float]:
+    """Fire rate-limited concurrent POSTs at the scanner edge functions; returns (samples, wall seconds).
+
+    Requests are interleaved across `endpoints` and paced globally at `rate`
+    per second (0 = as fast as `concurrency` allows). Each worker keeps one
+    connection when `reuse` is set, so connect/TLS show up once per worker;
+    without it every request pays for a fresh handshake.
+    """
+    import json
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    headers = {"Content-Type": "application/json", "x-scanner-key": scanner_key}
+    bodies = {
+        "validate": json.dumps({"gym_id": gym_id, "scanner_id": scanner_id}).encode(),
+        "verify": json.dumps(
+            {"user_id": PROBE_USER_ID, "gym_id": gym_id, "token_u32": 0, "scanner_id": scanner_id, "rssi": -60}
+        ).encode(),
+    }
+    plan = [name for _ in range(requests_per_endpoint) for name in endpoints]
+    samples: List[Optional[ProbeSample]] = [None] * len(plan)
+    next_index = [0]
+    lock = threading.Lock()
+    started = time.perf_counter()
+
+    def worker() -> None:
+        connection = _ProbeConnection(base_url, timeout)
+        try:
+            while True:
+                with lock:
+                    i = next_index[0]
+                    next_index[0] += 1
+                if i >= len(plan):
+                    return
+                if rate > 0:
+                    delay = started + i / rate - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                name = plan[i]
+                sample = ProbeSample(endpoint=name, ok=False)
+                connection.request(PROBE_ENDPOINTS[name], bodies[name], headers, sample)
+                samples[i] = sample
+                if not reuse:
+                    connection.close()
+        finally:
+            connection.close()
+
+    workers = max(1, min(concurrency, len(plan)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="probe") as pool:
+        for future in [pool.submit(worker) for _ in range(workers)]:
+            future.result()
+    return [s for s in samples if s is not None], time.perf_counter() - started
+
+
+def summarize_probe(samples: List[ProbeSample], wall_seconds: float) -> Dict[str, Any]:
+    report: Dict[str, Any] = {"wall_seconds": round(wall_seconds, 2), "endpoints": {}}
+    for name in PROBE_ENDPOINTS:
+        mine = [s for s in samples if s.endpoint == name]
+        if not mine:
+            continue
+        errors: Dict[str, int] = {}
+        for s in mine:
+            if not s.ok:
+                errors[s.error or "unknown"] = errors.get(s.error or "unknown", 0) + 1
+        fresh = [s for s in mine if not s.reused]
+        report["endpoints"][name] = {
+            "requests": len(mine),
+            "ok": len(mine) - sum(errors.values()),
+            "rps": round(len(mine) / wall_seconds, 1) if wall_seconds > 0 else None,
+            # The very first call is the best cold-start hint: compare it with p50.
+            "first_ms": round(mine[0].total_ms, 1) if mine[0].total_ms is not None else None,
+            "connect_ms": _percentiles([s.connect_ms for s in fresh if s.connect_ms is not None]),
+            "tls_ms": _percentiles([s.tls_ms for s in fresh if s.tls_ms is not None]),
+            "ttfb_ms": _percentiles([s.ttfb_ms for s in mine if s.ttfb_ms is not None]),
+            "total_ms": _percentiles([s.total_ms for s in mine if s.total_ms is not None]),
+            "errors": dict(sorted(errors.items(), key=lambda kv: -kv[1])),
+        }
+    return report
+
+
+def print_probe_report(report: Dict[str, Any], base_url: str) -> None:
+    try:
+        from rich.console import Console
+        from rich.table import Table
+    except ModuleNotFoundError:
+        print("Install UI deps: pip install -r attendance_scanner/requirements.txt", file=sys.stderr)
+        sys.exit(2)
+
+    console = Console()
+    for name, stats in report["endpoints"].items():
+        table = Table(
+            title=f"{PROBE_ENDPOINTS[name]} @ {base_url}: {stats['ok']}/{stats['requests']} ok, "
+            f"{stats['rps']} req/s, first call {stats['first_ms']} ms"
+        )
+        table.add_column("phase (ms)")
+        for column in ("p50", "p90", "p99", "max"):
+            table.add_column(column, justify="right")
+        for phase in ("connect_ms", "tls_ms", "ttfb_ms", "total_ms"):
+            values = stats[phase]
+            table.add_row(phase[:-3], *("" if values[c] is None else f"{values[c]:.1f}" for c in ("p50", "p90", "p99", "max")))
+        console.print(table)
+        for error, count in stats["errors"].items():
+            console.print(f"  [red]{count} × {error}[/red]")
+
+
 def revoke_scanner(base_url: str, headers: Dict[str, str], gym_id: int) -> None:
     try:
         from rich.console import Console
@@ -377,13 +1205,7 @@ def revoke_scanner(base_url: str, headers: Dict[str, str], gym_id: int) -> None:
         return
 
     patch_endpoint = f"{base_url}/rest/v1/attendance_scanners?id=eq.{target.id}"
-    payload = {
-        "is_active": False,
-        "revoked_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
-        "revoked_reason": reason or None,
-    }
-
-    res = postgrest_request("PATCH", patch_endpoint, headers=headers, json=payload)
+    res = postgrest_request("PATCH", patch_endpoint, headers=headers, json=_revoke_payload(reason))
     if res.status_code not in (200, 204):
         raise RuntimeError(f"Revoke failed ({res.status_code}): {res.text}")
 
@@ -411,14 +1233,90 @@ def main() -> None:
         help="Optional non-sensitive hint to help identify the key later (max 32 chars).",
     )
 
+    bulk = sub.add_parser("bulk-add", help="Register many scanners from a CSV/JSON manifest")
+    bulk.add_argument("manifest", help="CSV with header gym_id,scanner_id[,key_hint], or a JSON list of the same")
+    bulk.add_argument(
+        "--keys-out",
+        default=f"scanner_keys_{time.strftime('%Y%m%d_%H%M%S')}.csv",
+        help="Where to write the generated plaintext keys (created with mode 600, never overwritten)",
+    )
+    bulk.add_argument("--batch-size", type=int, default=500, help="Rows per insert request (default: 500)")
+    bulk.add_argument("--dry-run", action="store_true", help="Validate and check conflicts without inserting")
+
     rm = sub.add_parser("revoke", help="Revoke (disable) a scanner key for a gym")
     rm.add_argument("--gym-id", type=int, required=True)
 
-    ls = sub.add_parser("list", help="List scanners for a gym")
-    ls.add_argument("--gym-id", type=int, required=True)
+    for name, help_text in (
+        ("rotate", "Replace the key of every matching active scanner (new keys go to the manifest)"),
+        ("bulk-revoke", "Revoke every matching active scanner"),
+    ):
+        fleet = sub.add_parser(name, help=help_text)
+        which = fleet.add_mutually_exclusive_group(required=True)
+        which.add_argument("--gym-ids", type=parse_gym_ids, help="Comma-separated gym ids, e.g. 1,2,3")
+        which.add_argument("--all", action="store_true", help="Every gym")
+        fleet.add_argument("--scanner-id", dest="scanner_like", help="Only scanner_ids matching this pattern (* wildcard)")
+        fleet.add_argument("--reason", default="key rotation" if name == "rotate" else "", help="Stored as revoked_reason")
+        fleet.add_argument(
+            "--manifest",
+            default=f"scanner_{name.replace('-', '_')}_{time.strftime('%Y%m%d_%H%M%S')}.csv",
+            help="Per-row results (mode 600, never overwritten)",
+        )
+        fleet.add_argument("--concurrency", type=int, default=8, help="Parallel requests (default: 8)")
+        fleet.add_argument("--retries", type=int, default=3, help="Retries per request on network errors/429/5xx (default: 3)")
+        fleet.add_argument("--dry-run", action="store_true", help="Only count the matching scanners")
+
+    probe = sub.add_parser("probe", help="Measure edge function latency with a test scanner credential")
+    probe.add_argument("--url", help="Base URL to probe, e.g. a local stand-in (default: SUPABASE_URL)")
+    probe.add_argument("--gym-id", type=int, default=int(os.environ.get("ATTENDANCE_GYM_ID") or 0) or None)
+    probe.add_argument("--scanner-id", default=os.environ.get("ATTENDANCE_SCANNER_ID"))
+    probe.add_argument("--scanner-key", default=os.environ.get("ATTENDANCE_SCANNER_KEY"), help="Env: ATTENDANCE_SCANNER_KEY")
+    probe.add_argument("--endpoint", choices=("validate", "verify", "both"), default="both")
+    probe.add_argument("-n", "--requests", type=int, default=50, help="Requests per endpoint (default: 50)")
+    probe.add_argument("--concurrency", type=int, default=4, help="Parallel connections (default: 4)")
+    probe.add_argument("--rate", type=float, default=2.0, help="Overall requests/second, 0 = unlimited (default: 2)")
+    probe.add_argument("--timeout", type=float, default=10.0, help="Per-request timeout in seconds (default: 10)")
+    probe.add_argument("--no-reuse", action="store_true", help="New connection per request (measures every handshake)")
+    probe.add_argument("--json", action="store_true", help="Print the summary as JSON")
+
+    ls = sub.add_parser("list", help="List scanners for a gym, several gyms or the whole fleet")
+    which = ls.add_mutually_exclusive_group(required=True)
+    which.add_argument("--gym-id", type=int)
+    which.add_argument("--gym-ids", type=parse_gym_ids, help="Comma-separated gym ids, e.g. 1,2,3")
+    which.add_argument("--all", action="store_true", help="Every scanner in the fleet")
+    ls.add_argument("--format", choices=("rich", "csv", "ndjson"), default="rich", help="Output format (default: rich)")
+    state = ls.add_mutually_exclusive_group()
+    state.add_argument("--active-only", action="store_true", help="Only scanners with an active key")
+    state.add_argument("--inactive-only", action="store_true", help="Only revoked scanners")
+    ls.add_argument("--page-size", type=int, default=1000, help="Rows per request (default: 1000)")
 
     args = parser.parse_args()
 
+    if args.cmd == "probe":
+        # Scanner credentials only: the service role key is not needed (or wanted) here.
+        if not (args.gym_id and args.scanner_id and args.scanner_key):
+            parser.error("probe needs --gym-id, --scanner-id and --scanner-key (or the ATTENDANCE_* env vars)")
+        base_url = (args.url or require_env("SUPABASE_URL")).rstrip("/")
+        samples, wall = run_probe(
+            base_url,
+            ["validate", "verify"] if args.endpoint == "both" else [args.endpoint],
+            args.gym_id,
+            args.scanner_id,
+            args.scanner_key.strip(),
+            requests_per_endpoint=max(1, args.requests),
+            concurrency=max(1, args.concurrency),
+            rate=max(0.0, args.rate),
+            timeout=args.timeout,
+            reuse=not args.no_reuse,
+        )
+        report = summarize_probe(samples, wall)
+        if args.json:
+            import json
+
+            print(json.dumps(report, indent=2))
+        else:
+            print_probe_report(report, base_url)
+        sys.exit(0 if all(e["ok"] == e["requests"] for e in report["endpoints"].values()) else 1)
+
     supabase_url = require_env("SUPABASE_URL").rstrip("/")
     service_role = require_env("SUPABASE_SERVICE_ROLE_KEY").strip()
 
@@ -434,8 +1332,41 @@ def main() -> None:
             args.scanner_key,
             key_hint=args.key_hint,
         )
+    elif args.cmd == "bulk-add":
+        failed = bulk_add_scanners(
+            base_url,
+            headers,
+            Path(args.manifest).expanduser(),
+            Path(args.keys_out).expanduser(),
+            batch_size=args.batch_size,
+            dry_run=args.dry_run,
+        )
+        sys.exit(1 if failed else 0)
+    elif args.cmd in ("rotate", "bulk-revoke"):
+        failed = fleet_update(
+            base_url,
+            headers,
+            "rotate" if args.cmd == "rotate" else "revoke",
+            None if args.all else args.gym_ids,
+            args.scanner_like,
+            Path(args.manifest).expanduser(),
+            args.reason,
+            concurrency=args.concurrency,
+            retries=max(0, args.retries),
+            dry_run=args.dry_run,
+        )
+        sys.exit(1 if failed else 0)
     elif args.cmd == "revoke":
         revoke_scanner(base_url, headers, args.gym_id)
+    elif args.cmd == "list" and (args.gym_ids or args.all or args.format != "rich" or args.active_only or args.inactive_only):
+        gym_ids = None if args.all else (args.gym_ids or [args.gym_id])
+        active = True if args.active_only else False if args.inactive_only else None
+        session = postgrest_session(headers)
+        try:
+            write_scanners(iter_scanners(session, base_url, gym_ids, active, max(1, args.page_size)), args.format)
+        except BrokenPipeError:
+            # `... | head` closed the pipe; silence the flush at interpreter exit.
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
     elif args.cmd == "list":
         try:
             from rich.console import Console
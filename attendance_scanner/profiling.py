@@ -0,0 +1,295 @@
+"""Opt-in profiling for long-running scanners (scanner.py --profiling, daemon ATTENDANCE_PROFILING=1).
+
+Nothing here runs until asked, and it is driven by POSIX signals so it works on
+an unattended box without a debugger or an open port:
+
+  kill -USR1 <pid>   start a CPU profile; send again to stop early and dump it
+  kill -USR2 <pid>   tracemalloc snapshot; the first one starts tracing, later
+                     ones report the allocation sites that grew since the last
+
+Reports are plain text written to a directory next to the JSONL logs; the
+directory is trimmed (oldest first) to a byte budget after every write, and
+each report is also summarised as a log event.
+"""
+
+import collections
+import linecache
+import os
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Counter, Dict, List, Optional
+
+PROFILE_MODES = ("sample", "cprofile")
+
+
+class StackSampler:
+    """Samples every thread's Python stack at a fixed rate (folded-stack output).
+
+    Unlike cProfile this sees the verify worker threads (gateway.verify runs in
+    asyncio.to_thread), costs a fixed amount per sample instead of per call,
+    and the output loads straight into flamegraph.pl or speedscope.
+    """
+
+    def __init__(self, interval: float = 0.01, max_stacks: int = 20_000) -> None:
+        self.interval = max(0.001, float(interval))
+        self.max_stacks = max(100, int(max_stacks))
+        self.stacks: Counter[str] = collections.Counter()
+        self.samples = 0
+        self.overflow = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                parts: List[str] = []
+                while frame is not None:
+                    code = frame.f_code
+                    parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                parts.append(names.get(ident, str(ident)))
+                key = ";".join(reversed(parts))
+                if key in self.stacks or len(self.stacks) < self.max_stacks:
+                    self.stacks[key] += 1
+                else:
+                    self.overflow += 1
+            self.samples += 1
+
+    def report(self, limit: int) -> str:
+        lines = [f"{stack} {count}" for stack, count in self.stacks.most_common(limit)]
+        if self.overflow:
+            lines.append(f"[other stacks] {self.overflow}")
+        return "\n".join(lines) + "\n"
+
+
+class ProfilingHooks:
+    """SIGUSR1 CPU profiles and SIGUSR2 tracemalloc diffs, written under `directory`.
+
+    `gauges` returns sizes worth watching next to the allocation diff (e.g.
+    the throttle table or queue depth); `log` receives one summary event per
+    report. Everything here runs on the event loop thread.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        prefix: str,
+        log: Callable[[dict], None],
+        gauges: Optional[Callable[[], Dict[str, int]]] = None,
+        mode: str = "sample",
+        max_seconds: float = 120.0,
+        max_bytes: int = 20_000_000,
+        top: int = 40,
+        frames: int = 1,
+    ) -> None:
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"mode must be one of {PROFILE_MODES}, got {mode!r}")
+        self.directory = directory
+        self.prefix = prefix
+        self.log = log
+        self.gauges = gauges
+        self.mode = mode
+        self.max_seconds = max(1.0, float(max_seconds))
+        self.max_bytes = max(1_000_000, int(max_bytes))
+        self.top = max(5, int(top))
+        self.frames = max(1, int(frames))
+
+        self._loop = None
+        self._profiler = None
+        self._profile_started = 0.0
+        self._auto_stop = None
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self._snapshot_at = 0.0
+        self._gauges_before: Dict[str, int] = {}
+
+    def install(self, loop) -> bool:
+        """Hook SIGUSR1/SIGUSR2 on `loop`; False where those signals don't exist (Windows)."""
+        if not hasattr(signal, "SIGUSR1"):
+            return False
+        self._loop = loop
+        loop.add_signal_handler(signal.SIGUSR1, self.toggle_cpu_profile)
+        loop.add_signal_handler(signal.SIGUSR2, self.memory_snapshot)
+        return True
+
+    def close(self) -> None:
+        """Dump a running CPU profile and stop tracemalloc if we started it."""
+        if self._profiler is not None:
+            self.stop_cpu_profile()
+        if self._snapshot is not None:
+            tracemalloc.stop()
+            self._snapshot = None
+        if self._loop is not None and hasattr(signal, "SIGUSR1"):
+            self._loop.remove_signal_handler(signal.SIGUSR1)
+            self._loop.remove_signal_handler(signal.SIGUSR2)
+            self._loop = None
+
+    # CPU.
+
+    def toggle_cpu_profile(self) -> None:
+        if self._profiler is None:
+            self.start_cpu_profile()
+        else:
+            self.stop_cpu_profile()
+
+    def start_cpu_profile(self) -> None:
+        if self.mode == "cprofile":
+            import cProfile
+
+            profiler = cProfile.Profile()
+            profiler.enable()
+        else:
+            profiler = StackSampler()
+            profiler.start()
+        self._profiler = profiler
+        self._profile_started = time.perf_counter()
+        if self._loop is not None:
+            self._auto_stop = self._loop.call_later(self.max_seconds, self.stop_cpu_profile)
+        self.log({"event": "profile_started", "mode": self.mode, "max_seconds": self.max_seconds})
+
+    def stop_cpu_profile(self) -> None:
+        profiler, self._profiler = self._profiler, None
+        if profiler is None:
+            return
+        if self._auto_stop is not None:
+            self._auto_stop.cancel()
+            self._auto_stop = None
+        seconds = time.perf_counter() - self._profile_started
+
+        if self.mode == "cprofile":
+            import io
+            import pstats
+
+            profiler.disable()
+            out = io.StringIO()
+            stats = pstats.Stats(profiler, stream=out)
+            stats.sort_stats("cumulative").print_stats(self.top)
+            stats.sort_stats("tottime").print_stats(self.top)
+            text = f"# cProfile of the event loop thread, {seconds:.1f}s\n" + out.getvalue()
+            detail = {"calls": stats.total_calls}
+        else:
+            profiler.stop()
+            text = (
+                f"# {profiler.samples} samples every {profiler.interval * 1000:.0f} ms over {seconds:.1f}s, "
+                "folded stacks (flamegraph.pl / speedscope)\n" + profiler.report(limit=self.top * 50)
+            )
+            detail = {"samples": profiler.samples, "stacks": len(profiler.stacks)}
+
+        path = self._write("cpu", text)
+        self.log({"event": "profile_written", "mode": self.mode, "seconds": round(seconds, 1), "path": str(path), **detail})
+
+    # Memory.
+
+    def memory_snapshot(self) -> None:
+        gauges = self.gauges() if self.gauges is not None else {}
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._snapshot = self._take_snapshot()
+            self._snapshot_at = time.time()
+            self._gauges_before = gauges
+            self.log({"event": "tracemalloc_started", "frames": self.frames, **gauges})
+            return
+
+        snapshot = self._take_snapshot()
+        previous = self._snapshot if self._snapshot is not None else snapshot
+        growth = snapshot.compare_to(previous, "lineno")[: self.top]
+        elapsed = time.time() - self._snapshot_at
+        current, peak = tracemalloc.get_traced_memory()
+
+        lines = [
+            f"# tracemalloc diff over {elapsed:.0f}s: traced {current / 1024:.0f} KiB (peak {peak / 1024:.0f} KiB)",
+            "# gauges: "
+            + ", ".join(f"{name}={value} ({value - self._gauges_before.get(name, 0):+d})" for name, value in gauges.items()),
+            "",
+        ]
+        for stat in growth:
+            frame = stat.traceback[0]
+            lines.append(
+                f"{stat.size_diff / 1024:+10.1f} KiB {stat.count_diff:+8d} blocks  "
+                f"{stat.size / 1024:10.1f} KiB total  {frame.filename}:{frame.lineno}"
+            )
+            source = linecache.getline(frame.filename, frame.lineno).strip()
+            if source:
+                lines.append(f"{'':>50}{source}")
+        path = self._write("mem", "\n".join(lines) + "\n")
+
+        self.log(
+            {
+                "event": "tracemalloc_diff",
+                "seconds": round(elapsed, 1),
+                "traced_kb": current // 1024,
+                "path": str(path),
+                "top": [
+                    {
+                        "site": f"{os.path.basename(s.traceback[0].filename)}:{s.traceback[0].lineno}",
+                        "size_diff_kb": round(s.size_diff / 1024, 1),
+                        "count_diff": s.count_diff,
+                    }
+                    for s in growth[:5]
+                ],
+                **gauges,
+            }
+        )
+        self._snapshot, self._snapshot_at, self._gauges_before = snapshot, time.time(), gauges
+
+    @staticmethod
+    def _take_snapshot() -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(
+            (
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, linecache.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+            )
+        )
+
+    # Output.
+
+    def _write(self, kind: str, text: str) -> Path:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        stamp = time.strftime("%Y%m%dT%H%M%S", time.localtime())
+        path = self.directory / f"{self.prefix}.{kind}.{stamp}.{os.getpid()}.txt"
+        data = text.encode("utf-8")
+        # A single report never takes more than a quarter of the budget.
+        limit = self.max_bytes // 4
+        if len(data) > limit:
+            data = data[:limit] + b"\n[truncated]\n"
+        path.write_bytes(data)
+        self._trim()
+        return path
+
+    def _trim(self) -> None:
+        reports = []
+        for entry in self.directory.glob(f"{self.prefix}.*.txt"):
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            reports.append((st.st_mtime, st.st_size, entry))
+        reports.sort(reverse=True)
+        total = 0
+        for _mtime, size, entry in reports:
+            total += size
+            if total > self.max_bytes:
+                try:
+                    entry.unlink()
+                except FileNotFoundError:
+                    pass
@@ -2,25 +2,62 @@
 
 import argparse
 import asyncio
-from collections import deque
+from collections import OrderedDict, deque
+import contextlib
+import gzip
+import hashlib
+import itertools
 import json
 import os
+import random
 import re
+import signal
+import struct
 import sys
+import threading
 import time
 import uuid
+import zlib
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, Optional, Tuple
+from typing import Any, Callable, Deque, Dict, List, Optional, Protocol, Tuple
+
+from event_log import _call_later
 
 
 APPLE_COMPANY_ID = 0x004C
 IBEACON_PREFIX = bytes([0x02, 0x15])
 
+# BlueZ advertisement monitor patterns (start_position, AD type, content) for
+# --scan-filter. Manufacturer data AD starts with the little-endian company ID,
+# so the iBeacon prefix sits at offset 2.
+AD_TYPE_MANUFACTURER_DATA = 0xFF
+IBEACON_OR_PATTERN = (2, AD_TYPE_MANUFACTURER_DATA, IBEACON_PREFIX)
+APPLE_IBEACON_OR_PATTERN = (0, AD_TYPE_MANUFACTURER_DATA, APPLE_COMPANY_ID.to_bytes(2, "little") + IBEACON_PREFIX)
+
+SCAN_FILTER_MODES = ("off", "auto", "require")
+
+# Minimum gap between two verifies of the same (user_id, token_u32).
+THROTTLE_SECONDS = 25.0
+
 
 DEFAULT_SUPABASE_URL = "https://bpfptwqysbouppknzaqk.supabase.co"
 
 
+class SystemClock:
+    """Real time source. simulate.VirtualClock has the same shape and runs in virtual time."""
+
+    def time(self) -> float:
+        return time.time()
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+
+SYSTEM_CLOCK = SystemClock()
+
+
 _HEX64_RE = re.compile(r"^[0-9a-fA-F]{64}$")
 
 
@@ -30,6 +67,10 @@ def _safe_filename(value: str) -> str:
     return value or "unknown"
 
 
+# A deferring logger writes once this many events are held, however young they are.
+MAX_DEFERRED_EVENTS = 1000
+
+
 class JsonlLogger:
     def __init__(
         self,
@@ -41,6 +82,11 @@ class JsonlLogger:
         self.max_bytes = max(100_000, int(max_bytes))
         self.backups = max(0, int(backups))
         self.path.parent.mkdir(parents=True, exist_ok=True)
+        # > 0 while shedding load: lines are held and appended together (see defer()).
+        self.defer_seconds = 0.0
+        self._pending: List[str] = []
+        self._pending_since = 0.0
+        self._flush_timer: Optional[asyncio.TimerHandle] = None
 
     def _rotate_if_needed(self) -> None:
         if self.backups <= 0:
@@ -78,9 +124,81 @@ class JsonlLogger:
         self._rotate_if_needed()
         record = dict(event)
         record.setdefault("ts", time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()))
-        line = json.dumps(record, separators=(",", ":"), ensure_ascii=False)
+        self._pending.append(json.dumps(record, separators=(",", ":"), ensure_ascii=False) + "\n")
+        if self.defer_seconds > 0:
+            now = time.monotonic()
+            if len(self._pending) == 1:
+                self._pending_since = now
+                self._flush_timer = _call_later(self.defer_seconds, self.flush)
+            if len(self._pending) < MAX_DEFERRED_EVENTS and now - self._pending_since < self.defer_seconds:
+                return
+        self.flush()
+
+    def flush(self) -> None:
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        if not self._pending:
+            return
+        lines, self._pending = self._pending, []
+        self._rotate_if_needed()
         with self.path.open("a", encoding="utf-8") as f:
-            f.write(line + "\n")
+            f.write("".join(lines))
+
+    def defer(self, seconds: float) -> None:
+        """Hold events for up to `seconds` and write them in one append; 0 writes each event again.
+
+        Timestamps are taken when an event is logged, not when it is written.
+        Held events are written by a loop timer once `seconds` have passed,
+        even if nothing else is logged. A crash while deferring loses them.
+        """
+        self.defer_seconds = max(0.0, float(seconds))
+        if self.defer_seconds == 0:
+            self.flush()
+
+    def close(self) -> None:
+        # Only deferred lines to write; event_log.BinaryEventLogger also closes its file.
+        self.flush()
+
+
+LOG_FORMATS = ("jsonl", "binary")
+
+
+def open_event_logger(path: Path, log_format: str = "jsonl", max_bytes: int = 5_000_000, backups: int = 3):
+    """JsonlLogger, or event_log.BinaryEventLogger for log_format="binary" (same interface)."""
+    if log_format == "binary":
+        from event_log import BinaryEventLogger
+
+        return BinaryEventLogger(path, max_bytes=max_bytes, backups=backups)
+    return JsonlLogger(path, max_bytes=max_bytes, backups=backups)
+
+
+class ConfigError(ValueError):
+    pass
+
+
+def read_env_file(path: Path) -> Dict[str, str]:
+    """Parse a KEY=VALUE file (blank lines, # comments, `export` and quotes allowed)."""
+    values: Dict[str, str] = {}
+    for lineno, raw in enumerate(path.read_text(encoding="utf-8").splitlines(), start=1):
+        line = raw.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("export "):
+            line = line[len("export ") :].lstrip()
+        key, sep, value = line.partition("=")
+        key = key.strip()
+        if not sep or not key:
+            raise ConfigError(f"{path}:{lineno}: expected KEY=VALUE")
+        value = value.strip()
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in "'\"":
+            value = value[1:-1]
+        values[key] = value
+    return values
+
+
+def env_flag(value: str) -> bool:
+    return value.strip().lower() in ("1", "true", "yes", "on")
 
 
 def _looks_like_scanner_key(value: str) -> bool:
@@ -96,6 +214,13 @@ class BeaconFrame:
     rssi: int
 
 
+@dataclass(frozen=True)
+class VerifyResult:
+    ok: bool
+    status_code: Optional[int] = None
+    detail: Optional[str] = None
+
+
 def parse_ibeacon(manufacturer_data: bytes, rssi: int) -> Optional[BeaconFrame]:
     """Parse Apple iBeacon manufacturer data into (uuid, major, minor)."""
     if len(manufacturer_data) < 2 + 16 + 2 + 2 + 1:
@@ -123,7 +248,74 @@ def parse_ibeacon(manufacturer_data: bytes, rssi: int) -> Optional[BeaconFrame]:
     )
 
 
+def parse_advertisement(
+    stats,
+    manufacturer_data,
+    rssi: int,
+    strict_apple_id: bool = False,
+    debug=None,
+) -> Optional[Tuple[int, BeaconFrame]]:
+    """Pick the first iBeacon frame out of a Bleak manufacturer_data map.
+
+    Returns (company_id, frame) or None. `stats` is anything with the
+    adv_with_mfg / adv_ibeacon_prefix / frames_parsed counters (normally the
+    AttendanceGateway). `debug(company_id, payload_bytes)` is called for every
+    manufacturer payload inspected.
+    """
+    md = manufacturer_data or {}
+    if not md:
+        return None
+
+    stats.adv_with_mfg += 1
+
+    items = []
+    if strict_apple_id:
+        if APPLE_COMPANY_ID in md:
+            items = [(APPLE_COMPANY_ID, md[APPLE_COMPANY_ID])]
+    else:
+        items = list(md.items())
+
+    for company_id, payload in items:
+        try:
+            payload_bytes = bytes(payload)
+        except Exception:
+            payload_bytes = payload
+
+        if payload_bytes[:2] == IBEACON_PREFIX:
+            stats.adv_ibeacon_prefix += 1
+
+        if debug is not None:
+            debug(company_id, payload_bytes)
+
+        frame = parse_ibeacon(payload_bytes, rssi)
+        if frame is not None:
+            stats.frames_parsed += 1
+            return company_id, frame
+
+    return None
+
+
+def verify_idempotency_key(scanner_id: str, user_id: str, token_u32: int) -> str:
+    """Idempotency-Key for one verify: the same for its retries and hedged copies, new with each token."""
+    return hashlib.sha256(f"{scanner_id}|{user_id}|{int(token_u32)}".encode("utf-8")).hexdigest()
+
+
 class AttendanceGateway:
+    """Throttle, verify calls and the counters the UI, heartbeats and logs read.
+
+    verify() hedges: when no response has arrived by hedge_deadline_ms()
+    (hedge_percentile of recent round trips, at least hedge_min_ms, at most
+    half the HTTP timeout) a second copy of the request goes out with the
+    same Idempotency-Key and whichever answers first is used. The other one
+    is cancelled if it hasn't started, otherwise it is not retried and its
+    answer is ignored. Hedges are limited to `hedge_budget` of verifies (a
+    small burst may exceed that); a budget of 0 turns hedging off.
+    """
+
+    HEDGE_WARMUP = 20  # round trips seen before the percentile is trusted
+    HEDGE_INITIAL_MS = 2000.0
+    HEDGE_BURST = 3.0
+
     def __init__(
         self,
         supabase_url: str,
@@ -133,21 +325,49 @@ class AttendanceGateway:
         min_rssi: int,
         http_timeout_seconds: float,
         http_retries: int,
+        clock: Optional[SystemClock] = None,
+        throttle_seconds: float = THROTTLE_SECONDS,
+        hedge_budget: float = 0.1,
+        hedge_percentile: float = 95.0,
+        hedge_min_ms: float = 250.0,
     ) -> None:
         self.supabase_url = supabase_url.rstrip("/")
         self.gym_id = gym_id
         self.scanner_key = scanner_key
         self.scanner_id = scanner_id
         self.min_rssi = min_rssi
+        self.clock = clock if clock is not None else SYSTEM_CLOCK
+        self.throttle_seconds = float(throttle_seconds)
 
         self.http_timeout_seconds = float(http_timeout_seconds)
         self.http_retries = max(1, int(http_retries))
 
+        self.hedge_budget = max(0.0, float(hedge_budget))
+        self.hedge_percentile = min(99.9, max(50.0, float(hedge_percentile)))
+        self.hedge_min_ms = max(0.0, float(hedge_min_ms))
+        # Every verify round trip that got a response, hedges and losers included; the deadline comes from these.
+        self.attempt_latencies_ms: Deque[float] = deque(maxlen=256)
+        # Several verify threads hedge at once: the token bucket and hedge counters change under this lock.
+        self._hedge_lock = threading.Lock()
+        self._hedge_tokens = 1.0
+        # No threads until the first verify; both copies of a hedged verify run here.
+        self._hedge_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="verify")
+        self.hedges_sent = 0
+        self.hedge_wins = 0
+        # Losing copies left running when the other answered; they aren't retried and their answer is ignored.
+        self.hedges_abandoned = 0
+        self.hedges_over_budget = 0
+
         self.key_hint: Optional[str] = None
 
         # Throttle: (user_id, token_u32) -> last_sent_epoch
         self._last_sent: Dict[Tuple[str, int], float] = {}
 
+        # Most recent successful verifies (newest first), shown in the UI.
+        self.recent_verified: Deque[dict] = deque(maxlen=5)
+        # Verify round-trip times (ms) not yet folded into a heartbeat (see HeartbeatReporter).
+        self.verify_latencies_ms: Deque[float] = deque(maxlen=2048)
+
         # Scan diagnostics (these are updated from the Bleak callback thread)
         self.adv_seen = 0
         self.adv_with_mfg = 0
@@ -170,7 +390,35 @@ class AttendanceGateway:
         self.last_err: Optional[str] = None
         self.last_status_code: Optional[int] = None
 
-    def _post_json_with_retries(self, endpoint: str, headers: dict, payload: dict):
+        # Warm-restart snapshot diagnostics (see GatewayStateStore).
+        self.state_restored_entries = 0
+        self.state_saves = 0
+        self.state_last_bytes = 0
+        self.state_last_ms = 0.0
+
+        # Optional LAN claim sharing with co-located scanners (see ScannerGossip).
+        self.gossip: Optional["ScannerGossip"] = None
+        self.gossip_suppressed = 0
+
+        # Frames the capture process couldn't hand over (--split-process).
+        self.ring_producer_dropped = 0
+
+        # How the BLE source is scanning ("active" / "passive") and why passive wasn't used.
+        self.scan_mode: Optional[str] = None
+        self.scan_fallback: Optional[str] = None
+        # Per-second rates over the last maintenance interval (see AttendancePipeline).
+        self.adv_rate = 0.0
+        self.ibeacon_rate = 0.0
+
+        # BLE scanner stall watchdogs by adapter (in-process) and their totals (also fed from the capture ring).
+        self.scan_watchdogs: Dict[str, "ScanWatchdog"] = {}
+        self.scanner_stalls = 0
+        self.scanner_restarts = 0
+        self.scanner_stalled = False
+
+    def _post_json_with_retries(
+        self, endpoint: str, headers: dict, payload: dict, cancelled: Optional[threading.Event] = None
+    ):
         import requests
 
         last_exc: Optional[Exception] = None
@@ -185,130 +433,2846 @@ class AttendanceGateway:
             except Exception as e:
                 last_exc = e
                 if attempt < self.http_retries - 1:
-                    time.sleep(0.6 * (2**attempt))
-                    continue
+                    # A hedged copy that already lost stops here instead of retrying.
+                    if cancelled is None:
+                        time.sleep(0.6 * (2**attempt))
+                        continue
+                    if not cancelled.wait(0.6 * (2**attempt)):
+                        continue
                 raise
 
         raise last_exc or RuntimeError("request failed")
 
+    def hedge_deadline_ms(self) -> float:
+        """How long a verify waits for a response before a hedged copy is sent."""
+        samples = sorted(self.attempt_latencies_ms)
+        deadline = self.HEDGE_INITIAL_MS
+        if len(samples) >= self.HEDGE_WARMUP:
+            deadline = _percentile(samples, self.hedge_percentile)
+        # Past half the timeout a hedge has little left to win.
+        return min(max(self.hedge_min_ms, deadline), self.http_timeout_seconds * 500.0)
+
+    def _timed_post(self, endpoint: str, headers: dict, payload: dict, cancelled: threading.Event):
+        started = time.perf_counter()
+        res = self._post_json_with_retries(endpoint, headers, payload, cancelled)
+        self.attempt_latencies_ms.append((time.perf_counter() - started) * 1000.0)
+        return res
+
+    def _post_hedged(self, endpoint: str, headers: dict, payload: dict):
+        """_post_json_with_retries(), plus one hedged copy if the first response is late; first response wins."""
+        if self.hedge_budget <= 0:
+            return self._post_json_with_retries(endpoint, headers, payload)
+        with self._hedge_lock:
+            self._hedge_tokens = min(self.HEDGE_BURST, self._hedge_tokens + self.hedge_budget)
+
+        cancelled = threading.Event()
+        primary = self._hedge_pool.submit(self._timed_post, endpoint, headers, payload, cancelled)
+        done, _ = wait([primary], timeout=self.hedge_deadline_ms() / 1000.0)
+        if done:
+            return primary.result()
+        with self._hedge_lock:
+            over_budget = self._hedge_tokens < 1.0
+            if over_budget:
+                self.hedges_over_budget += 1
+            else:
+                self._hedge_tokens -= 1.0
+                self.hedges_sent += 1
+        if over_budget:
+            return primary.result()
+        hedge = self._hedge_pool.submit(self._timed_post, endpoint, headers, payload, cancelled)
+
+        pending = {primary, hedge}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winner: Optional[Future] = next((f for f in done if f.exception() is None), None)
+            if winner is None:
+                error = next(iter(done)).exception()
+                continue
+            cancelled.set()
+            # cancel() only stops a copy still queued in the pool; a running one stops at its next retry.
+            abandoned = sum(1 for loser in pending if not loser.cancel())
+            with self._hedge_lock:
+                if winner is hedge:
+                    self.hedge_wins += 1
+                self.hedges_abandoned += abandoned
+            return winner.result()
+        raise error or RuntimeError("request failed")
+
+    def hedge_stats(self) -> dict:
+        return {
+            "hedges_sent": self.hedges_sent,
+            "hedge_wins": self.hedge_wins,
+            "hedges_abandoned": self.hedges_abandoned,
+            "hedges_over_budget": self.hedges_over_budget,
+            "hedge_rate": round(self.hedges_sent / self.requests_sent, 4) if self.requests_sent else 0.0,
+            "hedge_deadline_ms": round(self.hedge_deadline_ms(), 1),
+        }
+
+    def close(self) -> None:
+        # Don't wait for abandoned hedges; they finish (or time out) on their own.
+        self._hedge_pool.shutdown(wait=False, cancel_futures=True)
+
     def should_send(self, frame: BeaconFrame) -> bool:
         self.frames_seen += 1
         self.last_seen = frame
         if frame.rssi < self.min_rssi:
             return False
 
-        key = (frame.user_id, frame.token_u32)
-        now = time.time()
-        last = self._last_sent.get(key, 0)
-        if now - last < 25:
-            return False
+        key = (frame.user_id, frame.token_u32)
+        now = self.clock.time()
+        last = self._last_sent.get(key, 0)
+        if now - last < self.throttle_seconds:
+            return False
+
+        if self.gossip is not None and self.gossip.is_claimed(key, now):
+            self.gossip_suppressed += 1
+            return False
+
+        # Peers hear about the frame once it is actually queued (AttendancePipeline.submit_frame).
+        self._last_sent[key] = now
+        return True
+
+    def in_flight_ttl_seconds(self) -> float:
+        """How long peers should hold off while our verify for a frame is outstanding."""
+        return min(self.throttle_seconds, self.http_timeout_seconds + 2.0)
+
+    def prune_throttle(self, now: Optional[float] = None) -> int:
+        """Drop throttle entries whose window has passed; returns how many were removed."""
+        now = self.clock.time() if now is None else now
+        expired = [k for k, last in self._last_sent.items() if now - last >= self.throttle_seconds]
+        for k in expired:
+            self._last_sent.pop(k, None)
+        return len(expired)
+
+    def verify(self, frame: BeaconFrame) -> VerifyResult:
+        self.requests_sent += 1
+        endpoint = f"{self.supabase_url}/functions/v1/attendance-verify-scan"
+        headers = {
+            "Content-Type": "application/json",
+            "x-scanner-key": self.scanner_key,
+            "Idempotency-Key": verify_idempotency_key(self.scanner_id, frame.user_id, frame.token_u32),
+        }
+        payload = {
+            "user_id": frame.user_id,
+            "gym_id": self.gym_id,
+            "token_u32": frame.token_u32,
+            "scanner_id": self.scanner_id,
+            "rssi": frame.rssi,
+        }
+
+        started = time.perf_counter()
+        try:
+            res = self._post_hedged(endpoint, headers=headers, payload=payload)
+        except Exception as e:
+            self.last_err_at = self.clock.time()
+            self.last_err = f"network error: {e}"
+            self.last_status_code = None
+            return VerifyResult(ok=False, status_code=None, detail=self.last_err)
+
+        self.verify_latencies_ms.append((time.perf_counter() - started) * 1000.0)
+        self.last_status_code = res.status_code
+
+        if 200 <= res.status_code < 300:
+            self.requests_ok += 1
+            self.last_ok_at = self.clock.time()
+            try:
+                data = res.json()
+            except Exception:
+                data = res.text
+            self.last_ok = str(data)
+            return VerifyResult(ok=True, status_code=res.status_code, detail=self.last_ok)
+
+        self.requests_err += 1
+        self.last_err_at = self.clock.time()
+        try:
+            err = res.json()
+        except Exception:
+            err = res.text
+
+        if res.status_code == 401:
+            self.last_err = (
+                "Unauthorized (401). Verify ATTENDANCE_SCANNER_KEY and that your scanner is registered as active "
+                f"for gym_id={self.gym_id} and scanner_id={self.scanner_id}."
+            )
+        else:
+            self.last_err = f"status={res.status_code} -> {err}"
+        return VerifyResult(ok=False, status_code=res.status_code, detail=self.last_err)
+
+    def validate_scanner_key(self) -> bool:
+        """Preflight check: ensure (gym_id, scanner_id, key) is registered and active.
+
+        This calls an Edge Function so the scanner never needs the stored hash.
+        """
+
+        endpoint = f"{self.supabase_url}/functions/v1/attendance-validate-scanner"
+        headers = {
+            "Content-Type": "application/json",
+            "x-scanner-key": self.scanner_key,
+        }
+        payload = {
+            "gym_id": self.gym_id,
+            "scanner_id": self.scanner_id,
+        }
+
+        try:
+            res = self._post_json_with_retries(endpoint, headers=headers, payload=payload)
+        except Exception as e:
+            self.last_err_at = self.clock.time()
+            self.last_err = (
+                f"key validation network error: {e} (timeout={self.http_timeout_seconds}s, retries={self.http_retries})"
+            )
+            self.last_status_code = None
+            return False
+
+        self.last_status_code = res.status_code
+
+        if 200 <= res.status_code < 300:
+            self.last_ok_at = self.clock.time()
+            self.last_ok = "scanner key validated"
+            try:
+                data = res.json()
+                hint = data.get("key_hint") if isinstance(data, dict) else None
+                self.key_hint = str(hint).strip() if hint else None
+            except Exception:
+                self.key_hint = None
+            return True
+
+        self.last_err_at = self.clock.time()
+        if res.status_code == 401:
+            self.last_err = "Invalid scanner key (401)."
+        elif res.status_code == 404:
+            self.last_err = (
+                "Validation function not found (404). Deploy the Edge Function 'attendance-validate-scanner'."
+            )
+        else:
+            self.last_err = f"key validation failed: status={res.status_code} -> {res.text}"
+        return False
+
+
+# Cumulative counters carried across restarts by GatewayStateStore.
+_SNAPSHOT_COUNTERS = (
+    "adv_seen",
+    "adv_with_mfg",
+    "adv_ibeacon_prefix",
+    "enqueued",
+    "dropped_queue_full",
+    "poll_cycles",
+    "frames_seen",
+    "frames_parsed",
+    "requests_sent",
+    "requests_ok",
+    "requests_err",
+    "gossip_suppressed",
+)
+
+
+class GatewayStateStore:
+    """Compact binary snapshot of the gateway's dedupe and counter state.
+
+    Layout (little endian):
+      header   magic "LCGS", u16 version, u16 reserved, f64 saved_at,
+               u32 n_throttle, u32 n_recent, u16 names_len
+      names    comma separated counter names (utf-8), then one u64 per name
+      throttle n_throttle x (16s user uuid, u32 token_u32, f64 last_sent)
+      recent   n_recent x (16s user uuid, 8s HH:MM:SS, i16 rssi, u16 status)
+      trailer  u32 crc32 of everything above
+
+    Only throttle entries still inside the throttle window are written, capped at
+    max_entries (newest kept), so the file and the save cost stay bounded.
+    """
+
+    MAGIC = b"LCGS"
+    VERSION = 1
+
+    _HEADER = struct.Struct("<4sHHdIIH")
+    _COUNTER = struct.Struct("<Q")
+    _THROTTLE = struct.Struct("<16sId")
+    _RECENT = struct.Struct("<16s8shH")
+    _CRC = struct.Struct("<I")
+
+    def __init__(self, path: Path, max_entries: int = 20_000) -> None:
+        self.path = path
+        self.max_entries = max(1, int(max_entries))
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # A cancelled save_async() can still be writing when the shutdown save() starts.
+        self._write_lock = threading.Lock()
+
+    def encode(self, gateway: "AttendanceGateway", now: Optional[float] = None) -> bytes:
+        now = gateway.clock.time() if now is None else now
+
+        throttle = [
+            (k, last) for k, last in list(gateway._last_sent.items()) if now - last < gateway.throttle_seconds
+        ]
+        if len(throttle) > self.max_entries:
+            throttle.sort(key=lambda item: item[1], reverse=True)
+            throttle = throttle[: self.max_entries]
+        recent = list(gateway.recent_verified)
+
+        names = ",".join(_SNAPSHOT_COUNTERS).encode("utf-8")
+        parts = [
+            self._HEADER.pack(self.MAGIC, self.VERSION, 0, now, len(throttle), len(recent), len(names)),
+            names,
+        ]
+        for name in _SNAPSHOT_COUNTERS:
+            parts.append(self._COUNTER.pack(max(0, int(getattr(gateway, name, 0)))))
+        # Keys come from parse_ibeacon (canonical UUID strings); fromhex is ~7x cheaper than uuid.UUID here.
+        for (user_id, token_u32), last in throttle:
+            parts.append(self._THROTTLE.pack(bytes.fromhex(user_id.replace("-", "")), token_u32 & 0xFFFFFFFF, last))
+        for r in recent:
+            parts.append(
+                self._RECENT.pack(
+                    uuid.UUID(str(r.get("user"))).bytes,
+                    str(r.get("at", "")).encode("ascii", "replace")[:8],
+                    int(r.get("rssi") or 0),
+                    int(r.get("status") or 0),
+                )
+            )
+
+        body = b"".join(parts)
+        return body + self._CRC.pack(zlib.crc32(body))
+
+    def write(self, data: bytes) -> None:
+        """Atomically replace the snapshot file with an encoded snapshot (blocking: fsync + rename)."""
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        with self._write_lock:
+            with tmp.open("wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+
+    def save(self, gateway: "AttendanceGateway") -> int:
+        """Atomically write a snapshot; returns the number of bytes written."""
+        started = time.perf_counter()
+        data = self.encode(gateway)
+        self.write(data)
+        return self._saved(gateway, data, started)
+
+    async def save_async(self, gateway: "AttendanceGateway") -> int:
+        """save() for the event loop: encode there (it reads live state), write and fsync in a thread."""
+        started = time.perf_counter()
+        data = self.encode(gateway)
+        await asyncio.to_thread(self.write, data)
+        return self._saved(gateway, data, started)
+
+    def _saved(self, gateway: "AttendanceGateway", data: bytes, started: float) -> int:
+        gateway.state_saves += 1
+        gateway.state_last_bytes = len(data)
+        gateway.state_last_ms = (time.perf_counter() - started) * 1000.0
+        return len(data)
+
+    def load(self, gateway: "AttendanceGateway", now: Optional[float] = None) -> int:
+        """Restore a snapshot into the gateway; returns throttle entries restored.
+
+        Missing, truncated or corrupt files are ignored (cold start).
+        """
+        now = gateway.clock.time() if now is None else now
+        try:
+            data = self.path.read_bytes()
+        except FileNotFoundError:
+            return 0
+
+        if len(data) < self._HEADER.size + self._CRC.size:
+            return 0
+        body, (crc,) = data[: -self._CRC.size], self._CRC.unpack(data[-self._CRC.size :])
+        if zlib.crc32(body) != crc:
+            return 0
+
+        magic, version, _reserved, _saved_at, n_throttle, n_recent, names_len = self._HEADER.unpack_from(body, 0)
+        if magic != self.MAGIC or version != self.VERSION:
+            return 0
+
+        offset = self._HEADER.size
+        names = body[offset : offset + names_len].decode("utf-8").split(",") if names_len else []
+        offset += names_len
+
+        for name in names:
+            (value,) = self._COUNTER.unpack_from(body, offset)
+            offset += self._COUNTER.size
+            if name in _SNAPSHOT_COUNTERS:
+                setattr(gateway, name, int(getattr(gateway, name, 0)) + value)
+
+        restored = 0
+        for _ in range(n_throttle):
+            user_bytes, token_u32, last = self._THROTTLE.unpack_from(body, offset)
+            offset += self._THROTTLE.size
+            if now - last >= gateway.throttle_seconds:
+                continue
+            key = (str(uuid.UUID(bytes=user_bytes)), token_u32)
+            if last > gateway._last_sent.get(key, 0):
+                gateway._last_sent[key] = last
+                restored += 1
+
+        recent = []
+        for _ in range(n_recent):
+            user_bytes, at, rssi, status = self._RECENT.unpack_from(body, offset)
+            offset += self._RECENT.size
+            recent.append(
+                {
+                    "at": at.rstrip(b"\x00").decode("ascii", "replace"),
+                    "user": str(uuid.UUID(bytes=user_bytes)),
+                    "rssi": rssi,
+                    "status": status or None,
+                }
+            )
+        if not gateway.recent_verified:
+            gateway.recent_verified.extend(recent)
+
+        gateway.state_restored_entries = restored
+        return restored
+
+
+def _percentile(sorted_values: List[float], pct: float, ndigits: int = 1) -> Optional[float]:
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100.0 * (len(sorted_values) - 1))))
+    return round(sorted_values[index], ndigits)
+
+
+class HeartbeatReporter:
+    """Periodic health rows for the attendance-scanner-heartbeat Edge Function.
+
+    Every window the gateway's counters are turned into deltas (plus verify
+    latency percentiles, queue depth and scanner health) and appended to a
+    bounded pending queue; uploads send up to `batch_size` rows as one gzip'd
+    JSON POST from a worker thread, so the scanning loop only pays for a few
+    attribute reads. While Supabase is unreachable rows keep accumulating
+    (oldest dropped past `max_pending`) and go out together once it's back;
+    `spool_path` carries them across restarts. Idle windows (no beacons, no
+    verifies) double the interval up to `idle_interval`.
+    """
+
+    ENDPOINT = "attendance-scanner-heartbeat"
+
+    def __init__(
+        self,
+        gateway: AttendanceGateway,
+        verify_queue: "FairVerifyQueue",
+        interval: float = 60.0,
+        idle_interval: float = 600.0,
+        max_pending: int = 1440,
+        batch_size: int = 500,
+        spool_path: Optional[Path] = None,
+        extra: Optional[Callable[[], dict]] = None,
+    ) -> None:
+        self.gateway = gateway
+        self.verify_queue = verify_queue
+        self.interval = max(5.0, float(interval))
+        self.idle_interval = max(self.interval, float(idle_interval))
+        self.batch_size = max(1, int(batch_size))
+        self.spool_path = spool_path
+        self.extra = extra
+        self.pending: Deque[dict] = deque(maxlen=max(1, int(max_pending)))
+        self.current_interval = self.interval
+
+        self._started = gateway.clock.monotonic()
+        self._window_started = self._started
+        self._last = self._counters()
+        self._retry_at = 0.0
+        self._failures = 0
+        # spool_path holds rows that have since been uploaded (or changed).
+        self._spool_stale = False
+
+        self.rows_sent = 0
+        self.batches_sent = 0
+        self.bytes_sent = 0
+        self.upload_errors = 0
+        self.rows_dropped = 0
+        self.last_ok_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def _counters(self) -> Dict[str, int]:
+        g = self.gateway
+        return {
+            "adv_seen": g.adv_seen,
+            "frames_parsed": g.frames_parsed,
+            "enqueued": g.enqueued,
+            "dropped_queue_full": g.dropped_queue_full,
+            "verifies_ok": g.requests_ok,
+            "verifies_err": g.requests_err,
+            "poll_cycles": g.poll_cycles,
+            "adv_ibeacon_prefix": g.adv_ibeacon_prefix,
+            "verify_hedged": g.hedges_sent,
+            "verify_hedge_wins": g.hedge_wins,
+        }
+
+    def sample(self) -> dict:
+        """Close the current window: append its row to `pending` and return it."""
+        g = self.gateway
+        now = g.clock.monotonic()
+        window = max(1e-9, now - self._window_started)
+        counters = self._counters()
+        delta = {name: counters[name] - self._last.get(name, 0) for name in counters}
+        self._last, self._window_started = counters, now
+
+        latencies = sorted(g.verify_latencies_ms)
+        g.verify_latencies_ms.clear()
+        idle = not (delta["frames_parsed"] or delta["verifies_ok"] or delta["verifies_err"]) and self.verify_queue.qsize() == 0
+
+        sampled_at = g.clock.time()
+        row = {
+            "sampled_at": round(sampled_at, 3),
+            "window_seconds": round(window, 1),
+            "uptime_seconds": round(now - self._started, 1),
+            "idle": idle,
+            "scan_mode": g.scan_mode,
+            # Receiving anything (callbacks or polls) and the stall watchdog is happy.
+            "adapter_ok": bool(delta["adv_seen"] or delta["poll_cycles"]) and not g.scanner_stalled,
+            "scanner_stalls": g.scanner_stalls,
+            "adv_seen": delta["adv_seen"],
+            "adv_per_second": round(delta["adv_seen"] / window, 2),
+            "ibeacon_per_second": round(delta["adv_ibeacon_prefix"] / window, 2),
+            "frames_parsed": delta["frames_parsed"],
+            "enqueued": delta["enqueued"],
+            "dropped_queue_full": delta["dropped_queue_full"],
+            "queue_depth": self.verify_queue.qsize(),
+            "verifies_ok": delta["verifies_ok"],
+            "verifies_err": delta["verifies_err"],
+            "verify_p50_ms": _percentile(latencies, 50),
+            "verify_p95_ms": _percentile(latencies, 95),
+            "verify_p99_ms": _percentile(latencies, 99),
+            "verify_hedged": delta["verify_hedged"],
+            "verify_hedge_wins": delta["verify_hedge_wins"],
+            "verify_hedge_deadline_ms": round(g.hedge_deadline_ms(), 1) if g.hedge_budget > 0 else None,
+            "last_error": g.last_err if g.last_err_at and g.last_err_at >= sampled_at - window else None,
+        }
+        if self.extra is not None:
+            row.update(self.extra())
+        if len(self.pending) == self.pending.maxlen:
+            self.rows_dropped += 1
+        self.pending.append(row)
+
+        self.current_interval = min(self.idle_interval, self.current_interval * 2) if idle else self.interval
+        return row
+
+    def encode(self, rows: List[dict]) -> bytes:
+        body = {"gym_id": self.gateway.gym_id, "scanner_id": self.gateway.scanner_id, "heartbeats": rows}
+        return gzip.compress(json.dumps(body, separators=(",", ":")).encode("utf-8"), compresslevel=6)
+
+    def _post(self, body: bytes) -> Tuple[Optional[int], str]:
+        import requests
+
+        g = self.gateway
+        try:
+            res = requests.post(
+                f"{g.supabase_url}/functions/v1/{self.ENDPOINT}",
+                headers={
+                    "Content-Type": "application/json",
+                    "Content-Encoding": "gzip",
+                    "x-scanner-key": g.scanner_key,
+                },
+                data=body,
+                timeout=g.http_timeout_seconds,
+            )
+        except Exception as e:
+            return None, f"network error: {e}"
+        return res.status_code, res.text[:200]
+
+    async def flush(self) -> int:
+        """Upload pending rows in batches until done or a batch fails; returns rows sent."""
+        clock = self.gateway.clock
+        sent = 0
+        while self.pending and clock.monotonic() >= self._retry_at:
+            batch = list(itertools.islice(self.pending, self.batch_size))
+            body = self.encode(batch)
+            status, detail = await asyncio.to_thread(self._post, body)
+            if status is not None and 200 <= status < 300:
+                for _ in batch:
+                    self.pending.popleft()
+                sent += len(batch)
+                self.rows_sent += len(batch)
+                self.batches_sent += 1
+                self.bytes_sent += len(body)
+                self.last_ok_at = clock.time()
+                self._failures = 0
+                continue
+
+            self.upload_errors += 1
+            self._failures += 1
+            if status == 404:
+                detail = f"Edge Function '{self.ENDPOINT}' not deployed (404)"
+            self.last_error = detail if status is None else f"status={status}: {detail}"
+            self._retry_at = clock.monotonic() + min(900.0, self.interval * 2 ** min(self._failures, 6))
+            self.save_spool()
+            break
+        if sent and self._spool_stale:
+            self.save_spool()
+        return sent
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.current_interval)
+            self.sample()
+            await self.flush()
+
+    def load_spool(self) -> int:
+        """Queue rows left over from a previous run; returns how many."""
+        if self.spool_path is None:
+            return 0
+        try:
+            data = gzip.decompress(self.spool_path.read_bytes())
+            rows = [json.loads(line) for line in data.decode("utf-8").splitlines() if line]
+        except FileNotFoundError:
+            return 0
+        except (OSError, EOFError, ValueError):
+            # Torn or foreign file: telemetry isn't worth failing startup over.
+            return 0
+        for row in reversed(rows):
+            if len(self.pending) == self.pending.maxlen:
+                break
+            self.pending.appendleft(row)
+        self._spool_stale = True
+        return len(rows)
+
+    def save_spool(self) -> None:
+        if self.spool_path is None:
+            return
+        try:
+            self._spool_stale = bool(self.pending)
+            if not self.pending:
+                self.spool_path.unlink(missing_ok=True)
+                return
+            self.spool_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.spool_path.with_suffix(self.spool_path.suffix + ".tmp")
+            lines = "".join(json.dumps(row, separators=(",", ":")) + "\n" for row in self.pending)
+            tmp.write_bytes(gzip.compress(lines.encode("utf-8")))
+            os.replace(tmp, self.spool_path)
+        except OSError as e:
+            self.last_error = f"spool write failed: {e}"
+
+    def summary(self) -> str:
+        if self._failures:
+            state = f"[yellow]{self.last_error}[/yellow]"
+        elif self.last_ok_at is not None:
+            state = f"ok {time.strftime('%H:%M:%S', time.localtime(self.last_ok_at))}"
+        else:
+            state = "waiting"
+        return f"{state}, every {self.current_interval:.0f}s, pending {len(self.pending)}"
+
+
+# Claim kinds shared between co-located scanners.
+CLAIM_IN_FLIGHT = 1
+CLAIM_VERIFIED = 2
+CLAIM_RELEASE = 3
+
+DEFAULT_GOSSIP_GROUP = "239.255.76.67"
+DEFAULT_GOSSIP_PORT = 47476
+
+
+class ScannerGossip:
+    """Share "in-flight"/"verified" claims for (user_id, token_u32) with peer scanners.
+
+    Every scanner at a gym announces a claim when it queues a frame for
+    verify and again once the verify succeeded (or releases it on failure, or
+    when the frame is dropped from the queue). Peers skip frames that are
+    claimed. Claims carry a TTL, capped at `max_ttl_seconds` (the receiving
+    gateway's throttle window), that the receiver applies on arrival, so they
+    expire on their own if a peer disappears and clock skew between laptops
+    doesn't matter.
+
+    Wire format (little endian, 40 bytes + optional 8 byte HMAC):
+      magic "LCGC", u8 version, u8 kind, u16 reserved, u32 gym_id,
+      u64 sender, 16s user uuid, u32 token_u32, u32 ttl_ms
+    """
+
+    MAGIC = b"LCGC"
+    VERSION = 1
+
+    _MSG = struct.Struct("<4sBBHIQ16sII")
+    _MAC_LEN = 8
+
+    def __init__(
+        self,
+        gym_id: int,
+        secret: Optional[str] = None,
+        clock: Optional[SystemClock] = None,
+        max_ttl_seconds: float = THROTTLE_SECONDS,
+    ) -> None:
+        self.gym_id = int(gym_id)
+        self.clock = clock if clock is not None else SYSTEM_CLOCK
+        self.max_ttl_seconds = float(max_ttl_seconds)
+        self.sender = int.from_bytes(os.urandom(8), "little")
+        self._secret = secret.encode("utf-8") if secret else None
+        self._send = None
+
+        # (user_id, token_u32) -> (kind, expires_at_epoch)
+        self._claims: Dict[Tuple[str, int], Tuple[int, float]] = {}
+
+        self.sent = 0
+        self.received = 0
+        self.rejected = 0
+
+    def attach(self, send) -> None:
+        """Set the transport callable used to broadcast encoded messages."""
+        self._send = send
+
+    def _mac(self, body: bytes) -> bytes:
+        import hashlib
+        import hmac
+
+        return hmac.new(self._secret, body, hashlib.sha256).digest()[: self._MAC_LEN]
+
+    def encode(self, key: Tuple[str, int], kind: int, ttl_seconds: float) -> bytes:
+        user_id, token_u32 = key
+        body = self._MSG.pack(
+            self.MAGIC,
+            self.VERSION,
+            kind,
+            0,
+            self.gym_id,
+            self.sender,
+            uuid.UUID(user_id).bytes,
+            token_u32 & 0xFFFFFFFF,
+            max(0, int(ttl_seconds * 1000)),
+        )
+        if self._secret:
+            body += self._mac(body)
+        return body
+
+    def announce(self, key: Tuple[str, int], kind: int, ttl_seconds: float) -> None:
+        if self._send is None:
+            return
+        try:
+            self._send(self.encode(key, kind, ttl_seconds))
+            self.sent += 1
+        except Exception:
+            # Gossip is best effort; scanning must never depend on it.
+            pass
+
+    def receive(self, data: bytes, now: Optional[float] = None) -> bool:
+        """Apply a peer message; returns True when it was accepted."""
+        expected = self._MSG.size + (self._MAC_LEN if self._secret else 0)
+        if len(data) != expected:
+            self.rejected += 1
+            return False
+
+        body = data[: self._MSG.size]
+        if self._secret:
+            import hmac
+
+            if not hmac.compare_digest(self._mac(body), data[self._MSG.size :]):
+                self.rejected += 1
+                return False
+
+        magic, version, kind, _reserved, gym_id, sender, user_bytes, token_u32, ttl_ms = self._MSG.unpack(body)
+        if magic != self.MAGIC or version != self.VERSION or gym_id != self.gym_id:
+            self.rejected += 1
+            return False
+        if sender == self.sender:
+            # Our own multicast loopback.
+            return False
+
+        self.received += 1
+        key = (str(uuid.UUID(bytes=user_bytes)), token_u32)
+        if kind == CLAIM_RELEASE:
+            self._claims.pop(key, None)
+            return True
+        if kind not in (CLAIM_IN_FLIGHT, CLAIM_VERIFIED):
+            return True
+
+        now = self.clock.time() if now is None else now
+        ttl = min(self.max_ttl_seconds, ttl_ms / 1000.0)
+        current = self._claims.get(key)
+        # A verified claim is never downgraded by a late in-flight one.
+        if current is not None and current[0] == CLAIM_VERIFIED and kind == CLAIM_IN_FLIGHT and current[1] > now:
+            return True
+        self._claims[key] = (kind, now + ttl)
+        return True
+
+    def is_claimed(self, key: Tuple[str, int], now: Optional[float] = None) -> bool:
+        claim = self._claims.get(key)
+        if claim is None:
+            return False
+        now = self.clock.time() if now is None else now
+        if claim[1] <= now:
+            self._claims.pop(key, None)
+            return False
+        return True
+
+    def prune(self, now: Optional[float] = None) -> int:
+        now = self.clock.time() if now is None else now
+        expired = [k for k, (_kind, expires_at) in self._claims.items() if expires_at <= now]
+        for k in expired:
+            self._claims.pop(k, None)
+        return len(expired)
+
+    def __len__(self) -> int:
+        return len(self._claims)
+
+
+class LoopbackGossipBus:
+    """In-process stand-in for the multicast group (tests, simulations)."""
+
+    def __init__(self) -> None:
+        self._members: list = []
+
+    def join(self, gossip: ScannerGossip) -> None:
+        self._members.append(gossip)
+        gossip.attach(self.publish)
+
+    def publish(self, data: bytes) -> None:
+        for member in self._members:
+            member.receive(data)
+
+
+async def open_multicast_gossip(
+    gossip: ScannerGossip,
+    group: str = DEFAULT_GOSSIP_GROUP,
+    port: int = DEFAULT_GOSSIP_PORT,
+):
+    """Join the UDP multicast group and wire it to `gossip`; returns the transport."""
+    import socket
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, "SO_REUSEPORT"):
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        except OSError:
+            pass
+    sock.bind(("", port))
+    membership = struct.pack("4s4s", socket.inet_aton(group), socket.inet_aton("0.0.0.0"))
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+    sock.setblocking(False)
+
+    class _Protocol(asyncio.DatagramProtocol):
+        def datagram_received(self, data, addr):
+            gossip.receive(data)
+
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(_Protocol, sock=sock)
+    gossip.attach(lambda data: transport.sendto(data, (group, port)))
+    return transport
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, at most `burst` stored."""
+
+    def __init__(self, rate: float, burst: float, clock: Optional[SystemClock] = None) -> None:
+        self.rate = max(0.0, float(rate))
+        self.burst = max(1.0, float(burst))
+        self.clock = clock if clock is not None else SYSTEM_CLOCK
+        self._tokens = self.burst
+        self._updated = self.clock.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> bool:
+        if self.rate <= 0:
+            return True
+        self._refill(self.clock.monotonic())
+        if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            return True
+        return False
+
+    def seconds_until_available(self) -> float:
+        if self.rate <= 0:
+            return 0.0
+        self._refill(self.clock.monotonic())
+        return max(0.0, (1.0 - self._tokens) / self.rate)
+
+
+class FairVerifyQueue:
+    """Bounded verify queue with round-robin fairness across users and a global rate cap.
+
+    Drop-in for the asyncio.Queue the verify worker used: put_nowait() raises
+    asyncio.QueueFull when the whole queue is full, get() hands out one frame
+    per user in turn and only once the token bucket allows another outbound
+    verify. A user with `per_user_limit` frames already pending has their
+    oldest pending frame replaced (the newest token is the one most likely to
+    still verify), which is counted as per-user throttling; put_nowait()
+    returns the replaced frame so the caller can release what it claimed.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 256,
+        rate_per_second: float = 10.0,
+        burst: float = 20.0,
+        per_user_limit: int = 4,
+        clock: Optional[SystemClock] = None,
+    ) -> None:
+        self.maxsize = max(1, int(maxsize))
+        self.per_user_limit = max(1, int(per_user_limit))
+        self.clock = clock if clock is not None else SYSTEM_CLOCK
+        self.bucket = TokenBucket(rate_per_second, burst, clock=self.clock)
+
+        # user_id -> pending frames (oldest first); insertion order is the round-robin order.
+        self._pending: Dict[str, Deque[BeaconFrame]] = {}
+        self._size = 0
+        self._unfinished = 0
+        self._not_empty = asyncio.Event()
+        self._all_done = asyncio.Event()
+        self._all_done.set()
+
+        self.limiter_waits = 0
+        self.limiter_wait_seconds = 0.0
+        self.limiter_saturated = False
+        self.per_user_throttled = 0
+        self.per_user_throttled_by_user: Dict[str, int] = {}
+
+    def qsize(self) -> int:
+        return self._size
+
+    def empty(self) -> bool:
+        return self._size == 0
+
+    def full(self) -> bool:
+        return self._size >= self.maxsize
+
+    def put_nowait(self, frame: BeaconFrame) -> Optional[BeaconFrame]:
+        pending = self._pending.get(frame.user_id)
+        if pending is not None and len(pending) >= self.per_user_limit:
+            replaced = pending.popleft()
+            pending.append(frame)
+            self._count_throttled(frame.user_id)
+            return replaced
+
+        if self._size >= self.maxsize:
+            raise asyncio.QueueFull
+
+        if pending is None:
+            pending = self._pending[frame.user_id] = deque()
+        pending.append(frame)
+        self._size += 1
+        self._unfinished += 1
+        self._not_empty.set()
+        self._all_done.clear()
+        return None
+
+    def _count_throttled(self, user_id: str) -> None:
+        self.per_user_throttled += 1
+        by_user = self.per_user_throttled_by_user
+        by_user[user_id] = by_user.get(user_id, 0) + 1
+        if len(by_user) > 1000:
+            # Keep the noisiest devices only so this stays bounded.
+            keep = sorted(by_user.items(), key=lambda item: item[1], reverse=True)[:100]
+            self.per_user_throttled_by_user = dict(keep)
+
+    def top_throttled(self, n: int = 3):
+        return sorted(self.per_user_throttled_by_user.items(), key=lambda item: item[1], reverse=True)[:n]
+
+    def _pop_round_robin(self) -> BeaconFrame:
+        user_id = next(iter(self._pending))
+        pending = self._pending.pop(user_id)
+        frame = pending.popleft()
+        if pending:
+            # Re-insert at the end so the next user gets the following turn.
+            self._pending[user_id] = pending
+        self._size -= 1
+        if self._size == 0:
+            self._not_empty.clear()
+        return frame
+
+    async def get(self) -> BeaconFrame:
+        while self._size == 0:
+            await self._not_empty.wait()
+
+        if not self.bucket.try_acquire():
+            self.limiter_waits += 1
+            self.limiter_saturated = True
+            started = self.clock.monotonic()
+            while not self.bucket.try_acquire():
+                await asyncio.sleep(self.bucket.seconds_until_available())
+            self.limiter_wait_seconds += self.clock.monotonic() - started
+        else:
+            self.limiter_saturated = False
+
+        # Another consumer may have drained the queue while we waited for a token.
+        while self._size == 0:
+            await self._not_empty.wait()
+        return self._pop_round_robin()
+
+    def task_done(self) -> None:
+        if self._unfinished > 0:
+            self._unfinished -= 1
+        if self._unfinished == 0:
+            self._all_done.set()
+
+    async def join(self) -> None:
+        """Wait until every queued frame has been taken and marked done."""
+        await self._all_done.wait()
+
+
+class DebugTap:
+    """Sampled, bounded buffer of manufacturer payloads for --debug-adv.
+
+    offer() has the debug_adv callback signature and never blocks: it applies
+    the address filter, probability sampling and a lines-per-second cap, then
+    appends a small record to a bounded deque. When the buffer is full the new
+    record is dropped and counted. drain() runs as a background task and
+    writes buffered lines to the console or a file in batches. While
+    LoopLagMonitor is shedding load, shed_level thins payloads out further
+    (1 keeps one in SHED_KEEP, 2 keeps none); those are counted as shed.
+    """
+
+    SHED_KEEP = 10
+
+    def __init__(
+        self,
+        capacity: int = 1024,
+        max_per_second: float = 20.0,
+        probability: float = 1.0,
+        addresses: Optional[List[str]] = None,
+        seed: Optional[int] = None,
+        clock: Optional[SystemClock] = None,
+    ) -> None:
+        self.capacity = max(1, int(capacity))
+        self.probability = min(1.0, max(0.0, float(probability)))
+        # Case-insensitive prefixes, so "AA:BB" matches a whole vendor block.
+        self.addresses = tuple(a.strip().upper() for a in addresses or () if a.strip())
+        self.clock = clock if clock is not None else SYSTEM_CLOCK
+        self._limiter = TokenBucket(max_per_second, max(1.0, max_per_second), clock=self.clock) if max_per_second > 0 else None
+        self._rng = random.Random(seed)
+        self._buffer: Deque[Tuple[float, str, int, int, int, bytes]] = deque()
+        self.shed_level = 0
+
+        self.offered = 0
+        self.filtered = 0
+        self.sampled_out = 0
+        self.shed = 0
+        self.dropped_full = 0
+        self.written = 0
+
+    def offer(self, address: str, rssi: int, company_id: int, payload_bytes: bytes) -> None:
+        self.offered += 1
+        if self.addresses and not str(address).upper().startswith(self.addresses):
+            self.filtered += 1
+            return
+        if self.shed_level and (self.shed_level >= 2 or self._rng.random() * self.SHED_KEEP >= 1.0):
+            self.shed += 1
+            return
+        if self.probability < 1.0 and self._rng.random() >= self.probability:
+            self.sampled_out += 1
+            return
+        if self._limiter is not None and not self._limiter.try_acquire():
+            self.sampled_out += 1
+            return
+        if len(self._buffer) >= self.capacity:
+            self.dropped_full += 1
+            return
+        self._buffer.append(
+            (self.clock.time(), str(address), int(rssi), int(company_id), len(payload_bytes), bytes(payload_bytes[:8]))
+        )
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    def pop_lines(self, max_items: int = 256) -> List[str]:
+        lines = []
+        buffer = self._buffer
+        while buffer and len(lines) < max_items:
+            at, address, rssi, company_id, length, head = buffer.popleft()
+            lines.append(
+                f"{time.strftime('%H:%M:%S', time.localtime(at))} ADV {address} rssi={rssi} "
+                f"company=0x{company_id:04x} bytes={length} head={head.hex()}"
+            )
+        return lines
+
+    async def drain(self, write: Callable[[str], None], interval: float = 0.25) -> None:
+        """Write buffered lines with `write(text)` until cancelled (one call per batch)."""
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                lines = self.pop_lines()
+                while lines:
+                    write("\n".join(lines))
+                    self.written += len(lines)
+                    lines = self.pop_lines()
+        finally:
+            lines = self.pop_lines(self.capacity)
+            if lines:
+                write("\n".join(lines))
+                self.written += len(lines)
+
+    def summary(self) -> str:
+        text = (
+            f"{self.written} written, {self.sampled_out} sampled out, "
+            f"{self.filtered} filtered, {self.dropped_full} dropped"
+        )
+        return text + f", {self.shed} shed" if self.shed else text
+
+
+def append_lines_to(path: Path) -> Callable[[str], None]:
+    """DebugTap.drain() writer appending each batch to `path`."""
+
+    def write(text: str) -> None:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+    return write
+
+
+@dataclass
+class CaptureStats:
+    """Counters kept by the capture process in --split-process mode."""
+
+    adv_seen: int = 0
+    adv_with_mfg: int = 0
+    adv_ibeacon_prefix: int = 0
+    frames_parsed: int = 0
+    poll_cycles: int = 0
+    poll_devices: int = 0
+
+
+class FrameRing:
+    """Single-producer/single-consumer ring of fixed-size frame records in shared memory.
+
+    The capture process is the only writer of `head` and the producer stats;
+    the consumer is the only writer of `tail` and `consumer_dropped`. Each
+    side publishes its index with one aligned 8-byte store after the record
+    bytes are in place, so no lock is needed between the two processes.
+
+    Header (128 bytes, little endian):
+      u32 magic, u32 record_size, u32 capacity, u32 stop,
+      u64 head, u64 tail, then one u64 per name in STATS
+    Record (32 bytes): f64 captured_at, 16s user uuid, u32 token_u32,
+      i16 rssi, u16 company_id
+    """
+
+    MAGIC = 0x4C435246  # "LCRF"
+    HEADER_SIZE = 128
+
+    STATS = (
+        "producer_dropped",
+        "consumer_dropped",
+        "adv_seen",
+        "adv_with_mfg",
+        "adv_ibeacon_prefix",
+        "frames_parsed",
+        "poll_cycles",
+        "poll_devices",
+        "scan_mode",  # 0 = starting, 1 = active, 2 = passive
+        "scanner_stalls",
+        "scanner_restarts",
+        "scanner_stalled",
+    )
+
+    _META = struct.Struct("<IIII")
+    _U64 = struct.Struct("<Q")
+    _RECORD = struct.Struct("<d16sIhH")
+    _HEAD_OFFSET = 16
+    _TAIL_OFFSET = 24
+    _STATS_OFFSET = 32
+
+    def __init__(self, shm, owner: bool) -> None:
+        self._shm = shm
+        self._buf = shm.buf
+        self._owner = owner
+
+        magic, record_size, capacity, _stop = self._META.unpack_from(self._buf, 0)
+        if magic != self.MAGIC or record_size != self._RECORD.size:
+            raise ValueError("shared memory block is not a FrameRing")
+        self.capacity = capacity
+
+        # Each side caches its own index; only the peer's index is re-read.
+        self._head = self._load(self._HEAD_OFFSET)
+        self._tail = self._load(self._TAIL_OFFSET)
+
+    @classmethod
+    def create(cls, capacity: int = 4096) -> "FrameRing":
+        from multiprocessing import shared_memory
+
+        capacity = max(16, int(capacity))
+        shm = shared_memory.SharedMemory(create=True, size=cls.HEADER_SIZE + capacity * cls._RECORD.size)
+        shm.buf[: cls.HEADER_SIZE] = bytes(cls.HEADER_SIZE)
+        cls._META.pack_into(shm.buf, 0, cls.MAGIC, cls._RECORD.size, capacity, 0)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> "FrameRing":
+        import multiprocessing
+        from multiprocessing import shared_memory
+
+        shm = shared_memory.SharedMemory(name=name)
+        if multiprocessing.parent_process() is None:
+            # Unrelated process with its own resource tracker: the creator owns
+            # unlinking, so don't let this tracker unlink (or warn about) it on
+            # exit. Spawned children share the creator's tracker and must not
+            # unregister.
+            try:
+                from multiprocessing import resource_tracker
+
+                resource_tracker.unregister(shm._name, "shared_memory")
+            except Exception:
+                pass
+        return cls(shm, owner=False)
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def _load(self, offset: int) -> int:
+        return self._U64.unpack_from(self._buf, offset)[0]
+
+    def _store(self, offset: int, value: int) -> None:
+        self._U64.pack_into(self._buf, offset, value)
+
+    def _stat_offset(self, name: str) -> int:
+        return self._STATS_OFFSET + 8 * self.STATS.index(name)
+
+    def stat(self, name: str) -> int:
+        return self._load(self._stat_offset(name))
+
+    def set_stat(self, name: str, value: int) -> None:
+        self._store(self._stat_offset(name), max(0, int(value)))
+
+    def __len__(self) -> int:
+        return self._load(self._HEAD_OFFSET) - self._load(self._TAIL_OFFSET)
+
+    # Producer side.
+
+    def push(self, frame: BeaconFrame, company_id: int = 0, captured_at: Optional[float] = None) -> bool:
+        tail = self._load(self._TAIL_OFFSET)
+        if self._head - tail >= self.capacity:
+            self.set_stat("producer_dropped", self.stat("producer_dropped") + 1)
+            return False
+
+        offset = self.HEADER_SIZE + (self._head % self.capacity) * self._RECORD.size
+        self._RECORD.pack_into(
+            self._buf,
+            offset,
+            time.time() if captured_at is None else captured_at,
+            uuid.UUID(frame.user_id).bytes,
+            frame.token_u32 & 0xFFFFFFFF,
+            max(-32768, min(32767, int(frame.rssi))),
+            company_id & 0xFFFF,
+        )
+        self._head += 1
+        self._store(self._HEAD_OFFSET, self._head)
+        return True
+
+    # Consumer side.
+
+    def pop_many(self, max_items: int = 256):
+        """Return up to `max_items` (captured_at, company_id, frame) tuples, oldest first."""
+        head = self._load(self._HEAD_OFFSET)
+        available = min(head - self._tail, max(1, int(max_items)))
+        out = []
+        for _ in range(available):
+            offset = self.HEADER_SIZE + (self._tail % self.capacity) * self._RECORD.size
+            captured_at, user_bytes, token_u32, rssi, company_id = self._RECORD.unpack_from(self._buf, offset)
+            out.append(
+                (
+                    captured_at,
+                    company_id,
+                    BeaconFrame(
+                        user_id=str(uuid.UUID(bytes=user_bytes)),
+                        token_u32=token_u32,
+                        major=token_u32 >> 16,
+                        minor=token_u32 & 0xFFFF,
+                        rssi=rssi,
+                    ),
+                )
+            )
+            self._tail += 1
+        if available:
+            self._store(self._TAIL_OFFSET, self._tail)
+        return out
+
+    # Lifecycle.
+
+    @property
+    def stop_requested(self) -> bool:
+        return bool(self._META.unpack_from(self._buf, 0)[3])
+
+    def request_stop(self) -> None:
+        self._META.pack_into(self._buf, 0, self.MAGIC, self._RECORD.size, self.capacity, 1)
+
+    def close(self) -> None:
+        self._buf.release()
+        self._shm.close()
+        if self._owner:
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def _capture_process_main(
+    ring_name: str,
+    adapter: Optional[str],
+    strict_apple_id: bool,
+    debug_tap: Optional[dict],
+    parent_pid: int,
+    scan_filter: str = "off",
+    stall_seconds: float = 30.0,
+) -> None:
+    """Entry point of the capture process in --split-process mode."""
+    try:
+        asyncio.run(
+            _capture_loop(ring_name, adapter, strict_apple_id, debug_tap, parent_pid, scan_filter, stall_seconds)
+        )
+    except KeyboardInterrupt:
+        pass
+
+
+class _RingWriter:
+    """Advertisement consumer used by the capture process: parse and push to the ring."""
+
+    def __init__(self, ring: FrameRing, strict_apple_id: bool, debug_tap: Optional[DebugTap] = None) -> None:
+        self.ring = ring
+        self.strict_apple_id = strict_apple_id
+        self.debug_tap = debug_tap
+        self.stats = CaptureStats()
+        self.watchdog: Optional["ScanWatchdog"] = None
+
+    def submit_advertisement(self, address: str, rssi: int, manufacturer_data, polled: bool = False) -> None:
+        if not polled:
+            self.stats.adv_seen += 1
+
+        if self.debug_tap is not None:
+
+            def debug(company_id: int, payload_bytes: bytes) -> None:
+                self.debug_tap.offer(address, rssi, company_id, payload_bytes)
+
+        else:
+            debug = None
+
+        parsed = parse_advertisement(self.stats, manufacturer_data, rssi, self.strict_apple_id, debug=debug)
+        if parsed is not None:
+            company_id, frame = parsed
+            self.ring.push(frame, company_id)
+
+    def note_poll(self, devices: int) -> None:
+        self.stats.poll_cycles += 1
+        self.stats.poll_devices = devices
+        self.publish_stats()
+
+    def note_error(self, message: str) -> None:
+        pass
+
+    def note_scan_mode(self, mode: str, fallback: Optional[str] = None) -> None:
+        self.ring.set_stat("scan_mode", 2 if mode == "passive" else 1)
+        if fallback:
+            print(f"capture: passive scanning unavailable, using active: {fallback}", file=sys.stderr, flush=True)
+
+    def register_watchdog(self, watchdog: "ScanWatchdog") -> None:
+        self.watchdog = watchdog
+
+    def publish_stats(self) -> None:
+        for name in ("adv_seen", "adv_with_mfg", "adv_ibeacon_prefix", "frames_parsed", "poll_cycles", "poll_devices"):
+            self.ring.set_stat(name, getattr(self.stats, name))
+        if self.watchdog is not None:
+            self.ring.set_stat("scanner_stalls", self.watchdog.stalls)
+            self.ring.set_stat("scanner_restarts", self.watchdog.restarts)
+            self.ring.set_stat("scanner_stalled", int(self.watchdog.stalled))
+
+
+async def _capture_loop(
+    ring_name: str,
+    adapter: Optional[str],
+    strict_apple_id: bool,
+    debug_tap: Optional[dict],
+    parent_pid: int,
+    scan_filter: str = "off",
+    stall_seconds: float = 30.0,
+) -> None:
+    ring = FrameRing.attach(ring_name)
+    tap = None
+    if debug_tap is not None:
+        options = dict(debug_tap)
+        out = options.pop("out", None)
+        tap = DebugTap(**options)
+    writer = _RingWriter(ring, strict_apple_id, tap)
+    source = BleakAdvertisementSource(
+        adapter=adapter, scan_filter=scan_filter, strict_apple_id=strict_apple_id, stall_seconds=stall_seconds
+    )
+    capture = asyncio.create_task(source.run(writer))
+    tasks = [capture]
+    if tap is not None:
+        write = append_lines_to(Path(out)) if out else (lambda text: print(text, flush=True))
+        tasks.append(asyncio.create_task(tap.drain(write)))
+    try:
+        while not ring.stop_requested and os.getppid() == parent_pid and not capture.done():
+            await asyncio.sleep(0.25)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        writer.publish_stats()
+        ring.close()
+
+
+@dataclass
+class StageCounters:
+    """Throughput counters for one AttendancePipeline stage."""
+
+    items_in: int = 0
+    items_out: int = 0
+    dropped: int = 0
+    errors: int = 0
+    busy_seconds: float = 0.0
+
+
+class VerifySink(Protocol):
+    async def verify(self, frame: BeaconFrame) -> VerifyResult: ...
+
+
+class EventSink(Protocol):
+    def log(self, event: dict) -> None: ...
+
+
+class AdvertisementSource(Protocol):
+    """Feeds the pipeline via submit_advertisement() or submit_frame() until done or cancelled."""
+
+    async def run(self, pipeline: "AttendancePipeline") -> None: ...
+
+
+class GatewayVerifySink:
+    """Verify through AttendanceGateway.verify (blocking HTTP) on a worker thread."""
+
+    def __init__(self, gateway: AttendanceGateway) -> None:
+        self.gateway = gateway
+
+    async def verify(self, frame: BeaconFrame) -> VerifyResult:
+        return await asyncio.to_thread(self.gateway.verify, frame)
+
+
+class NullVerifySink:
+    """Dry-run sink: counts verifies as successful without calling Supabase."""
+
+    def __init__(self, gateway: AttendanceGateway) -> None:
+        self.gateway = gateway
+
+    async def verify(self, frame: BeaconFrame) -> VerifyResult:
+        self.gateway.requests_sent += 1
+        self.gateway.requests_ok += 1
+        self.gateway.last_ok_at = self.gateway.clock.time()
+        self.gateway.last_ok = "dry run"
+        return VerifyResult(ok=True, status_code=None, detail="dry run")
+
+
+class ScanWatchdog:
+    """Detects a BLE scanner that has gone quiet and paces escalating restarts.
+
+    Arrivals (fresh advertisements) are counted into 5 s buckets that feed an
+    EWMA baseline rate. Once the baseline shows real traffic, a silence longer
+    than max(stall_seconds, 10 expected arrivals) is a stall. check() then
+    returns recovery levels 1, 2, 3, 3, ... with exponentially growing gaps
+    (capped at 10 minutes) until arrivals resume, so a genuinely empty room
+    doesn't cause restart thrash.
+    """
+
+    BUCKET_SECONDS = 5.0
+    MAX_BACKOFF_SECONDS = 600.0
+
+    def __init__(
+        self,
+        name: str,
+        stall_seconds: float = 30.0,
+        min_baseline: float = 0.2,
+        clock: Optional[SystemClock] = None,
+    ) -> None:
+        self.name = name
+        self.stall_seconds = max(1.0, float(stall_seconds))
+        self.min_baseline = float(min_baseline)
+        self.clock = clock if clock is not None else SYSTEM_CLOCK
+
+        now = self.clock.monotonic()
+        self.baseline = 0.0
+        self.rate = 0.0
+        self.arrivals = 0
+        self._bucket_started = now
+        self._bucket_arrivals = 0
+        self.last_arrival_at: Optional[float] = None
+
+        self.stalled_since: Optional[float] = None
+        self._quiet_before_detect = 0.0
+        self._level = 0
+        self._next_action_at = 0.0
+
+        self.stalls = 0
+        self.restarts = 0
+        self.recoveries = 0
+        self.last_stall_seconds: Optional[float] = None
+        self.last_recovery_seconds: Optional[float] = None
+        self.total_stall_seconds = 0.0
+
+    def note_arrivals(self, count: int = 1) -> None:
+        if count <= 0:
+            return
+        self.arrivals += count
+        self._bucket_arrivals += count
+        self.last_arrival_at = self.clock.monotonic()
+
+    @property
+    def stalled(self) -> bool:
+        return self.stalled_since is not None
+
+    def check(self) -> Optional[int]:
+        """Return the recovery level to run now (1 = restart scan, 2 = new scanner, 3 = fallback), if any."""
+        now = self.clock.monotonic()
+        elapsed = now - self._bucket_started
+        if elapsed >= self.BUCKET_SECONDS:
+            self.rate = self._bucket_arrivals / elapsed
+            if not self.stalled:
+                self.baseline = self.rate if self.baseline == 0.0 else 0.8 * self.baseline + 0.2 * self.rate
+            self._bucket_started = now
+            self._bucket_arrivals = 0
+
+        if self.stalled:
+            if self.last_arrival_at is not None and self.last_arrival_at > self.stalled_since:
+                self.recoveries += 1
+                self.last_recovery_seconds = self.last_arrival_at - self.stalled_since
+                self.last_stall_seconds = self.last_recovery_seconds + self._quiet_before_detect
+                self.total_stall_seconds += self.last_stall_seconds
+                self.stalled_since = None
+                self._level = 0
+                return None
+            if now < self._next_action_at:
+                return None
+            self._level += 1
+            self.restarts += 1
+            backoff = min(self.MAX_BACKOFF_SECONDS, self.stall_seconds * (2 ** (self._level - 1)))
+            self._next_action_at = now + backoff
+            return min(self._level, 3)
+
+        if self.baseline < self.min_baseline or self.last_arrival_at is None:
+            return None
+        quiet = now - self.last_arrival_at
+        if quiet >= max(self.stall_seconds, 10.0 / self.baseline):
+            self.stalls += 1
+            self.stalled_since = now
+            self._quiet_before_detect = quiet
+            self._next_action_at = now
+            return self.check()
+        return None
+
+    def dismiss(self) -> None:
+        """End a stall that turned out to be real silence: no recovery is counted and the baseline restarts."""
+        if not self.stalled:
+            return
+        now = self.clock.monotonic()
+        self.total_stall_seconds += now - self.stalled_since + self._quiet_before_detect
+        self.stalled_since = None
+        self._level = 0
+        self.baseline = 0.0
+        self._bucket_started = now
+        self._bucket_arrivals = 0
+
+    def summary(self) -> str:
+        state = "[red]stalled[/red]" if self.stalled else "ok"
+        text = f"{state} {self.rate:.1f}/s (baseline {self.baseline:.1f}/s)"
+        if self.stalls:
+            text += f", stalls {self.stalls}, restarts {self.restarts}"
+        if self.last_recovery_seconds is not None:
+            text += f", last recovery {self.last_recovery_seconds:.1f}s"
+        return text
+
+
+class BleakAdvertisementSource:
+    """Live advertisements from a BleakScanner: detection callback plus discovered-map polling.
+
+    scan_filter pushes iBeacon matching into BlueZ: "auto" tries passive
+    scanning with advertisement monitor patterns (only candidate frames reach
+    Python) and falls back to active scanning, "require" fails instead, "off"
+    always scans actively. scanner_factory replaces BleakScanner (e.g. a mock).
+
+    With stall_seconds > 0 a ScanWatchdog restarts only the BleakScanner when
+    advertisements stop arriving: first stop/start, then a fresh scanner, then
+    (after a pause) active scanning if passive was in use. The pipeline, HTTP
+    session, queues and throttle state are untouched.
+
+    A passive scan only sees iBeacons, so a gym emptying out looks like a
+    stall. The active scan at level 3 is therefore a probe: if it sees an
+    iBeacon within PROBE_SECONDS, passive was missing them and active stays;
+    otherwise the silence was real, passive is restored and the stall dismissed.
+    """
+
+    PROBE_SECONDS = 15.0
+
+    def __init__(
+        self,
+        adapter: Optional[str] = None,
+        poll_interval: float = 0.75,
+        scan_filter: str = "off",
+        strict_apple_id: bool = False,
+        scanner_factory: Optional[Callable[..., object]] = None,
+        stall_seconds: float = 30.0,
+    ) -> None:
+        if scan_filter not in SCAN_FILTER_MODES:
+            raise ValueError(f"scan_filter must be one of {SCAN_FILTER_MODES}, got {scan_filter!r}")
+        self.adapter = adapter
+        self.poll_interval = float(poll_interval)
+        self.scan_filter = scan_filter
+        self.strict_apple_id = bool(strict_apple_id)
+        self.scanner_factory = scanner_factory
+        self.scanner = None
+        self.mode: Optional[str] = None
+        self.fallback_reason: Optional[str] = None
+        self.watchdog = ScanWatchdog(adapter or "default", stall_seconds) if stall_seconds > 0 else None
+        self._factory = None
+        self._callback = None
+        # address -> id() of the last AdvertisementData polled; a new object means a fresh advertisement.
+        self._polled: Dict[str, int] = {}
+        self.shed_level = 0
+        self.polls_shed = 0
+        # Set while an active scan tests a passive stall (see class docstring).
+        self._probe_until: Optional[float] = None
+        self._probe_beacons = 0
+
+    def or_patterns(self) -> list:
+        pattern = APPLE_IBEACON_OR_PATTERN if self.strict_apple_id else IBEACON_OR_PATTERN
+        try:
+            from bleak.backends.bluezdbus.advertisement_monitor import OrPattern
+        except ImportError:
+            # Mocked backends (scanner_factory) take the raw tuples.
+            return [pattern]
+        return [OrPattern(*pattern)]
+
+    def _scanner_kwargs(self, passive: bool) -> dict:
+        kwargs: dict = {}
+        bluez: dict = {}
+        if self.adapter:
+            bluez["adapter"] = self.adapter
+        if passive:
+            kwargs["scanning_mode"] = "passive"
+            bluez["or_patterns"] = self.or_patterns()
+        if bluez:
+            kwargs["bluez"] = bluez
+        return kwargs
+
+    async def _start_scanner(self, passive: bool) -> None:
+        scanner = self._factory(detection_callback=self._callback, **self._scanner_kwargs(passive=passive))
+        await scanner.start()
+        self.scanner, self.mode = scanner, "passive" if passive else "active"
+
+    async def run(self, pipeline) -> None:
+        if self.scanner_factory is not None:
+            self._factory = self.scanner_factory
+        else:
+            from bleak import BleakScanner
+
+            self._factory = BleakScanner
+
+        watchdog = self.watchdog
+
+        def detection_callback(device, adv_data):
+            if watchdog is not None:
+                watchdog.note_arrivals()
+                if self._probe_until is not None:
+                    self._note_probe(adv_data.manufacturer_data)
+            pipeline.submit_advertisement(device.address, adv_data.rssi, adv_data.manufacturer_data)
+
+        self._callback = detection_callback
+
+        if self.scan_filter != "off":
+            try:
+                if self.scanner_factory is None and not sys.platform.startswith("linux"):
+                    raise RuntimeError("passive filtered scanning needs BlueZ (Linux)")
+                await self._start_scanner(passive=True)
+            except Exception as e:
+                # Typically BlueZ < 5.56 or AdvertisementMonitor disabled (bluetoothd --experimental).
+                if self.scan_filter == "require":
+                    raise
+                self.fallback_reason = f"{type(e).__name__}: {e}"
+
+        if self.scanner is None:
+            await self._start_scanner(passive=False)
+
+        note = getattr(pipeline, "note_scan_mode", None)
+        if note is not None:
+            note(self.mode, self.fallback_reason)
+        register = getattr(pipeline, "register_watchdog", None)
+        if watchdog is not None and register is not None:
+            register(watchdog)
+        try:
+            await self._poll(pipeline)
+        finally:
+            await self.scanner.stop()
+
+    async def _recover(self, pipeline, level: int) -> None:
+        """Restart just the BleakScanner; higher levels throw away more state."""
+        started = time.perf_counter()
+        previous_mode = self.mode
+        error = None
+        try:
+            with contextlib.suppress(Exception):
+                await self.scanner.stop()
+            if level == 1:
+                await self.scanner.start()
+            else:
+                passive = self.mode == "passive"
+                if level >= 3:
+                    # Give BlueZ a moment, and stop relying on the monitor if it's the culprit.
+                    await asyncio.sleep(2.0)
+                    if passive and self.scan_filter == "auto":
+                        passive = False
+                        self._probe_until = self.watchdog.clock.monotonic() + 2.0 + self.PROBE_SECONDS
+                        self._probe_beacons = 0
+                await self._start_scanner(passive=passive)
+                self._polled.clear()
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            pipeline.note_error(f"scanner restart (level {level}) failed: {error}")
+
+        log = getattr(pipeline, "log_event", None)
+        if log is not None:
+            log(
+                {
+                    "event": "scanner_restart",
+                    "adapter": self.watchdog.name,
+                    "level": level,
+                    "mode": self.mode,
+                    "restart_ms": round((time.perf_counter() - started) * 1000.0, 1),
+                    "stalled_for_seconds": round(self.watchdog.clock.monotonic() - self.watchdog.stalled_since, 1),
+                    "error": error,
+                }
+            )
+        note = getattr(pipeline, "note_scan_mode", None)
+        if note is not None and self.mode != previous_mode:
+            note(self.mode, self.fallback_reason)
+
+    def _note_probe(self, manufacturer_data) -> None:
+        for payload in (manufacturer_data or {}).values():
+            if bytes(payload[:2]) == IBEACON_PREFIX:
+                self._probe_beacons += 1
+                return
+
+    async def _finish_probe(self, pipeline) -> None:
+        """Keep active scanning if the probe saw iBeacons, else go back to passive."""
+        self._probe_until = None
+        error = None
+        if self._probe_beacons:
+            self.fallback_reason = "passive scanning stalled"
+        else:
+            try:
+                with contextlib.suppress(Exception):
+                    await self.scanner.stop()
+                await self._start_scanner(passive=True)
+                self._polled.clear()
+                self.watchdog.dismiss()
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                pipeline.note_error(f"passive scanning restore failed: {error}")
+                self.fallback_reason = f"passive restore failed: {error}"
+                # Leave the watchdog stalled: if this fails too, its next level retries.
+                with contextlib.suppress(Exception):
+                    await self._start_scanner(passive=False)
+
+        log = getattr(pipeline, "log_event", None)
+        if log is not None:
+            log(
+                {
+                    "event": "scanner_probe",
+                    "adapter": self.watchdog.name,
+                    "ibeacons": self._probe_beacons,
+                    "mode": self.mode,
+                    "error": error,
+                }
+            )
+        note = getattr(pipeline, "note_scan_mode", None)
+        if note is not None:
+            note(self.mode, self.fallback_reason)
+
+    async def _poll(self, pipeline) -> None:
+        """Fallback for platforms/backends where detection_callback is flaky.
+
+        On some Linux/BlueZ setups, Bleak's callback may not fire even though the
+        scanner collects discovered devices. Polling the discovered map keeps the
+        UI/live metrics moving and still lets us parse manufacturer data.
+        """
+
+        # Small initial delay so the scanner can start.
+        await asyncio.sleep(0.25)
+        watchdog = self.watchdog
+        while True:
+            # Load shedding (LoopLagMonitor): level 1 polls 4x less often, level 2 pauses.
+            await asyncio.sleep(self.poll_interval * (4 if self.shed_level == 1 else 1))
+            if self.shed_level >= 2:
+                # The watchdog waits too: it can't tell a paused poll from a silent adapter.
+                self.polls_shed += 1
+                continue
+            try:
+                discovered = getattr(self.scanner, "discovered_devices_and_advertisement_data", {})
+                pipeline.note_poll(len(discovered))
+                fresh = 0
+                for addr, (dev, adv) in list(discovered.items()):
+                    if watchdog is not None and self._polled.get(addr) != id(adv):
+                        self._polled[addr] = id(adv)
+                        fresh += 1
+                        if self._probe_until is not None:
+                            self._note_probe(adv.manufacturer_data)
+                    pipeline.submit_advertisement(
+                        getattr(dev, "address", "?"), adv.rssi, adv.manufacturer_data, polled=True
+                    )
+                if watchdog is not None:
+                    if len(self._polled) > 2 * len(discovered) + 1000:
+                        self._polled = {addr: self._polled[addr] for addr in discovered if addr in self._polled}
+                    watchdog.note_arrivals(fresh)
+            except Exception as e:
+                # Don't crash scanning on occasional backend issues.
+                pipeline.note_error(f"poll error: {e}")
+
+            if self._probe_until is not None:
+                # Active traffic during the probe says nothing about passive: hold the watchdog.
+                if self._probe_beacons or watchdog.clock.monotonic() >= self._probe_until:
+                    await self._finish_probe(pipeline)
+                continue
+            if watchdog is not None:
+                recoveries = watchdog.recoveries
+                level = watchdog.check()
+                if level is not None:
+                    await self._recover(pipeline, level)
+                elif watchdog.recoveries != recoveries:
+                    log = getattr(pipeline, "log_event", None)
+                    if log is not None:
+                        log(
+                            {
+                                "event": "scanner_recovered",
+                                "adapter": watchdog.name,
+                                "stall_seconds": round(watchdog.last_stall_seconds, 1),
+                                "recovery_seconds": round(watchdog.last_recovery_seconds, 1),
+                                "restarts": watchdog.restarts,
+                            }
+                        )
+
+
+class RingFrameSource:
+    """Frames parsed by a capture child process (--split-process), read from a FrameRing.
+
+    run() raises RuntimeError if the capture process dies, so the pipeline
+    stops instead of verifying nothing forever.
+    """
+
+    IDLE_SLEEP_MIN = 0.005
+    IDLE_SLEEP_MAX = 0.05
+
+    def __init__(
+        self,
+        adapter: Optional[str] = None,
+        strict_apple_id: bool = False,
+        debug_tap: Optional[dict] = None,
+        capacity: int = 4096,
+        scan_filter: str = "off",
+        stall_seconds: float = 30.0,
+    ) -> None:
+        self.adapter = adapter
+        self.scan_filter = scan_filter
+        self.stall_seconds = stall_seconds
+        self.strict_apple_id = strict_apple_id
+        # DebugTap keyword arguments (plus optional "out" path) for the capture process's own tap.
+        self.debug_tap = debug_tap
+        self.capacity = capacity
+        self.ring: Optional[FrameRing] = None
+
+    async def run(self, pipeline: "AttendancePipeline") -> None:
+        import multiprocessing
+
+        gateway = pipeline.gateway
+        ring = self.ring = FrameRing.create(self.capacity)
+        # Capture counters restart at zero in the child; keep restored totals.
+        capture_base = {
+            name: getattr(gateway, name)
+            for name in ("adv_seen", "adv_with_mfg", "adv_ibeacon_prefix", "frames_parsed", "poll_cycles")
+        }
+        proc = multiprocessing.get_context("spawn").Process(
+            target=_capture_process_main,
+            args=(
+                ring.name,
+                self.adapter,
+                bool(self.strict_apple_id),
+                self.debug_tap,
+                os.getpid(),
+                self.scan_filter,
+                self.stall_seconds,
+            ),
+            name="attendance-capture",
+            daemon=True,
+        )
+        proc.start()
+        pipeline.log_event({"event": "capture_process_started", "pid": proc.pid, "ring_capacity": ring.capacity})
+
+        source = pipeline.stages["source"]
+        idle_sleep = self.IDLE_SLEEP_MIN
+        try:
+            while True:
+                batch = ring.pop_many(256)
+                source.items_in += len(batch)
+                for _captured_at, _company_id, frame in batch:
+                    pipeline.submit_frame(frame)
+
+                for name, base in capture_base.items():
+                    setattr(gateway, name, base + ring.stat(name))
+                gateway.poll_devices = ring.stat("poll_devices")
+                gateway.ring_producer_dropped = ring.stat("producer_dropped")
+                scan_mode = ring.stat("scan_mode")
+                if scan_mode:
+                    gateway.scan_mode = "passive" if scan_mode == 2 else "active"
+                gateway.scanner_stalls = ring.stat("scanner_stalls")
+                gateway.scanner_restarts = ring.stat("scanner_restarts")
+                gateway.scanner_stalled = bool(ring.stat("scanner_stalled"))
+                ring.set_stat("consumer_dropped", gateway.dropped_queue_full)
+
+                if batch:
+                    idle_sleep = self.IDLE_SLEEP_MIN
+                    continue
+                if not proc.is_alive():
+                    message = f"capture process exited (code={proc.exitcode})"
+                    pipeline.note_error(message)
+                    # Fail the pipeline so the scanner/daemon exits non-zero (and systemd restarts it).
+                    raise RuntimeError(message)
+                # Back off while the ring stays empty; a busy gym keeps it short.
+                await asyncio.sleep(idle_sleep)
+                idle_sleep = min(self.IDLE_SLEEP_MAX, idle_sleep * 2)
+        finally:
+            ring.request_stop()
+            await asyncio.to_thread(proc.join, 3)
+            if proc.is_alive():
+                proc.terminate()
+            ring.close()
+
+
+class PresenceTracker:
+    """Members currently in range, most recently seen last (bounded LRU).
+
+    seen() is O(1) (OrderedDict move_to_end); members not seen for
+    `ttl_seconds` expire from the old end and the table never holds more than
+    `max_members`, so a full building costs the same per frame as an empty one.
+    page() walks from the newest end without building a list.
+    """
+
+    def __init__(self, ttl_seconds: float = 120.0, max_members: int = 2000, clock: Optional[SystemClock] = None) -> None:
+        self.ttl_seconds = float(ttl_seconds)
+        self.max_members = max(1, int(max_members))
+        self.clock = clock if clock is not None else SYSTEM_CLOCK
+        # user_id -> [first_seen, last_seen, rssi, verified_at]
+        self._members: "OrderedDict[str, list]" = OrderedDict()
+        self.evicted = 0
+
+    def seen(self, frame: BeaconFrame, now: Optional[float] = None) -> None:
+        now = self.clock.time() if now is None else now
+        entry = self._members.get(frame.user_id)
+        if entry is None:
+            self._members[frame.user_id] = [now, now, frame.rssi, None]
+            if len(self._members) > self.max_members:
+                self._members.popitem(last=False)
+                self.evicted += 1
+        else:
+            entry[1] = now
+            entry[2] = frame.rssi
+            self._members.move_to_end(frame.user_id)
+
+    def verified(self, frame: BeaconFrame, now: Optional[float] = None) -> None:
+        entry = self._members.get(frame.user_id)
+        if entry is not None:
+            entry[3] = self.clock.time() if now is None else now
+
+    def expire(self, now: Optional[float] = None) -> int:
+        now = self.clock.time() if now is None else now
+        cutoff = now - self.ttl_seconds
+        removed = 0
+        members = self._members
+        while members:
+            _user_id, entry = next(iter(members.items()))
+            if entry[1] >= cutoff:
+                break
+            members.popitem(last=False)
+            removed += 1
+        return removed
+
+    def page(self, index: int, size: int) -> List[Tuple[str, float, float, int, Optional[float]]]:
+        """Rows (user_id, first_seen, last_seen, rssi, verified_at), newest first."""
+        start = max(0, int(index)) * max(1, int(size))
+        rows = itertools.islice(reversed(self._members.items()), start, start + max(1, int(size)))
+        return [(user_id, e[0], e[1], e[2], e[3]) for user_id, e in rows]
+
+    def __len__(self) -> int:
+        return len(self._members)
+
+
+class AttendancePipeline:
+    """Importable scan -> verify pipeline around an AttendanceGateway.
+
+    Stages, each with its own StageCounters in `stages`:
+      source  -> advertisements (or pre-parsed frames) handed in by sources
+      parse   -> iBeacon extraction (parse_advertisement)
+      filter  -> RSSI/throttle/peer-claim checks (AttendanceGateway.should_send)
+      queue   -> FairVerifyQueue (rate limit + per-user fairness)
+      verify  -> VerifySink (HTTP by default, runs off the event loop)
+      log     -> EventSink (JsonlLogger by default)
+
+    submit_advertisement()/submit_frame() are synchronous and cheap so they can
+    be called straight from a Bleak callback; run() drives verify workers and
+    any sources passed to it.
+    """
+
+    STAGES = ("source", "parse", "filter", "queue", "verify", "log")
+
+    def __init__(
+        self,
+        gateway: AttendanceGateway,
+        verify_sink: Optional[VerifySink] = None,
+        log_sink: Optional[EventSink] = None,
+        queue: Optional[FairVerifyQueue] = None,
+        strict_apple_id: bool = False,
+        verify_workers: int = 1,
+        debug_adv: Optional[Callable[[str, int, int, bytes], None]] = None,
+        recorder=None,
+        presence: Optional[PresenceTracker] = None,
+    ) -> None:
+        self.gateway = gateway
+        self.verify_sink = verify_sink if verify_sink is not None else GatewayVerifySink(gateway)
+        self.log_sink = log_sink
+        self.queue = queue if queue is not None else FairVerifyQueue()
+        self.strict_apple_id = bool(strict_apple_id)
+        self.verify_workers = max(1, int(verify_workers))
+        self.debug_adv = debug_adv
+        # capture_files.AdvertisementRecorder (or anything with record()) for --record.
+        self.recorder = recorder
+        self.presence = presence
+
+        self.stages: Dict[str, StageCounters] = {name: StageCounters() for name in self.STAGES}
+        self._listeners: List[Callable[[BeaconFrame, VerifyResult], None]] = []
+
+    def add_listener(self, listener: Callable[[BeaconFrame, VerifyResult], None]) -> None:
+        """Call `listener(frame, result)` after every verify (e.g. console output)."""
+        self._listeners.append(listener)
+
+    def stats(self) -> Dict[str, dict]:
+        return {name: dict(vars(counters)) for name, counters in self.stages.items()}
+
+    # Source -> parse.
+
+    def submit_advertisement(self, address: str, rssi: int, manufacturer_data, polled: bool = False) -> Optional[BeaconFrame]:
+        self.stages["source"].items_in += 1
+        if not polled:
+            self.gateway.adv_seen += 1
+            # The poll re-submits the discovered map every cycle; recording it would replay stale advertisements.
+            if self.recorder is not None:
+                self.recorder.record(address, rssi, manufacturer_data)
+
+        if self.debug_adv is not None:
+
+            def debug(company_id: int, payload_bytes: bytes) -> None:
+                self.debug_adv(address, rssi, company_id, payload_bytes)
+
+        else:
+            debug = None
+
+        stage = self.stages["parse"]
+        stage.items_in += 1
+        started = time.perf_counter()
+        parsed = parse_advertisement(self.gateway, manufacturer_data, rssi, self.strict_apple_id, debug=debug)
+        stage.busy_seconds += time.perf_counter() - started
+        if parsed is None:
+            stage.dropped += 1
+            return None
+        stage.items_out += 1
+
+        _company_id, frame = parsed
+        self.submit_frame(frame)
+        return frame
+
+    def note_poll(self, devices: int) -> None:
+        self.gateway.poll_cycles += 1
+        self.gateway.poll_devices = devices
+        self.gateway.last_poll_at = self.gateway.clock.time()
+
+    def note_error(self, message: str) -> None:
+        self.gateway.last_err_at = self.gateway.clock.time()
+        self.gateway.last_err = message
+
+    def note_scan_mode(self, mode: str, fallback: Optional[str] = None) -> None:
+        self.gateway.scan_mode = mode
+        self.gateway.scan_fallback = fallback
+        self.log_event({"event": "scan_mode", "mode": mode, "fallback": fallback})
+
+    def register_watchdog(self, watchdog: "ScanWatchdog") -> None:
+        self.gateway.scan_watchdogs[watchdog.name] = watchdog
+
+    # Filter -> queue.
+
+    def submit_frame(self, frame: BeaconFrame) -> bool:
+        """Run a parsed frame through the throttle and enqueue it; True if queued."""
+        stage = self.stages["filter"]
+        stage.items_in += 1
+        started = time.perf_counter()
+        if self.presence is not None and frame.rssi >= self.gateway.min_rssi:
+            self.presence.seen(frame)
+        passed = self.gateway.should_send(frame)
+        stage.busy_seconds += time.perf_counter() - started
+        if not passed:
+            stage.dropped += 1
+            return False
+        stage.items_out += 1
+
+        queue = self.stages["queue"]
+        queue.items_in += 1
+        try:
+            replaced = self.queue.put_nowait(frame)
+            self.gateway.enqueued += 1
+        except asyncio.QueueFull:
+            queue.dropped += 1
+            self.gateway.dropped_queue_full += 1
+            return False
+
+        gossip = self.gateway.gossip
+        if gossip is not None:
+            key = (frame.user_id, frame.token_u32)
+            gossip.announce(key, CLAIM_IN_FLIGHT, self.gateway.in_flight_ttl_seconds())
+            if replaced is not None and (replaced.user_id, replaced.token_u32) != key:
+                # It will never be verified here, so let a peer pick it up.
+                gossip.announce((replaced.user_id, replaced.token_u32), CLAIM_RELEASE, 0)
+        return True
+
+    # Verify -> log.
+
+    async def process(self, frame: BeaconFrame) -> VerifyResult:
+        """Verify one frame and publish the outcome (gossip, UI state, log, listeners)."""
+        gateway = self.gateway
+        stage = self.stages["verify"]
+        stage.items_in += 1
+        started = time.perf_counter()
+        try:
+            result = await self.verify_sink.verify(frame)
+        except Exception as e:
+            result = VerifyResult(ok=False, status_code=None, detail=f"verify sink error: {e}")
+        stage.busy_seconds += time.perf_counter() - started
+        if result.ok:
+            stage.items_out += 1
+        else:
+            stage.errors += 1
+
+        if gateway.gossip is not None:
+            key = (frame.user_id, frame.token_u32)
+            if result.ok:
+                gateway.gossip.announce(key, CLAIM_VERIFIED, gateway.throttle_seconds)
+            else:
+                gateway.gossip.announce(key, CLAIM_RELEASE, 0)
+
+        if result.ok:
+            if self.presence is not None:
+                self.presence.verified(frame)
+            gateway.recent_verified.appendleft(
+                {
+                    "at": time.strftime('%H:%M:%S', time.localtime(gateway.clock.time())),
+                    "user": frame.user_id,
+                    "rssi": frame.rssi,
+                    "status": result.status_code,
+                }
+            )
+
+        event = {
+            "event": "attendance_verified",
+            "ok": result.ok,
+            "status_code": result.status_code,
+            "gym_id": gateway.gym_id,
+            "scanner_id": gateway.scanner_id,
+            "user_id": frame.user_id,
+            "token_u32": frame.token_u32,
+            "rssi": frame.rssi,
+        }
+        if not result.ok:
+            event["error"] = result.detail
+        self.log_event(event)
+
+        for listener in self._listeners:
+            try:
+                listener(frame, result)
+            except Exception:
+                pass
+        return result
+
+    def log_event(self, event: dict) -> None:
+        if self.log_sink is None:
+            return
+        stage = self.stages["log"]
+        stage.items_in += 1
+        started = time.perf_counter()
+        try:
+            self.log_sink.log(event)
+            stage.items_out += 1
+        except Exception:
+            stage.errors += 1
+        stage.busy_seconds += time.perf_counter() - started
+
+    async def _verify_worker(self) -> None:
+        while True:
+            frame = await self.queue.get()
+            self.stages["queue"].items_out += 1
+            try:
+                await self.process(frame)
+            finally:
+                self.queue.task_done()
+
+    async def _maintenance_worker(self) -> None:
+        """Keep the throttle table and peer claims from growing without bound; refresh rates."""
+        gateway = self.gateway
+        last_at = gateway.clock.monotonic()
+        last_adv, last_ibeacon = gateway.adv_seen, gateway.adv_ibeacon_prefix
+        while True:
+            await asyncio.sleep(5)
+            now = gateway.clock.monotonic()
+            elapsed = max(1e-9, now - last_at)
+            gateway.adv_rate = (gateway.adv_seen - last_adv) / elapsed
+            gateway.ibeacon_rate = (gateway.adv_ibeacon_prefix - last_ibeacon) / elapsed
+            last_at, last_adv, last_ibeacon = now, gateway.adv_seen, gateway.adv_ibeacon_prefix
+            if gateway.scan_watchdogs:
+                watchdogs = gateway.scan_watchdogs.values()
+                gateway.scanner_stalls = sum(w.stalls for w in watchdogs)
+                gateway.scanner_restarts = sum(w.restarts for w in watchdogs)
+                gateway.scanner_stalled = any(w.stalled for w in watchdogs)
+
+            self.gateway.prune_throttle()
+            if self.gateway.gossip is not None:
+                self.gateway.gossip.prune()
+            if self.presence is not None:
+                self.presence.expire()
+
+    async def run(self, *sources: AdvertisementSource, drain: bool = False) -> None:
+        """Run verify workers and `sources` until cancelled.
+
+        With drain=True (finite sources such as file replays), return once every
+        source has finished and all queued verifies have completed.
+        """
+        workers = [asyncio.create_task(self._verify_worker()) for _ in range(self.verify_workers)]
+        workers.append(asyncio.create_task(self._maintenance_worker()))
+        feeders = [asyncio.create_task(source.run(self)) for source in sources]
+        try:
+            if feeders:
+                await asyncio.gather(*feeders)
+            if drain:
+                await self.queue.join()
+            else:
+                await asyncio.gather(*workers)
+        finally:
+            for task in feeders + workers:
+                task.cancel()
+            await asyncio.gather(*feeders, *workers, return_exceptions=True)
+
+
+# Settings a running scanner picks up from its config file (see ConfigWatcher).
+# Anything else in the file is reported as needing a restart.
+LIVE_SETTINGS: Dict[str, Callable[[str], Any]] = {
+    "ATTENDANCE_MIN_RSSI": int,
+    "ATTENDANCE_STRICT_APPLE_ID": env_flag,
+    "ATTENDANCE_HTTP_TIMEOUT_SECONDS": float,
+    "ATTENDANCE_HTTP_RETRIES": int,
+    "ATTENDANCE_VERIFY_RPS": float,
+    "ATTENDANCE_VERIFY_BURST": float,
+    "ATTENDANCE_VERIFY_PER_USER_PENDING": int,
+    "ATTENDANCE_VERIFY_HEDGE_BUDGET": float,
+    "ATTENDANCE_VERIFY_HEDGE_PERCENTILE": float,
+    "ATTENDANCE_VERIFY_HEDGE_MIN_MS": float,
+    "ATTENDANCE_SCANNER_LOG_MAX_BYTES": int,
+    "ATTENDANCE_SCANNER_LOG_BACKUPS": int,
+}
+
+
+class LiveConfig:
+    """Applies LIVE_SETTINGS to the running gateway, pipeline, verify queue and logger.
+
+    Every value is parsed before anything is assigned, and the assignments
+    happen in one event loop callback, so the pipeline sees either the old
+    settings or the new ones; verify threads pick up a new timeout/retry count
+    on their next request. `pinned` names come from the real environment and
+    win over the file, as they do at startup.
+    """
+
+    def __init__(
+        self,
+        gateway: AttendanceGateway,
+        pipeline: "AttendancePipeline",
+        queue: "FairVerifyQueue",
+        logger: Optional[JsonlLogger] = None,
+        source: Optional[object] = None,
+        pinned: Tuple[str, ...] = (),
+    ) -> None:
+        self.gateway = gateway
+        self.pipeline = pipeline
+        self.queue = queue
+        self.logger = logger
+        self.source = source
+        self.pinned = frozenset(pinned)
+        # The capture child of --split-process parses frames itself.
+        self.names = frozenset(
+            name
+            for name in LIVE_SETTINGS
+            if not (name == "ATTENDANCE_STRICT_APPLE_ID" and isinstance(source, RingFrameSource))
+            and not (name.startswith("ATTENDANCE_SCANNER_LOG_") and logger is None)
+        )
+
+    def snapshot(self) -> Dict[str, Any]:
+        g, q = self.gateway, self.queue
+        values = {
+            "ATTENDANCE_MIN_RSSI": g.min_rssi,
+            "ATTENDANCE_STRICT_APPLE_ID": self.pipeline.strict_apple_id,
+            "ATTENDANCE_HTTP_TIMEOUT_SECONDS": g.http_timeout_seconds,
+            "ATTENDANCE_HTTP_RETRIES": g.http_retries,
+            "ATTENDANCE_VERIFY_RPS": q.bucket.rate,
+            "ATTENDANCE_VERIFY_BURST": q.bucket.burst,
+            "ATTENDANCE_VERIFY_PER_USER_PENDING": q.per_user_limit,
+            "ATTENDANCE_VERIFY_HEDGE_BUDGET": g.hedge_budget,
+            "ATTENDANCE_VERIFY_HEDGE_PERCENTILE": g.hedge_percentile,
+            "ATTENDANCE_VERIFY_HEDGE_MIN_MS": g.hedge_min_ms,
+        }
+        if self.logger is not None:
+            values["ATTENDANCE_SCANNER_LOG_MAX_BYTES"] = self.logger.max_bytes
+            values["ATTENDANCE_SCANNER_LOG_BACKUPS"] = self.logger.backups
+        return values
+
+    def apply(self, values: Dict[str, str]) -> Dict[str, list]:
+        """Apply the live settings found in `values`; returns {name: [old, new]} for what changed.
+
+        Raises ConfigError, leaving everything as it was, if any value is invalid.
+        """
+        parsed: Dict[str, Any] = {}
+        for name, raw in values.items():
+            if name not in self.names or name in self.pinned or raw.strip() == "":
+                continue
+            try:
+                parsed[name] = LIVE_SETTINGS[name](raw)
+            except ValueError:
+                raise ConfigError(f"{name} must be a number, got {raw!r}") from None
+        if parsed.get("ATTENDANCE_HTTP_TIMEOUT_SECONDS", 1.0) <= 0:
+            raise ConfigError("ATTENDANCE_HTTP_TIMEOUT_SECONDS must be positive")
+
+        before = self.snapshot()
+        g, q = self.gateway, self.queue
+        for name, value in parsed.items():
+            if name == "ATTENDANCE_MIN_RSSI":
+                g.min_rssi = value
+            elif name == "ATTENDANCE_STRICT_APPLE_ID":
+                self.pipeline.strict_apple_id = value
+                if isinstance(self.source, BleakAdvertisementSource):
+                    # Passive-scan match patterns follow on the next scanner (re)start.
+                    self.source.strict_apple_id = value
+            elif name == "ATTENDANCE_HTTP_TIMEOUT_SECONDS":
+                g.http_timeout_seconds = value
+            elif name == "ATTENDANCE_HTTP_RETRIES":
+                g.http_retries = max(1, value)
+            elif name == "ATTENDANCE_VERIFY_RPS":
+                q.bucket.rate = max(0.0, value)
+            elif name == "ATTENDANCE_VERIFY_BURST":
+                q.bucket.burst = max(1.0, value)
+            elif name == "ATTENDANCE_VERIFY_PER_USER_PENDING":
+                q.per_user_limit = max(1, value)
+            elif name == "ATTENDANCE_VERIFY_HEDGE_BUDGET":
+                g.hedge_budget = max(0.0, value)
+            elif name == "ATTENDANCE_VERIFY_HEDGE_PERCENTILE":
+                g.hedge_percentile = min(99.9, max(50.0, value))
+            elif name == "ATTENDANCE_VERIFY_HEDGE_MIN_MS":
+                g.hedge_min_ms = max(0.0, value)
+            elif name == "ATTENDANCE_SCANNER_LOG_MAX_BYTES":
+                self.logger.max_bytes = max(100_000, value)
+            elif name == "ATTENDANCE_SCANNER_LOG_BACKUPS":
+                self.logger.backups = max(0, value)
+        after = self.snapshot()
+        return {name: [before[name], after[name]] for name in after if after[name] != before[name]}
+
+
+class ConfigWatcher:
+    """Reloads a KEY=VALUE config file into a LiveConfig when it changes or on SIGHUP.
+
+    The file is polled with stat() (no inotify dependency) and a change is only
+    read once it has held still for one poll, so a half-written save is not
+    picked up. Every reload, or rejected reload, is logged with what changed;
+    the running settings stay as they were when the file doesn't parse.
+
+    Only settings whose value in the file was edited are applied, so a value
+    set by a command-line flag or an interactive prompt survives reloads
+    until its own line in the file changes.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        live: LiveConfig,
+        log: Callable[[dict], None],
+        interval: float = 2.0,
+        initial: Optional[Dict[str, str]] = None,
+    ) -> None:
+        self.path = path
+        self.live = live
+        self.log = log
+        self.interval = max(0.2, float(interval))
+        self.values: Dict[str, str] = dict(initial) if initial is not None else {}
+        self.reloads = 0
+        self.failures = 0
+        self._stat = self._stat_key()
+        self._loop = None
+
+    def _stat_key(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = self.path.stat()
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def install(self, loop) -> bool:
+        """Reload on SIGHUP; False where that signal doesn't exist (Windows)."""
+        if not hasattr(signal, "SIGHUP"):
+            return False
+        self._loop = loop
+        loop.add_signal_handler(signal.SIGHUP, self.reload, "sighup")
+        return True
+
+    def close(self) -> None:
+        if self._loop is not None:
+            self._loop.remove_signal_handler(signal.SIGHUP)
+            self._loop = None
+
+    def reload(self, trigger: str = "file") -> bool:
+        self._stat = self._stat_key()
+        try:
+            values = read_env_file(self.path)
+            edited = {name for name in set(values) | set(self.values) if values.get(name) != self.values.get(name)}
+            changes = self.live.apply({name: values[name] for name in edited if name in values})
+        except (ConfigError, OSError, UnicodeDecodeError) as e:
+            self.failures += 1
+            self.log({"event": "config_reload_failed", "path": str(self.path), "trigger": trigger, "error": str(e)})
+            return False
+
+        self.values = values
+        self.reloads += 1
+        self.log(
+            {
+                "event": "config_reloaded",
+                "path": str(self.path),
+                "trigger": trigger,
+                "changes": changes,
+                # Names only: the file also holds the scanner key.
+                "restart_required": sorted(edited - self.live.names),
+                "pinned_by_env": sorted(edited & self.live.names & self.live.pinned),
+            }
+        )
+        return True
+
+    async def run(self) -> None:
+        settling: Optional[Tuple[int, int, int]] = None
+        while True:
+            await asyncio.sleep(self.interval)
+            key = self._stat_key()
+            if key == self._stat or key is None:
+                # Unchanged, or deleted/mid-rename: keep the running settings.
+                settling = None
+                continue
+            if key != settling:
+                settling = key
+                continue
+            settling = None
+            self.reload("file")
+
+
+LOAD_LEVELS = ("normal", "degraded", "shedding")
+# What main() turns each level into: dashboard refresh and event log deferral, in seconds.
+UI_REFRESH_SECONDS = (0.25, 1.0, 2.0)
+LOG_DEFER_SECONDS = (0.0, 1.0, 5.0)
+
+
+class LoopLagMonitor:
+    """Measures event loop lag and sheds non-essential work while the loop is behind.
+
+    run() sleeps `interval` at a time; how late each wake-up is, is time the
+    loop spent on something else (Rich renders, log writes, poll re-scans,
+    debug printing) while advertisements and verifies waited. p50/p95/p99/max
+    are kept over the last `window` samples.
+
+    When p95 reaches degrade_ms the level goes to 1 ("degraded"), at shed_ms
+    to 2 ("shedding"). It steps back down one level at a time, and only after
+    p95 has stayed under half the current level's threshold for
+    recover_seconds, so one slow render doesn't make it flap. Each change
+    calls the registered actions with the new level and is logged as a
+    load_shedding event; with shedding=False the levels are tracked and
+    logged but nothing is degraded.
+    """
+
+    def __init__(
+        self,
+        log: Callable[[dict], None],
+        interval: float = 0.1,
+        window: int = 100,
+        degrade_ms: float = 50.0,
+        shed_ms: float = 250.0,
+        recover_seconds: float = 10.0,
+        shedding: bool = True,
+        clock: Optional[SystemClock] = None,
+    ) -> None:
+        self.log = log
+        self.interval = max(0.01, float(interval))
+        self.degrade_ms = max(1.0, float(degrade_ms))
+        self.shed_ms = max(self.degrade_ms, float(shed_ms))
+        self.recover_seconds = max(0.0, float(recover_seconds))
+        self.shedding = bool(shedding)
+        self.clock = clock if clock is not None else SYSTEM_CLOCK
+        self.samples: Deque[float] = deque(maxlen=max(10, int(window)))
+        self.actions: List[Tuple[str, Callable[[int], None]]] = []
+        self.level = 0
+        self._level_since = self.clock.monotonic()
+        self._calm_since: Optional[float] = None
+
+        self.max_lag_ms = 0.0
+        self.transitions = 0
+        self.action_errors = 0
+        self.seconds_at_level = [0.0] * len(LOAD_LEVELS)
+
+    def add_action(self, name: str, apply: Callable[[int], None]) -> None:
+        """Call `apply(level)` on every level change (level 0 = restore normal operation)."""
+        self.actions.append((name, apply))
+
+    def percentiles(self) -> Dict[str, Optional[float]]:
+        ordered = sorted(self.samples)
+        return {
+            "lag_p50_ms": _percentile(ordered, 50),
+            "lag_p95_ms": _percentile(ordered, 95),
+            "lag_p99_ms": _percentile(ordered, 99),
+            "lag_max_ms": round(ordered[-1], 1) if ordered else None,
+        }
+
+    def _threshold(self, level: int) -> float:
+        return self.shed_ms if level >= 2 else self.degrade_ms
+
+    def record(self, lag_ms: float, now: Optional[float] = None) -> Optional[int]:
+        """Add one lag sample; returns the new level if it changed."""
+        now = self.clock.monotonic() if now is None else now
+        lag_ms = max(0.0, float(lag_ms))
+        self.samples.append(lag_ms)
+        self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+
+        p95 = _percentile(sorted(self.samples), 95) or 0.0
+        target = 2 if p95 >= self.shed_ms else 1 if p95 >= self.degrade_ms else 0
+        if target > self.level:
+            self._calm_since = None
+            return self._set_level(target, now)
+        if self.level == 0 or p95 >= self._threshold(self.level) / 2:
+            self._calm_since = None
+            return None
+        if self._calm_since is None:
+            self._calm_since = now
+        if now - self._calm_since < self.recover_seconds:
+            return None
+        self._calm_since = now
+        return self._set_level(self.level - 1, now)
+
+    def _set_level(self, level: int, now: float) -> int:
+        previous = self.level
+        self.seconds_at_level[previous] += now - self._level_since
+        self.level, self._level_since = level, now
+        self.transitions += 1
+        self.log(
+            {
+                "event": "load_shedding",
+                "level": level,
+                "state": LOAD_LEVELS[level],
+                "previous": LOAD_LEVELS[previous],
+                **self.percentiles(),
+                "actions": [name for name, _ in self.actions] if self.shedding else [],
+            }
+        )
+        if self.shedding:
+            for _, apply in self.actions:
+                try:
+                    apply(level)
+                except Exception:
+                    # A broken action must not take the monitor (and the other actions) down with it.
+                    self.action_errors += 1
+        return level
+
+    async def run(self) -> None:
+        while True:
+            expected = self.clock.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = self.clock.monotonic()
+            self.record((now - expected) * 1000.0, now)
+
+    def stats(self) -> dict:
+        seconds = list(self.seconds_at_level)
+        seconds[self.level] += self.clock.monotonic() - self._level_since
+        return {
+            **self.percentiles(),
+            "lag_peak_ms": round(self.max_lag_ms, 1),
+            "transitions": self.transitions,
+            "action_errors": self.action_errors,
+            "seconds": {name: round(value, 1) for name, value in zip(LOAD_LEVELS, seconds)},
+        }
+
+    def summary(self) -> str:
+        p = self.percentiles()
+        if p["lag_p50_ms"] is None:
+            return "-"
+        state = LOAD_LEVELS[self.level]
+        if self.level:
+            state = f"[{'yellow' if self.level == 1 else 'red'}]{state}[/]"
+        # Whole milliseconds: sub-ms jitter would otherwise re-render the dashboard every tick.
+        return f"{state}, p50 {p['lag_p50_ms']:.0f} / p95 {p['lag_p95_ms']:.0f} / max {p['lag_max_ms']:.0f} ms"
+
+
+@dataclass(frozen=True)
+class DashboardSnapshot:
+    """Everything the Live dashboard shows, read from the gateway once per UI tick.
+
+    Values are pre-formatted strings, so two snapshots compare equal exactly
+    when the screen would look the same and the render can be skipped.
+    """
+
+    metrics: Tuple[Tuple[str, str], ...]
+    recent: Tuple[Tuple[str, str, str, str], ...]
+    present: Tuple[Tuple[str, str, str, str, str], ...]
+    present_total: int
+    page: int
+    pages: int
+
+
+def _short_user(user_id: str) -> str:
+    return user_id[:8] + "…" + user_id[-4:] if len(user_id) > 16 else user_id
+
+
+def _clock_hms(epoch: Optional[float]) -> str:
+    return time.strftime('%H:%M:%S', time.localtime(epoch)) if epoch else "-"
+
+
+def take_dashboard_snapshot(
+    gateway: AttendanceGateway,
+    verify_queue: FairVerifyQueue,
+    ring: Optional[FrameRing] = None,
+    presence: Optional[PresenceTracker] = None,
+    page: int = 0,
+    page_size: int = 15,
+    debug_tap: Optional[DebugTap] = None,
+    heartbeat: Optional[HeartbeatReporter] = None,
+    lag_monitor: Optional[LoopLagMonitor] = None,
+) -> DashboardSnapshot:
+    m: List[Tuple[str, str]] = []
+    if gateway.scan_mode:
+        mode = gateway.scan_mode
+        if gateway.scan_mode == "passive":
+            mode = "[green]passive[/green] (BlueZ iBeacon filter)"
+        elif gateway.scan_fallback:
+            mode = "active [yellow](passive unavailable)[/yellow]"
+        m.append(("Scan mode", mode))
+    for name, watchdog in gateway.scan_watchdogs.items():
+        m.append((f"Scanner {name}", watchdog.summary()))
+    if not gateway.scan_watchdogs and (gateway.scanner_stalls or gateway.scanner_stalled):
+        state = "[red]stalled[/red]" if gateway.scanner_stalled else "ok"
+        m.append(("Scanner", f"{state}, stalls {gateway.scanner_stalls}, restarts {gateway.scanner_restarts}"))
+    m += [
+        ("Callbacks/s | iBeacon/s", f"{gateway.adv_rate:.1f} | {gateway.ibeacon_rate:.1f}"),
+        ("Adv callbacks", str(gateway.adv_seen)),
+        ("Poll cycles", str(gateway.poll_cycles)),
+        ("Poll devices", str(gateway.poll_devices)),
+        ("Adv w/ manufacturer", str(gateway.adv_with_mfg)),
+        ("iBeacon prefix seen", str(gateway.adv_ibeacon_prefix)),
+        ("Frames seen", str(gateway.frames_seen)),
+        ("iBeacon parsed", str(gateway.frames_parsed)),
+        ("Enqueued", str(gateway.enqueued)),
+    ]
+    if gateway.dropped_queue_full:
+        m.append(("Dropped (queue full)", f"[red]{gateway.dropped_queue_full}[/red]"))
+    if ring is not None:
+        m.append(("Ring depth", f"{len(ring)}/{ring.capacity}"))
+        if gateway.ring_producer_dropped:
+            m.append(("Dropped (ring full)", f"[red]{gateway.ring_producer_dropped}[/red]"))
+    m.append(("Verify queue", f"{verify_queue.qsize()}/{verify_queue.maxsize}"))
+    if verify_queue.limiter_waits:
+        state = "[yellow]saturated[/yellow]" if verify_queue.limiter_saturated else "ok"
+        m.append(
+            (
+                "Rate limiter",
+                f"{state}, {verify_queue.limiter_waits} waits, {verify_queue.limiter_wait_seconds:.1f}s",
+            )
+        )
+    if verify_queue.per_user_throttled:
+        top = ", ".join(f"{u[:8]}…×{n}" for u, n in verify_queue.top_throttled())
+        m.append(("Per-user throttled", f"{verify_queue.per_user_throttled} ({top})"))
+    m.append(("Verify requests", str(gateway.requests_sent)))
+    m.append(("Verify OK", f"[green]{gateway.requests_ok}[/green]"))
+    m.append(("Verify ERR", f"[red]{gateway.requests_err}[/red]"))
+    if gateway.hedges_sent or gateway.hedges_over_budget:
+        m.append(
+            (
+                "Hedged verifies",
+                f"{gateway.hedges_sent} ({gateway.hedges_sent / max(1, gateway.requests_sent):.0%}), "
+                f"{gateway.hedge_wins} won, after {gateway.hedge_deadline_ms():.0f} ms",
+            )
+        )
+    m.append(("Throttle entries", str(len(gateway._last_sent))))
+    if gateway.gossip is not None:
+        m.append(("Peer claims", f"{len(gateway.gossip)} active, {gateway.gossip_suppressed} suppressed"))
+    if debug_tap is not None:
+        m.append(("Debug tap", debug_tap.summary()))
+    if heartbeat is not None:
+        m.append(("Heartbeat", heartbeat.summary()))
+    if lag_monitor is not None:
+        m.append(("Loop lag", lag_monitor.summary()))
+    if gateway.state_saves:
+        m.append(("State snapshot", f"{gateway.state_last_bytes / 1024:.1f} KiB in {gateway.state_last_ms:.1f} ms"))
+    last_seen = gateway.last_seen
+    if last_seen:
+        m.append(("Last UUID", last_seen.user_id))
+        m.append(("Last token_u32", str(last_seen.token_u32)))
+        m.append(("Last RSSI", f"{last_seen.rssi} dBm"))
+    if gateway.last_ok_at:
+        m.append(("Last OK", _clock_hms(gateway.last_ok_at)))
+    if gateway.last_err_at:
+        m.append(("Last ERR", _clock_hms(gateway.last_err_at)))
+    if gateway.last_err:
+        m.append(("Last error", gateway.last_err))
+
+    recent = tuple(
+        (str(r.get("at", "")), _short_user(str(r.get("user", ""))), f"{r.get('rssi', '')}", f"{r.get('status', '')}")
+        for r in list(gateway.recent_verified)[:5]
+    )
+
+    present: Tuple[Tuple[str, str, str, str, str], ...] = ()
+    total = pages = 0
+    if presence is not None:
+        presence.expire()
+        total = len(presence)
+        page_size = max(1, int(page_size))
+        pages = max(1, -(-total // page_size))
+        page = min(max(0, int(page)), pages - 1)
+        present = tuple(
+            (_short_user(user_id), str(rssi), _clock_hms(first), _clock_hms(last), _clock_hms(verified_at))
+            for user_id, first, last, rssi, verified_at in presence.page(page, page_size)
+        )
 
-        self._last_sent[key] = now
-        return True
+    return DashboardSnapshot(
+        metrics=tuple(m),
+        recent=recent,
+        present=present,
+        present_total=total,
+        page=page,
+        pages=pages,
+    )
 
-    def verify(self, frame: BeaconFrame) -> None:
-        self.requests_sent += 1
-        endpoint = f"{self.supabase_url}/functions/v1/attendance-verify-scan"
-        headers = {
-            "Content-Type": "application/json",
-            "x-scanner-key": self.scanner_key,
-        }
-        payload = {
-            "user_id": frame.user_id,
-            "gym_id": self.gym_id,
-            "token_u32": frame.token_u32,
-            "scanner_id": self.scanner_id,
-            "rssi": frame.rssi,
-        }
 
-        try:
-            res = self._post_json_with_retries(endpoint, headers=headers, payload=payload)
-        except Exception as e:
-            self.last_err_at = time.time()
-            self.last_err = f"network error: {e}"
-            self.last_status_code = None
-            return
+def profiling_gauges(
+    gateway: AttendanceGateway,
+    verify_queue: FairVerifyQueue,
+    presence: Optional[PresenceTracker] = None,
+    debug_tap: Optional[DebugTap] = None,
+) -> Dict[str, int]:
+    """Sizes of the long-lived tables, reported next to tracemalloc diffs (see profiling.py)."""
+    gauges = {
+        "throttle_entries": len(gateway._last_sent),
+        "queue_depth": verify_queue.qsize(),
+        "queue_users": len(verify_queue._pending),
+    }
+    if gateway.gossip is not None:
+        gauges["gossip_claims"] = len(gateway.gossip._claims)
+    if presence is not None:
+        gauges["presence_members"] = len(presence)
+    if debug_tap is not None:
+        gauges["debug_tap_buffered"] = len(debug_tap._buffer)
+    return gauges
 
-        self.last_status_code = res.status_code
 
-        if 200 <= res.status_code < 300:
-            self.requests_ok += 1
-            self.last_ok_at = time.time()
-            try:
-                data = res.json()
-            except Exception:
-                data = res.text
-            self.last_ok = str(data)
-            return
+def render_dashboard(snapshot: DashboardSnapshot):
+    """Build the Rich layout for one snapshot (Rich is imported lazily; the daemon never needs it)."""
+    from rich.layout import Layout
+    from rich.panel import Panel
+    from rich.table import Table
 
-        self.requests_err += 1
-        self.last_err_at = time.time()
-        try:
-            err = res.json()
-        except Exception:
-            err = res.text
+    metrics = Table(title="Scanner Status", expand=True)
+    metrics.add_column("Metric")
+    metrics.add_column("Value", justify="right")
+    for label, value in snapshot.metrics:
+        metrics.add_row(label, value)
 
-        if res.status_code == 401:
-            self.last_err = (
-                "Unauthorized (401). Verify ATTENDANCE_SCANNER_KEY and that your scanner is registered as active "
-                f"for gym_id={self.gym_id} and scanner_id={self.scanner_id}."
-            )
-        else:
-            self.last_err = f"status={res.status_code} -> {err}"
+    recent = Table(title="Latest verified (top 5)", expand=True)
+    recent.add_column("Time", no_wrap=True)
+    recent.add_column("User", overflow="fold")
+    recent.add_column("RSSI", justify="right")
+    recent.add_column("HTTP", justify="right")
+    for row in snapshot.recent or (("-", "(none yet)", "-", "-"),):
+        recent.add_row(*row)
 
-    def validate_scanner_key(self) -> bool:
-        """Preflight check: ensure (gym_id, scanner_id, key) is registered and active.
+    layout = Layout(name="root")
+    layout.split_row(
+        Layout(name="left", ratio=2),
+        Layout(name="right", ratio=3),
+    )
+    layout["left"].update(Panel(metrics, title="Metrics"))
 
-        This calls an Edge Function so the scanner never needs the stored hash.
-        """
+    if snapshot.pages:
+        present = Table(expand=True)
+        present.add_column("User", overflow="fold")
+        present.add_column("RSSI", justify="right")
+        present.add_column("First seen", no_wrap=True)
+        present.add_column("Last seen", no_wrap=True)
+        present.add_column("Verified", no_wrap=True)
+        for row in snapshot.present or (("(nobody in range)", "-", "-", "-", "-"),):
+            present.add_row(*row)
+        layout["right"].split_column(
+            Layout(Panel(recent, title="Latest verified"), name="recent", size=11),
+            Layout(
+                Panel(
+                    present,
+                    title=f"Present: {snapshot.present_total} (page {snapshot.page + 1}/{snapshot.pages}, n/p to page)",
+                ),
+                name="present",
+            ),
+        )
+    else:
+        layout["right"].update(Panel(recent, title="Latest verified"))
+    return layout
 
-        endpoint = f"{self.supabase_url}/functions/v1/attendance-validate-scanner"
-        headers = {
-            "Content-Type": "application/json",
-            "x-scanner-key": self.scanner_key,
-        }
-        payload = {
-            "gym_id": self.gym_id,
-            "scanner_id": self.scanner_id,
-        }
 
-        try:
-            res = self._post_json_with_retries(endpoint, headers=headers, payload=payload)
-        except Exception as e:
-            self.last_err_at = time.time()
-            self.last_err = (
-                f"key validation network error: {e} (timeout={self.http_timeout_seconds}s, retries={self.http_retries})"
-            )
-            self.last_status_code = None
-            return False
+@contextlib.contextmanager
+def _keypresses(on_key: Callable[[str], None]):
+    """Deliver single keypresses from a TTY stdin to `on_key` while the Live UI runs."""
+    if sys.stdin is None or not sys.stdin.isatty():
+        yield
+        return
+    try:
+        import termios
+        import tty
+    except ImportError:
+        yield
+        return
 
-        self.last_status_code = res.status_code
+    fd = sys.stdin.fileno()
+    saved = termios.tcgetattr(fd)
+    loop = asyncio.get_running_loop()
 
-        if 200 <= res.status_code < 300:
-            self.last_ok_at = time.time()
-            self.last_ok = "scanner key validated"
-            try:
-                data = res.json()
-                hint = data.get("key_hint") if isinstance(data, dict) else None
-                self.key_hint = str(hint).strip() if hint else None
-            except Exception:
-                self.key_hint = None
-            return True
+    def readable() -> None:
+        data = os.read(fd, 32)
+        for ch in data.decode("utf-8", "ignore"):
+            on_key(ch)
 
-        self.last_err_at = time.time()
-        if res.status_code == 401:
-            self.last_err = "Invalid scanner key (401)."
-        elif res.status_code == 404:
-            self.last_err = (
-                "Validation function not found (404). Deploy the Edge Function 'attendance-validate-scanner'."
-            )
-        else:
-            self.last_err = f"key validation failed: status={res.status_code} -> {res.text}"
-        return False
+    tty.setcbreak(fd)
+    loop.add_reader(fd, readable)
+    try:
+        yield
+    finally:
+        loop.remove_reader(fd)
+        termios.tcsetattr(fd, termios.TCSADRAIN, saved)
 
 
 async def main() -> None:
+    # A --config file fills in whatever the real environment doesn't set, before
+    # the env-derived flag defaults below are read.
+    preparser = argparse.ArgumentParser(add_help=False)
+    preparser.add_argument("--config", default=os.environ.get("ATTENDANCE_CONFIG"))
+    config_arg = preparser.parse_known_args()[0].config
+    config_path = Path(config_arg).expanduser() if config_arg else None
+    config_values: Dict[str, str] = {}
+    if config_path is not None:
+        try:
+            config_values = read_env_file(config_path)
+        except (ConfigError, OSError) as e:
+            print(f"Config error: {e}", file=sys.stderr)
+            sys.exit(2)
+    # Real environment variables that differ from the file win over it, now and on reload.
+    config_pinned = tuple(name for name in LIVE_SETTINGS if name in os.environ and os.environ[name] != config_values.get(name))
+    for key, value in config_values.items():
+        os.environ.setdefault(key, value)
+
     parser = argparse.ArgumentParser(description="LiftCo attendance scanner gateway")
+    parser.add_argument(
+        "--config",
+        default=os.environ.get("ATTENDANCE_CONFIG"),
+        help="KEY=VALUE file with ATTENDANCE_* settings (real environment variables win). Live settings such as "
+        "ATTENDANCE_MIN_RSSI are re-applied when the file changes or on SIGHUP. Env: ATTENDANCE_CONFIG",
+    )
     parser.add_argument(
         "--supabase-url",
         help="Supabase project URL (e.g. https://<ref>.supabase.co). Can also be set via SUPABASE_URL env var.",
@@ -341,13 +3305,68 @@ async def main() -> None:
     parser.add_argument(
         "--strict-apple-id",
         action="store_true",
-        help="Only accept iBeacon frames where company_id == 0x004C (Apple). Default: accept any company_id if payload matches iBeacon prefix.",
+        default=env_flag(os.environ.get("ATTENDANCE_STRICT_APPLE_ID", "0")),
+        help="Only accept iBeacon frames where company_id == 0x004C (Apple). Default: accept any company_id if payload matches iBeacon prefix. "
+        "Env: ATTENDANCE_STRICT_APPLE_ID=1",
+    )
+    parser.add_argument(
+        "--scan-filter",
+        choices=SCAN_FILTER_MODES,
+        default=os.environ.get("ATTENDANCE_SCAN_FILTER", "off"),
+        help="Filter in BlueZ with passive scanning + iBeacon advertisement monitor patterns: "
+        "auto = fall back to active scanning if unsupported, require = fail instead (default: off). "
+        "Env: ATTENDANCE_SCAN_FILTER",
+    )
+    parser.add_argument(
+        "--stall-seconds",
+        type=float,
+        default=float(os.environ.get("ATTENDANCE_STALL_SECONDS", "30")),
+        help="Restart the BLE scanner when advertisements stop for this long after steady traffic; 0 disables "
+        "(default: 30). Env: ATTENDANCE_STALL_SECONDS",
+    )
+    parser.add_argument(
+        "--profiling",
+        action="store_true",
+        default=env_flag(os.environ.get("ATTENDANCE_PROFILING", "0")),
+        help="Enable signal-driven profiling: SIGUSR1 toggles a CPU profile, SIGUSR2 takes a tracemalloc diff. "
+        "Reports go to profiles/ next to the JSONL log. Env: ATTENDANCE_PROFILING",
+    )
+    parser.add_argument(
+        "--heartbeat-seconds",
+        type=float,
+        default=float(os.environ.get("ATTENDANCE_HEARTBEAT_SECONDS", "60")),
+        help="Upload a health heartbeat (counters, verify latency, queue, adapter) this often; idle scanners back off "
+        "to ATTENDANCE_HEARTBEAT_IDLE_SECONDS. 0 disables; never sent with --dry-run (default: 60). "
+        "Env: ATTENDANCE_HEARTBEAT_SECONDS",
     )
     parser.add_argument(
         "--debug-adv",
         action="store_true",
         help="Print manufacturer data seen (for debugging when scanner doesn't detect beacons).",
     )
+    parser.add_argument(
+        "--debug-rate",
+        type=float,
+        default=20.0,
+        help="With --debug-adv: max lines per second, 0 = no cap (default: 20). Extra lines are counted, not printed.",
+    )
+    parser.add_argument(
+        "--debug-sample",
+        type=float,
+        default=1.0,
+        help="With --debug-adv: fraction of payloads to keep, 0..1 (default: 1).",
+    )
+    parser.add_argument(
+        "--debug-address",
+        action="append",
+        metavar="ADDR",
+        help="With --debug-adv: only show addresses starting with ADDR (repeatable, case-insensitive).",
+    )
+    parser.add_argument(
+        "--debug-out",
+        metavar="PATH",
+        help="With --debug-adv: append debug lines to PATH instead of the console.",
+    )
     parser.add_argument(
         "--verbose",
         action="store_true",
@@ -372,15 +3391,98 @@ async def main() -> None:
         default=int(os.environ.get("ATTENDANCE_HTTP_RETRIES", "3")),
         help="Network retry attempts for Edge Function calls (default: 3). Env: ATTENDANCE_HTTP_RETRIES",
     )
+    parser.add_argument(
+        "--state-interval",
+        type=float,
+        default=float(os.environ.get("ATTENDANCE_SCANNER_STATE_INTERVAL_SECONDS", "15")),
+        help="Seconds between warm-restart state snapshots (default: 15). Env: ATTENDANCE_SCANNER_STATE_INTERVAL_SECONDS",
+    )
+    parser.add_argument(
+        "--no-load-shedding",
+        action="store_true",
+        default=not env_flag(os.environ.get("ATTENDANCE_LOAD_SHEDDING", "1")),
+        help="Only measure event loop lag; don't slow the dashboard, polling, --debug-adv output or log writes "
+        "while the loop is behind. Env: ATTENDANCE_LOAD_SHEDDING=0",
+    )
+    parser.add_argument(
+        "--log-format",
+        choices=LOG_FORMATS,
+        default=os.environ.get("ATTENDANCE_SCANNER_LOG_FORMAT", "jsonl"),
+        help="Event log format: jsonl, or binary (.lcev, smaller and cheaper to write; read it with "
+        "event_log.py cat/convert). Env: ATTENDANCE_SCANNER_LOG_FORMAT",
+    )
+    parser.add_argument(
+        "--no-state",
+        action="store_true",
+        help="Do not load or save the warm-restart state snapshot (throttle table, counters).",
+    )
+    parser.add_argument(
+        "--gossip",
+        action="store_true",
+        default=bool(int(os.environ.get("ATTENDANCE_GOSSIP", "0"))),
+        help="Share verify claims with other scanners at this gym over UDP multicast to avoid duplicate verifies. Env: ATTENDANCE_GOSSIP=1",
+    )
+    parser.add_argument(
+        "--verify-rps",
+        type=float,
+        default=float(os.environ.get("ATTENDANCE_VERIFY_RPS", "10")),
+        help="Global cap on verify calls per second to Supabase, 0 = unlimited (default: 10). Env: ATTENDANCE_VERIFY_RPS",
+    )
+    parser.add_argument(
+        "--verify-burst",
+        type=float,
+        default=float(os.environ.get("ATTENDANCE_VERIFY_BURST", "20")),
+        help="Verify calls allowed in a burst above --verify-rps (default: 20). Env: ATTENDANCE_VERIFY_BURST",
+    )
+    parser.add_argument(
+        "--btsnoop",
+        metavar="PATH",
+        help="Read advertisements from a btsnoop capture (btmon -w / hcidump --btsnoop -w) instead of a BLE adapter.",
+    )
+    parser.add_argument(
+        "--replay",
+        metavar="PATH",
+        help="Replay a file written by --record instead of scanning a BLE adapter.",
+    )
+    parser.add_argument(
+        "--record",
+        metavar="PATH",
+        help="Append every advertisement seen (time, address, RSSI, company ID, payload) to a compact binary recording.",
+    )
+    parser.add_argument(
+        "--replay-speed",
+        type=float,
+        default=1.0,
+        help="Playback speed for file sources: 1 = wall clock, 10 = 10x faster, 0 = as fast as possible (default: 1).",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Don't call Supabase: skip key validation and count every queued verify as OK (for replays and throughput tests).",
+    )
+    parser.add_argument(
+        "--split-process",
+        action="store_true",
+        default=bool(int(os.environ.get("ATTENDANCE_SPLIT_PROCESS", "0"))),
+        help="Run BLE capture + iBeacon parsing in a separate process connected by a shared-memory ring; "
+        "verify, logging and UI stay in this process. Env: ATTENDANCE_SPLIT_PROCESS=1",
+    )
     args = parser.parse_args()
+    if args.btsnoop and args.replay:
+        parser.error("--btsnoop and --replay are mutually exclusive")
+    if args.record and args.split_process:
+        # The capture process parses before the ring; raw advertisements never reach this process.
+        parser.error("--record is not supported with --split-process")
+
+    # File sources replay captures, so they work without a Bluetooth stack.
+    file_source = bool(args.btsnoop or args.replay)
 
     try:
-        from bleak import BleakScanner
+        if not file_source:
+            from bleak import BleakScanner
         from rich.console import Console
-        from rich.layout import Layout
         from rich.live import Live
         from rich.panel import Panel
-        from rich.table import Table
         from rich.prompt import Confirm, IntPrompt, Prompt
     except ModuleNotFoundError as e:
         # Keep --help usable even without deps (argparse exits before this).
@@ -487,7 +3589,10 @@ async def main() -> None:
             default=str(args.scanner_id or "laptop-1"),
         ).strip() or "laptop-1"
 
-    if not args.scanner_key:
+    if args.dry_run:
+        # Nothing is sent to Supabase, so no secret is needed.
+        args.scanner_key = args.scanner_key or ""
+    elif not args.scanner_key:
         require_tty_or_exit("--scanner-key / ATTENDANCE_SCANNER_KEY")
         explain_secrets()
         if not Confirm.ask("Continue and enter ATTENDANCE_SCANNER_KEY now?", default=True):
@@ -567,18 +3672,33 @@ async def main() -> None:
         min_rssi=args.min_rssi,
         http_timeout_seconds=args.http_timeout,
         http_retries=args.http_retries,
+        hedge_budget=float(os.environ.get("ATTENDANCE_VERIFY_HEDGE_BUDGET", "0.1")),
+        hedge_percentile=float(os.environ.get("ATTENDANCE_VERIFY_HEDGE_PERCENTILE", "95")),
+        hedge_min_ms=float(os.environ.get("ATTENDANCE_VERIFY_HEDGE_MIN_MS", "250")),
     )
 
-    # Local JSONL logging.
+    # Local event log (JSONL unless --log-format binary).
     log_path_raw = os.environ.get("ATTENDANCE_SCANNER_LOG_PATH")
     if log_path_raw:
         log_path = Path(log_path_raw).expanduser()
     else:
         base = Path.home() / ".liftco" / "attendance_scanner" / "logs"
-        log_path = base / f"scanner_gym{args.gym_id}_{_safe_filename(args.scanner_id)}.jsonl"
+        suffix = ".lcev" if args.log_format == "binary" else ".jsonl"
+        log_path = base / f"scanner_gym{args.gym_id}_{_safe_filename(args.scanner_id)}{suffix}"
     log_max = int(os.environ.get("ATTENDANCE_SCANNER_LOG_MAX_BYTES", "5000000"))
     log_backups = int(os.environ.get("ATTENDANCE_SCANNER_LOG_BACKUPS", "3"))
-    logger = JsonlLogger(log_path, max_bytes=log_max, backups=log_backups)
+    logger = open_event_logger(log_path, args.log_format, max_bytes=log_max, backups=log_backups)
+
+    # Warm-restart state snapshot (dedupe/throttle table + counters).
+    state_store: Optional[GatewayStateStore] = None
+    if not args.no_state:
+        state_path_raw = os.environ.get("ATTENDANCE_SCANNER_STATE_PATH")
+        if state_path_raw:
+            state_path = Path(state_path_raw).expanduser()
+        else:
+            base = Path.home() / ".liftco" / "attendance_scanner" / "state"
+            state_path = base / f"scanner_gym{args.gym_id}_{_safe_filename(args.scanner_id)}.state"
+        state_store = GatewayStateStore(state_path)
 
     console.print(
         Panel.fit(
@@ -591,7 +3711,9 @@ async def main() -> None:
                     f"Min RSSI: {args.min_rssi} dBm",
                     f"Adapter: {args.adapter or '(default)'}",
                     f"Log: {str(log_path)}",
+                    f"State: {str(state_store.path) if state_store else '(disabled)'}",
                     f"HTTP timeout: {args.http_timeout}s (retries: {args.http_retries})",
+                    f"Verify rate limit: {f'{args.verify_rps:g}/s (burst {args.verify_burst:g})' if args.verify_rps > 0 else 'off'}",
                 ]
             ),
             title="Startup",
@@ -599,12 +3721,17 @@ async def main() -> None:
     )
 
     # Security gate: validate scanner key before doing any BLE scanning.
-    console.print("Validating scanner credentials…")
-    ok = await asyncio.to_thread(gateway.validate_scanner_key)
+    if args.dry_run:
+        console.print("[yellow]Dry run:[/yellow] skipping credential validation; nothing is sent to Supabase.")
+        ok = True
+    else:
+        console.print("Validating scanner credentials…")
+        ok = await asyncio.to_thread(gateway.validate_scanner_key)
     logger.log(
         {
             "event": "scanner_key_validation",
             "ok": bool(ok),
+            "dry_run": bool(args.dry_run),
             "gym_id": args.gym_id,
             "scanner_id": args.scanner_id,
             "status_code": gateway.last_status_code,
@@ -633,284 +3760,416 @@ async def main() -> None:
         )
         sys.exit(2)
 
+    if state_store is not None:
+        started = time.perf_counter()
+        restored = state_store.load(gateway)
+        logger.log(
+            {
+                "event": "state_restored",
+                "path": str(state_store.path),
+                "throttle_entries": restored,
+                "load_ms": round((time.perf_counter() - started) * 1000.0, 3),
+            }
+        )
+
+    gossip_transport = None
+    if args.gossip:
+        group = os.environ.get("ATTENDANCE_GOSSIP_GROUP", DEFAULT_GOSSIP_GROUP).strip()
+        port = int(os.environ.get("ATTENDANCE_GOSSIP_PORT", str(DEFAULT_GOSSIP_PORT)))
+        gossip = ScannerGossip(
+            args.gym_id,
+            secret=os.environ.get("ATTENDANCE_GOSSIP_SECRET") or None,
+            max_ttl_seconds=gateway.throttle_seconds,
+        )
+        try:
+            gossip_transport = await open_multicast_gossip(gossip, group=group, port=port)
+            gateway.gossip = gossip
+            console.print(f"[green]Gossip:[/green] sharing verify claims on {group}:{port}")
+        except OSError as e:
+            console.print(
+                Panel(
+                    f"Could not join multicast group {group}:{port}: {e}\n"
+                    "Continuing without cross-scanner dedupe.",
+                    title="[yellow]Gossip disabled[/yellow]",
+                )
+            )
+        logger.log(
+            {
+                "event": "gossip_started",
+                "ok": gateway.gossip is not None,
+                "group": group,
+                "port": port,
+            }
+        )
+
     if gateway.key_hint and bool(int(os.environ.get("ATTENDANCE_SHOW_KEY_HINT", "0"))):
         console.print(Panel(f"key_hint: [b]{gateway.key_hint}[/b]", title="Scanner Key Hint"))
 
     # Preflight: attempt a short scan to ensure BLE works (BlueZ running, permissions ok).
-    try:
-        kwargs = {}
-        if args.adapter:
-            kwargs["bluez"] = {"adapter": args.adapter}
+    if not file_source:
+        try:
+            kwargs = {}
+            if args.adapter:
+                kwargs["bluez"] = {"adapter": args.adapter}
 
-        devices = await BleakScanner.discover(timeout=args.scan_seconds, **kwargs)
+            devices = await BleakScanner.discover(timeout=args.scan_seconds, **kwargs)
 
-        # Discover can return empty without raising; treat that as a warning.
-        if not devices:
-            uid = os.geteuid() if hasattr(os, "geteuid") else None
+            # Discover can return empty without raising; treat that as a warning.
+            if not devices:
+                uid = os.geteuid() if hasattr(os, "geteuid") else None
+                console.print(
+                    Panel(
+                        "BLE preflight completed but found 0 devices.\n\n"
+                        "Common causes on Linux:\n"
+                        "- Bluetooth is off or no adapter present\n"
+                        "- BlueZ not running\n"
+                        "- Insufficient permissions (try running with sudo for a quick test)\n"
+                        "- Wrong adapter selected (use --adapter hci0)\n\n"
+                        f"Tip: current euid={uid}",
+                        title="[yellow]Preflight warning[/yellow]",
+                    )
+                )
+            else:
+                console.print(
+                    f"[green]Preflight OK:[/green] BLE scanning works (saw {len(devices)} devices)"
+                )
+        except Exception as e:
             console.print(
                 Panel(
-                    "BLE preflight completed but found 0 devices.\n\n"
-                    "Common causes on Linux:\n"
-                    "- Bluetooth is off or no adapter present\n"
-                    "- BlueZ not running\n"
-                    "- Insufficient permissions (try running with sudo for a quick test)\n"
-                    "- Wrong adapter selected (use --adapter hci0)\n\n"
-                    f"Tip: current euid={uid}",
-                    title="[yellow]Preflight warning[/yellow]",
+                    f"BLE scan preflight failed: {e}\n\n"
+                    "On Linux, common fixes:\n"
+                    "- Ensure BlueZ is running: `sudo systemctl status bluetooth`\n"
+                    "- Start it if needed: `sudo systemctl start bluetooth`\n"
+                    "- Check adapter: `bluetoothctl show`\n"
+                    "- Some distros require running as root or adding capabilities for BLE scan.",
+                    title="[red]Not Ready[/red]",
                 )
             )
-        else:
-            console.print(
-                f"[green]Preflight OK:[/green] BLE scanning works (saw {len(devices)} devices)"
-            )
-    except Exception as e:
-        console.print(
-            Panel(
-                f"BLE scan preflight failed: {e}\n\n"
-                "On Linux, common fixes:\n"
-                "- Ensure BlueZ is running: `sudo systemctl status bluetooth`\n"
-                "- Start it if needed: `sudo systemctl start bluetooth`\n"
-                "- Check adapter: `bluetoothctl show`\n"
-                "- Some distros require running as root or adding capabilities for BLE scan.",
-                title="[red]Not Ready[/red]",
-            )
-        )
-        sys.exit(2)
-
-    def detection_callback(device, adv_data):
-        gateway.adv_seen += 1
-        _handle_advertisement(device.address, adv_data.rssi, adv_data.manufacturer_data)
+            sys.exit(2)
 
-    def _handle_advertisement(address: str, rssi: int, manufacturer_data) -> None:
-        md = manufacturer_data or {}
-        if not md:
-            return
+    # --debug-adv goes through a sampled, bounded tap so printing never slows the scan callback.
+    debug_tap_options: Optional[dict] = None
+    debug_tap: Optional[DebugTap] = None
+    if args.debug_adv:
+        debug_tap_options = {
+            "capacity": int(os.environ.get("ATTENDANCE_DEBUG_BUFFER", "1024")),
+            "max_per_second": args.debug_rate,
+            "probability": args.debug_sample,
+            "addresses": args.debug_address,
+        }
+        if not args.split_process:
+            # With --split-process the capture child runs its own tap.
+            debug_tap = DebugTap(**debug_tap_options)
 
-        gateway.adv_with_mfg += 1
+    # Don't block Bleak's callback/event loop on network I/O.
+    verify_queue = FairVerifyQueue(
+        maxsize=256,
+        rate_per_second=args.verify_rps,
+        burst=args.verify_burst,
+        per_user_limit=int(os.environ.get("ATTENDANCE_VERIFY_PER_USER_PENDING", "4")),
+    )
+    recorder = None
+    if args.record:
+        from capture_files import AdvertisementRecorder
 
-        items = []
-        if args.strict_apple_id:
-            if APPLE_COMPANY_ID in md:
-                items = [(APPLE_COMPANY_ID, md[APPLE_COMPANY_ID])]
-        else:
-            items = list(md.items())
+        recorder = AdvertisementRecorder(Path(args.record).expanduser())
+        logger.log({"event": "recording_started", "path": str(recorder.path)})
 
-        if not items:
-            return
+    presence = PresenceTracker(
+        ttl_seconds=float(os.environ.get("ATTENDANCE_PRESENCE_TTL_SECONDS", "120")),
+        max_members=int(os.environ.get("ATTENDANCE_PRESENCE_MAX", "2000")),
+    )
+    page_size = max(1, int(os.environ.get("ATTENDANCE_UI_PAGE_SIZE", "15")))
+    ui_renders = ui_skipped = 0
 
-        frame = None
-        for company_id, payload in items:
-            try:
-                payload_bytes = bytes(payload)
-            except Exception:
-                payload_bytes = payload
+    pipeline = AttendancePipeline(
+        gateway,
+        verify_sink=NullVerifySink(gateway) if args.dry_run else GatewayVerifySink(gateway),
+        log_sink=logger,
+        queue=verify_queue,
+        strict_apple_id=args.strict_apple_id,
+        debug_adv=debug_tap.offer if debug_tap is not None else None,
+        recorder=recorder,
+        presence=presence,
+    )
 
-            if payload_bytes[:2] == IBEACON_PREFIX:
-                gateway.adv_ibeacon_prefix += 1
+    if args.no_ui or args.verbose:
 
-            if args.debug_adv:
-                head = payload_bytes[:8].hex()
+        def print_result(frame: BeaconFrame, result: VerifyResult) -> None:
+            if result.ok:
                 console.print(
-                    f"[dim]ADV[/dim] {address} rssi={rssi} company=0x{company_id:04x} bytes={len(payload_bytes)} head={head}"
+                    f"[green][OK][/green] {frame.user_id} token={frame.token_u32} rssi={frame.rssi} -> {result.detail}"
+                )
+            elif result.status_code is not None:
+                console.print(
+                    f"[red][ERR][/red] {frame.user_id} token={frame.token_u32} rssi={frame.rssi} -> {result.detail}"
                 )
 
-            candidate = parse_ibeacon(payload_bytes, rssi)
-            if candidate is not None:
-                frame = candidate
-                break
-
-        if frame is None:
-            return
-
-        gateway.frames_parsed += 1
+        pipeline.add_listener(print_result)
 
-        if not gateway.should_send(frame):
-            return
+    ring_source: Optional[RingFrameSource] = None
+    if args.btsnoop:
+        from capture_files import BtsnoopSource
 
-        try:
-            verify_queue.put_nowait(frame)
-            gateway.enqueued += 1
-        except asyncio.QueueFull:
-            gateway.dropped_queue_full += 1
-            return
+        source = BtsnoopSource(Path(args.btsnoop).expanduser(), speed=args.replay_speed)
+    elif args.replay:
+        from capture_files import RecordingSource
 
-    # Don't block Bleak's callback/event loop on network I/O.
-    verify_queue: asyncio.Queue[BeaconFrame] = asyncio.Queue(maxsize=256)
+        source = RecordingSource(Path(args.replay).expanduser(), speed=args.replay_speed)
+    elif args.split_process:
+        ring_source = RingFrameSource(
+            adapter=args.adapter,
+            strict_apple_id=bool(args.strict_apple_id),
+            debug_tap=dict(debug_tap_options, out=args.debug_out) if debug_tap_options is not None else None,
+            capacity=int(os.environ.get("ATTENDANCE_RING_CAPACITY", "4096")),
+            scan_filter=args.scan_filter,
+            stall_seconds=args.stall_seconds,
+        )
+        source = ring_source
+    else:
+        source = BleakAdvertisementSource(
+            adapter=args.adapter,
+            scan_filter=args.scan_filter,
+            strict_apple_id=bool(args.strict_apple_id),
+            stall_seconds=args.stall_seconds,
+        )
 
-    async def verify_worker() -> None:
-        recent_verified = deque(maxlen=5)
+    async def state_worker() -> None:
+        """Periodically persist dedupe state so a restart doesn't re-verify everyone in range."""
+        interval = max(1.0, float(args.state_interval))
         while True:
-            frame = await verify_queue.get()
+            await asyncio.sleep(interval)
             try:
-                before_ok = gateway.requests_ok
-                before_err = gateway.requests_err
-                await asyncio.to_thread(gateway.verify, frame)
-
-                if gateway.requests_ok != before_ok:
-                    recent_verified.appendleft(
-                        {
-                            "at": time.strftime('%H:%M:%S', time.localtime(time.time())),
-                            "user": frame.user_id,
-                            "rssi": frame.rssi,
-                            "status": gateway.last_status_code,
-                        }
-                    )
-                    logger.log(
-                        {
-                            "event": "attendance_verified",
-                            "ok": True,
-                            "status_code": gateway.last_status_code,
-                            "gym_id": args.gym_id,
-                            "scanner_id": args.scanner_id,
-                            "user_id": frame.user_id,
-                            "token_u32": frame.token_u32,
-                            "rssi": frame.rssi,
-                        }
-                    )
-                elif gateway.requests_err != before_err:
-                    logger.log(
-                        {
-                            "event": "attendance_verified",
-                            "ok": False,
-                            "status_code": gateway.last_status_code,
-                            "gym_id": args.gym_id,
-                            "scanner_id": args.scanner_id,
-                            "user_id": frame.user_id,
-                            "token_u32": frame.token_u32,
-                            "rssi": frame.rssi,
-                            "error": gateway.last_err,
-                        }
-                    )
+                await state_store.save_async(gateway)
+            except Exception as e:
+                gateway.last_err_at = gateway.clock.time()
+                gateway.last_err = f"state snapshot error: {e}"
 
-                should_print = args.no_ui or args.verbose
-                if should_print:
-                    if gateway.requests_ok != before_ok:
-                        console.print(
-                            f"[green][OK][/green] {frame.user_id} token={frame.token_u32} rssi={frame.rssi} -> {gateway.last_ok}"
-                        )
-                    elif gateway.requests_err != before_err:
-                        console.print(
-                            f"[red][ERR][/red] {frame.user_id} token={frame.token_u32} rssi={frame.rssi} -> {gateway.last_err}"
-                        )
-            finally:
-                verify_queue.task_done()
+    state_task = asyncio.create_task(state_worker()) if state_store is not None else None
 
-            # Attach recent_verified on the gateway for UI rendering.
-            setattr(gateway, "recent_verified", list(recent_verified))
+    profiling = None
+    if args.profiling:
+        from profiling import ProfilingHooks
 
-    scanner_kwargs = {}
-    if args.adapter:
-        scanner_kwargs["bluez"] = {"adapter": args.adapter}
+        profiling = ProfilingHooks(
+            log_path.parent / "profiles",
+            prefix=log_path.stem,
+            log=logger.log,
+            gauges=lambda: profiling_gauges(gateway, verify_queue, presence, debug_tap),
+            mode=os.environ.get("ATTENDANCE_PROFILE_MODE", "sample"),
+            max_seconds=float(os.environ.get("ATTENDANCE_PROFILE_MAX_SECONDS", "120")),
+            max_bytes=int(os.environ.get("ATTENDANCE_PROFILE_MAX_BYTES", "20000000")),
+        )
+        if profiling.install(asyncio.get_running_loop()):
+            console.print(f"Profiling: kill -USR1 {os.getpid()} (CPU), kill -USR2 {os.getpid()} (memory)")
 
-    scanner = BleakScanner(detection_callback=detection_callback, **scanner_kwargs)
+    config_watcher = None
+    config_task = None
+    if config_path is not None:
+        config_watcher = ConfigWatcher(
+            config_path,
+            LiveConfig(gateway, pipeline, verify_queue, logger, source, pinned=config_pinned),
+            logger.log,
+            interval=float(os.environ.get("ATTENDANCE_CONFIG_POLL_SECONDS", "2")),
+            initial=config_values,
+        )
+        if config_watcher.install(asyncio.get_running_loop()):
+            console.print(f"Config: {config_path} (reloads on save, or kill -HUP {os.getpid()})")
+        config_task = asyncio.create_task(config_watcher.run())
 
-    worker_task = asyncio.create_task(verify_worker())
+    heartbeat = None
+    heartbeat_task = None
+    if args.heartbeat_seconds > 0 and not args.dry_run and not file_source:
+        heartbeat = HeartbeatReporter(
+            gateway,
+            verify_queue,
+            interval=args.heartbeat_seconds,
+            idle_interval=float(os.environ.get("ATTENDANCE_HEARTBEAT_IDLE_SECONDS", "600")),
+            spool_path=log_path.parent / f"{log_path.stem}.heartbeats.gz",
+        )
+        spooled = heartbeat.load_spool()
+        if spooled:
+            logger.log({"event": "heartbeat_spool_loaded", "rows": spooled})
+        heartbeat_task = asyncio.create_task(heartbeat.run())
 
-    async def poll_worker() -> None:
-        """Fallback for platforms/backends where detection_callback is flaky.
+    # Degrades the extras above (never scanning or verifying) while the event loop is behind.
+    lag_monitor = LoopLagMonitor(
+        logger.log,
+        degrade_ms=float(os.environ.get("ATTENDANCE_LOOP_LAG_DEGRADE_MS", "50")),
+        shed_ms=float(os.environ.get("ATTENDANCE_LOOP_LAG_SHED_MS", "250")),
+        recover_seconds=float(os.environ.get("ATTENDANCE_LOOP_LAG_RECOVER_SECONDS", "10")),
+        shedding=not args.no_load_shedding,
+    )
+    view = {"page": 0, "refresh": UI_REFRESH_SECONDS[0]}
+    if not args.no_ui:
+        lag_monitor.add_action("ui_refresh", lambda level: view.update(refresh=UI_REFRESH_SECONDS[level]))
+    if isinstance(source, BleakAdvertisementSource):
+        lag_monitor.add_action("poll", lambda level: setattr(source, "shed_level", level))
+    if debug_tap is not None:
+        lag_monitor.add_action("debug_sample", lambda level: setattr(debug_tap, "shed_level", level))
+    lag_monitor.add_action("log_defer", lambda level: logger.defer(LOG_DEFER_SECONDS[level]))
+    lag_task = asyncio.create_task(lag_monitor.run())
 
-        On some Linux/BlueZ setups, Bleak's callback may not fire even though the
-        scanner collects discovered devices. Polling the discovered map keeps the
-        UI/live metrics moving and still lets us parse manufacturer data.
-        """
+    console.print("Scanning for iBeacon frames… (Ctrl+C to stop)")
+    started = time.perf_counter()
+    pipeline_task = asyncio.create_task(pipeline.run(source, drain=file_source))
+    debug_task = None
+    if debug_tap is not None:
+        if args.debug_out:
+            debug_write = append_lines_to(Path(args.debug_out).expanduser())
+        else:
 
-        # Small initial delay so the scanner can start.
-        await asyncio.sleep(0.25)
-        while True:
-            await asyncio.sleep(0.75)
-            gateway.poll_cycles += 1
-            gateway.last_poll_at = time.time()
+            def debug_write(text: str) -> None:
+                console.print(text, markup=False, highlight=False, style="dim")
 
-            try:
-                discovered = getattr(scanner, "discovered_devices_and_advertisement_data", {})
-                gateway.poll_devices = len(discovered)
-                if not discovered:
-                    continue
+        debug_task = asyncio.create_task(debug_tap.drain(debug_write))
+    try:
+        if args.no_ui:
+            while not pipeline_task.done():
+                await asyncio.sleep(1)
+        else:
+            ring = ring_source.ring if ring_source is not None else None
 
-                for _addr, (dev, adv) in list(discovered.items()):
-                    _handle_advertisement(getattr(dev, "address", "?"), adv.rssi, adv.manufacturer_data)
-            except Exception as e:
-                # Don't crash scanning on occasional backend issues.
-                gateway.last_err_at = time.time()
-                gateway.last_err = f"poll error: {e}"
-
-    poll_task = asyncio.create_task(poll_worker())
-
-    def render_metrics_table() -> Table:
-        t = Table(title="Scanner Status", expand=True)
-        t.add_column("Metric")
-        t.add_column("Value", justify="right")
-        t.add_row("Adv callbacks", str(gateway.adv_seen))
-        t.add_row("Poll cycles", str(gateway.poll_cycles))
-        t.add_row("Poll devices", str(gateway.poll_devices))
-        t.add_row("Adv w/ manufacturer", str(gateway.adv_with_mfg))
-        t.add_row("iBeacon prefix seen", str(gateway.adv_ibeacon_prefix))
-        t.add_row("Frames seen", str(gateway.frames_seen))
-        t.add_row("iBeacon parsed", str(gateway.frames_parsed))
-        t.add_row("Enqueued", str(gateway.enqueued))
-        if gateway.dropped_queue_full:
-            t.add_row("Dropped (queue full)", f"[red]{gateway.dropped_queue_full}[/red]")
-        t.add_row("Verify requests", str(gateway.requests_sent))
-        t.add_row("Verify OK", f"[green]{gateway.requests_ok}[/green]")
-        t.add_row("Verify ERR", f"[red]{gateway.requests_err}[/red]")
-        if gateway.last_seen:
-            t.add_row("Last UUID", gateway.last_seen.user_id)
-            t.add_row("Last token_u32", str(gateway.last_seen.token_u32))
-            t.add_row("Last RSSI", f"{gateway.last_seen.rssi} dBm")
-        if gateway.last_ok_at:
-            t.add_row("Last OK", time.strftime('%H:%M:%S', time.localtime(gateway.last_ok_at)))
-        if gateway.last_err_at:
-            t.add_row("Last ERR", time.strftime('%H:%M:%S', time.localtime(gateway.last_err_at)))
-        if gateway.last_err:
-            t.add_row("Last error", gateway.last_err)
-        return t
-
-    def render_recent_table() -> Table:
-        t = Table(title="Latest verified (top 5)", expand=True)
-        t.add_column("Time", no_wrap=True)
-        t.add_column("User", overflow="fold")
-        t.add_column("RSSI", justify="right")
-        t.add_column("HTTP", justify="right")
-
-        rows = getattr(gateway, "recent_verified", []) or []
-        if not rows:
-            t.add_row("-", "(none yet)", "-", "-")
-            return t
-
-        for r in rows[:5]:
-            user_id = str(r.get("user", ""))
-            short = user_id[:8] + "…" + user_id[-4:] if len(user_id) > 16 else user_id
-            t.add_row(
-                str(r.get("at", "")),
-                short,
-                f"{r.get('rssi', '')}",
-                f"{r.get('status', '')}",
-            )
-        return t
-
-    def render_layout():
-        layout = Layout(name="root")
-        layout.split_row(
-            Layout(name="left", ratio=2),
-            Layout(name="right", ratio=3),
-        )
-        layout["left"].update(Panel(render_metrics_table(), title="Metrics"))
-        layout["right"].update(Panel(render_recent_table(), title="Latest verified"))
-        return layout
+            def on_key(ch: str) -> None:
+                if ch in ("n", " ", "j"):
+                    view["page"] += 1
+                elif ch in ("p", "k"):
+                    view["page"] = max(0, view["page"] - 1)
 
-    console.print("Scanning for iBeacon frames… (Ctrl+C to stop)")
-    try:
-        async with scanner:
-            if args.no_ui:
-                while True:
-                    await asyncio.sleep(1)
-            else:
-                with Live(get_renderable=render_layout, console=console, refresh_per_second=4):
-                    while True:
-                        await asyncio.sleep(0.25)
+            last_snapshot: Optional[DashboardSnapshot] = None
+            with _keypresses(on_key), Live(console=console, auto_refresh=False) as live:
+                while not pipeline_task.done():
+                    snapshot = take_dashboard_snapshot(
+                        gateway,
+                        verify_queue,
+                        ring,
+                        presence,
+                        view["page"],
+                        page_size,
+                        debug_tap,
+                        heartbeat,
+                        lag_monitor,
+                    )
+                    view["page"] = snapshot.page
+                    if snapshot != last_snapshot:
+                        live.update(render_dashboard(snapshot), refresh=True)
+                        last_snapshot = snapshot
+                        ui_renders += 1
+                    else:
+                        ui_skipped += 1
+                    await asyncio.sleep(view["refresh"])
+        # Surface scanner failures (e.g. BlueZ errors) instead of idling.
+        pipeline_task.result()
+        if file_source:
+            elapsed = max(1e-9, time.perf_counter() - started)
+            stages = pipeline.stats()
+            console.print(
+                Panel(
+                    "\n".join(
+                        [
+                            f"Advertisements: {stages['source']['items_in']} "
+                            f"({stages['source']['items_in'] / elapsed:,.0f}/s over {elapsed:.2f}s)",
+                            f"iBeacon frames: {stages['parse']['items_out']}",
+                            f"Passed throttle: {stages['filter']['items_out']}",
+                            f"Verified OK: {stages['verify']['items_out']}  ERR: {stages['verify']['errors']}",
+                        ]
+                    ),
+                    title="Replay finished",
+                )
+            )
     finally:
-        worker_task.cancel()
-        poll_task.cancel()
+        pipeline_task.cancel()
+        await asyncio.gather(pipeline_task, return_exceptions=True)
+        logger.log({"event": "pipeline_stats", "stages": pipeline.stats()})
+        gateway.close()
+        if not args.dry_run:
+            logger.log({"event": "verify_hedge_stats", **gateway.hedge_stats()})
+        for watchdog in gateway.scan_watchdogs.values():
+            logger.log(
+                {
+                    "event": "scanner_watchdog_stats",
+                    "adapter": watchdog.name,
+                    "stalls": watchdog.stalls,
+                    "restarts": watchdog.restarts,
+                    "recoveries": watchdog.recoveries,
+                    "total_stall_seconds": round(watchdog.total_stall_seconds, 1),
+                    "last_recovery_seconds": watchdog.last_recovery_seconds,
+                }
+            )
+        lag_task.cancel()
+        loop_stats = {"event": "loop_lag_stats", **lag_monitor.stats()}
+        if isinstance(source, BleakAdvertisementSource):
+            loop_stats["polls_shed"] = source.polls_shed
+        logger.log(loop_stats)
+        if not args.no_ui:
+            logger.log({"event": "ui_stats", "renders": ui_renders, "skipped": ui_skipped})
+        if recorder is not None:
+            recorder.close()
+            logger.log(
+                {
+                    "event": "recording_stopped",
+                    "path": str(recorder.path),
+                    "records": recorder.records,
+                    "truncated": recorder.truncated,
+                }
+            )
+        if profiling is not None:
+            profiling.close()
+        if config_task is not None:
+            config_task.cancel()
+            config_watcher.close()
+            logger.log({"event": "config_reload_stats", "reloads": config_watcher.reloads, "failures": config_watcher.failures})
+        if heartbeat_task is not None:
+            heartbeat_task.cancel()
+            await asyncio.gather(heartbeat_task, return_exceptions=True)
+            # Upload on the next start rather than holding up shutdown on the network.
+            heartbeat.sample()
+            heartbeat.save_spool()
+            logger.log(
+                {
+                    "event": "heartbeat_stats",
+                    "rows_sent": heartbeat.rows_sent,
+                    "batches_sent": heartbeat.batches_sent,
+                    "bytes_sent": heartbeat.bytes_sent,
+                    "upload_errors": heartbeat.upload_errors,
+                    "rows_dropped": heartbeat.rows_dropped,
+                    "pending": len(heartbeat.pending),
+                }
+            )
+        if debug_task is not None:
+            debug_task.cancel()
+            await asyncio.gather(debug_task, return_exceptions=True)
+            logger.log(
+                {
+                    "event": "debug_tap_stats",
+                    "offered": debug_tap.offered,
+                    "written": debug_tap.written,
+                    "sampled_out": debug_tap.sampled_out,
+                    "shed": debug_tap.shed,
+                    "filtered": debug_tap.filtered,
+                    "dropped_full": debug_tap.dropped_full,
+                }
+            )
+        if state_task is not None:
+            state_task.cancel()
+        if gossip_transport is not None:
+            gossip_transport.close()
+        if state_store is not None:
+            try:
+                gateway.prune_throttle()
+                size = state_store.save(gateway)
+                logger.log(
+                    {
+                        "event": "state_saved",
+                        "path": str(state_store.path),
+                        "bytes": size,
+                        "save_ms": round(gateway.state_last_ms, 3),
+                        "throttle_entries": len(gateway._last_sent),
+                    }
+                )
+            except Exception:
+                pass
+        logger.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""Discrete-event simulation of a gym day through the real scanner pipeline.
+
+Synthetic members arrive, advertise rotating iBeacon tokens while they stay and
+leave again; a simulated verify endpoint answers with sampled latencies and
+errors. Everything runs on a virtual clock: the asyncio loop's time() is
+virtual and jumps straight to the next timer whenever nothing is runnable, so
+hours of traffic finish in seconds. The same --seed gives the same report.
+
+Use it to size --verify-rps/--verify-burst, the throttle window, the verify
+queue and verify workers before a busy gym hits them, e.g.
+
+  python3 attendance_scanner/simulate.py --hours 4 --arrivals-per-hour 300 --verify-rps 5
+"""
+
+import argparse
+import asyncio
+import heapq
+import json
+import math
+import random
+import selectors
+import sys
+import time
+import uuid
+import zlib
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional
+
+from scanner import (
+    AttendanceGateway,
+    AttendancePipeline,
+    BeaconFrame,
+    FairVerifyQueue,
+    THROTTLE_SECONDS,
+    VerifyResult,
+    _percentile,
+)
+
+
+# attendance-verify-scan accepts the current 30 s window and one either side.
+TOKEN_WINDOW_SECONDS = 30.0
+
+
+class VirtualClock:
+    """Drop-in for scanner.SystemClock that only moves when advanced."""
+
+    def __init__(self, epoch: float = 1_700_000_000.0) -> None:
+        self.epoch = float(epoch)
+        self.now = 0.0
+
+    def time(self) -> float:
+        return self.epoch + self.now
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        if seconds > 0:
+            self.now += seconds
+
+
+class _VirtualSelector(selectors.DefaultSelector):
+    # The loop asks the selector to block until its next timer is due; instead
+    # of sleeping we poll real fds (the loop's self-pipe) and jump the clock.
+    def __init__(self, clock: VirtualClock) -> None:
+        super().__init__()
+        self.clock = clock
+
+    def select(self, timeout=None):
+        events = super().select(0)
+        if events or timeout == 0:
+            return events
+        if timeout is None:
+            raise RuntimeError("simulation stalled: no timers pending and nothing runnable")
+        self.clock.advance(timeout)
+        return events
+
+
+class VirtualTimeEventLoop(asyncio.SelectorEventLoop):
+    """Event loop whose time() is a VirtualClock; asyncio.sleep() costs no wall time."""
+
+    def __init__(self, clock: VirtualClock) -> None:
+        super().__init__(selector=_VirtualSelector(clock))
+        self.clock = clock
+
+    def time(self) -> float:
+        return self.clock.monotonic()
+
+
+def run_in_virtual_time(coro, clock: VirtualClock):
+    loop = VirtualTimeEventLoop(clock)
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+@dataclass
+class SimConfig:
+    hours: float = 4.0
+    arrivals_per_hour: float = 150.0
+    stay_minutes: float = 60.0
+    adv_interval: float = 1.0
+    rssi_mean: float = -68.0
+    rssi_sd: float = 8.0
+    min_rssi: int = -85
+    throttle_seconds: float = THROTTLE_SECONDS
+    verify_rps: float = 10.0
+    verify_burst: float = 20.0
+    per_user_pending: int = 4
+    queue_size: int = 256
+    verify_workers: int = 1
+    latency_ms: float = 250.0
+    latency_sigma: float = 0.6
+    error_rate: float = 0.01
+    http_timeout: float = 12.0
+    tick: float = 0.05
+    seed: int = 1
+
+
+def _token_u32(user_id: str, window_index: int) -> int:
+    # Stand-in for the app's HMAC token; only needs to differ per user and window.
+    return zlib.crc32(f"{user_id}|{window_index}".encode("utf-8")) & 0xFFFFFFFF
+
+
+@dataclass
+class _Member:
+    user_id: str
+    arrives_at: float
+    leaves_at: float
+    checked_in_at: Optional[float] = None
+
+    def __post_init__(self) -> None:
+        self.beacon_prefix = bytes([0x02, 0x15]) + uuid.UUID(self.user_id).bytes
+
+
+class SimulatedVerifyEndpoint:
+    """VerifySink standing in for attendance-verify-scan.
+
+    Latency is log-normal around `latency_ms`; calls slower than the HTTP
+    timeout fail like a network error. Tokens are checked against the window
+    at the time the request lands, and check-ins are idempotent per member.
+    """
+
+    def __init__(self, config: SimConfig, clock: VirtualClock, members: Dict[str, _Member], rng: random.Random) -> None:
+        self.config = config
+        self.clock = clock
+        self.members = members
+        self.rng = rng
+        self.latencies: List[float] = []
+
+        self.calls = 0
+        self.ok = 0
+        self.redundant = 0
+        self.stale_tokens = 0
+        self.server_errors = 0
+        self.timeouts = 0
+
+    async def verify(self, frame: BeaconFrame) -> VerifyResult:
+        config = self.config
+        self.calls += 1
+        latency = self.rng.lognormvariate(math.log(config.latency_ms / 1000.0), config.latency_sigma)
+        if latency >= config.http_timeout:
+            await asyncio.sleep(config.http_timeout)
+            self.timeouts += 1
+            return VerifyResult(ok=False, status_code=None, detail="network error: timeout")
+
+        await asyncio.sleep(latency)
+        self.latencies.append(latency)
+        if self.rng.random() < config.error_rate:
+            self.server_errors += 1
+            return VerifyResult(ok=False, status_code=500, detail="simulated server error")
+
+        window = int(self.clock.time() // TOKEN_WINDOW_SECONDS)
+        if frame.token_u32 not in (_token_u32(frame.user_id, w) for w in (window - 1, window, window + 1)):
+            self.stale_tokens += 1
+            return VerifyResult(ok=False, status_code=400, detail="Token mismatch")
+
+        self.ok += 1
+        member = self.members[frame.user_id]
+        if member.checked_in_at is None:
+            member.checked_in_at = self.clock.monotonic()
+        else:
+            self.redundant += 1
+        return VerifyResult(ok=True, status_code=200, detail="ok")
+
+
+class SimulatedGymSource:
+    """AdvertisementSource replaying scheduled member advertisements in virtual time.
+
+    Advertisements are due at per-member intervals with jitter; everything due
+    within one `tick` is submitted together to keep the event count manageable.
+    """
+
+    def __init__(self, config: SimConfig, clock: VirtualClock, members: List[_Member], rng: random.Random) -> None:
+        self.config = config
+        self.clock = clock
+        self.members = members
+        self.rng = rng
+        self.advertisements = 0
+        self.peak_queue = 0
+        self.peak_throttle_entries = 0
+        self.peak_present = 0
+
+    async def run(self, pipeline) -> None:
+        config = self.config
+        rng = self.rng
+        clock = self.clock
+        due = [(m.arrives_at, i) for i, m in enumerate(self.members)]
+        heapq.heapify(due)
+        departures = sorted(m.leaves_at for m in self.members)
+        arrivals = sorted(m.arrives_at for m in self.members)
+        arrived = departed = 0
+
+        while due:
+            tick_end = clock.monotonic() + config.tick
+            while due and due[0][0] < tick_end:
+                at, i = heapq.heappop(due)
+                member = self.members[i]
+                if at >= member.leaves_at:
+                    continue
+                window = int((clock.epoch + at) // TOKEN_WINDOW_SECONDS)
+                token = _token_u32(member.user_id, window)
+                payload = member.beacon_prefix + token.to_bytes(4, "big") + b"\xc5"
+                rssi = int(round(rng.gauss(config.rssi_mean, config.rssi_sd)))
+                pipeline.submit_advertisement(member.user_id, rssi, {0x004C: payload})
+                self.advertisements += 1
+                heapq.heappush(due, (at + config.adv_interval * rng.uniform(0.8, 1.2), i))
+
+            while arrived < len(arrivals) and arrivals[arrived] < tick_end:
+                arrived += 1
+            while departed < len(departures) and departures[departed] < tick_end:
+                departed += 1
+            present = arrived - departed
+            self.peak_present = max(self.peak_present, present)
+            self.peak_queue = max(self.peak_queue, pipeline.queue.qsize())
+            self.peak_throttle_entries = max(self.peak_throttle_entries, len(pipeline.gateway._last_sent))
+
+            if due:
+                await asyncio.sleep(max(config.tick, due[0][0] - clock.monotonic()))
+
+
+def build_members(config: SimConfig, rng: random.Random) -> List[_Member]:
+    """Poisson arrivals over the day, exponential stays (at least 5 minutes)."""
+    members: List[_Member] = []
+    duration = config.hours * 3600.0
+    rate = config.arrivals_per_hour / 3600.0
+    t = 0.0
+    while rate > 0:
+        t += rng.expovariate(rate)
+        if t >= duration:
+            break
+        stay = max(300.0, rng.expovariate(1.0 / (config.stay_minutes * 60.0)))
+        user_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        members.append(_Member(user_id=user_id, arrives_at=t, leaves_at=min(duration, t + stay)))
+    return members
+
+
+def simulate(config: SimConfig) -> dict:
+    """Run one scenario and return a JSON-friendly report."""
+    rng = random.Random(config.seed)
+    clock = VirtualClock()
+    members = build_members(config, rng)
+    by_user = {m.user_id: m for m in members}
+
+    gateway = AttendanceGateway(
+        supabase_url="http://simulated.invalid",
+        gym_id=1,
+        scanner_key="",
+        scanner_id="simulated",
+        min_rssi=config.min_rssi,
+        http_timeout_seconds=config.http_timeout,
+        http_retries=1,
+        clock=clock,
+        throttle_seconds=config.throttle_seconds,
+    )
+    endpoint = SimulatedVerifyEndpoint(config, clock, by_user, random.Random(config.seed + 1))
+    source = SimulatedGymSource(config, clock, members, random.Random(config.seed + 2))
+
+    async def scenario():
+        queue = FairVerifyQueue(
+            maxsize=config.queue_size,
+            rate_per_second=config.verify_rps,
+            burst=config.verify_burst,
+            per_user_limit=config.per_user_pending,
+            clock=clock,
+        )
+        pipeline = AttendancePipeline(
+            gateway,
+            verify_sink=endpoint,
+            queue=queue,
+            verify_workers=config.verify_workers,
+        )
+        await pipeline.run(source, drain=True)
+        return pipeline, queue
+
+    started = time.perf_counter()
+    pipeline, queue = run_in_virtual_time(scenario(), clock)
+    wall = time.perf_counter() - started
+
+    waits = sorted(m.checked_in_at - m.arrives_at for m in members if m.checked_in_at is not None)
+    latencies = sorted(endpoint.latencies)
+    stages = pipeline.stats()
+    return {
+        "config": asdict(config),
+        "simulated_seconds": round(clock.monotonic(), 3),
+        "wall_seconds": round(wall, 3),
+        "members": {
+            "arrived": len(members),
+            "peak_present": source.peak_present,
+            "checked_in": len(waits),
+            "missed": len(members) - len(waits),
+            "time_to_check_in_p50": _percentile(waits, 50, 3),
+            "time_to_check_in_p95": _percentile(waits, 95, 3),
+            "time_to_check_in_p99": _percentile(waits, 99, 3),
+            "time_to_check_in_max": round(max(waits), 3) if waits else None,
+        },
+        "pipeline": {
+            "advertisements": source.advertisements,
+            "frames_parsed": stages["parse"]["items_out"],
+            "below_min_rssi_or_throttled": stages["filter"]["dropped"],
+            "enqueued": gateway.enqueued,
+            "dropped_queue_full": gateway.dropped_queue_full,
+            "per_user_throttled": queue.per_user_throttled,
+            "limiter_waits": queue.limiter_waits,
+            "limiter_wait_seconds": round(queue.limiter_wait_seconds, 3),
+            "peak_queue_depth": source.peak_queue,
+            "peak_throttle_entries": source.peak_throttle_entries,
+        },
+        "verify": {
+            "calls": endpoint.calls,
+            "ok": endpoint.ok,
+            "redundant_ok": endpoint.redundant,
+            "stale_tokens": endpoint.stale_tokens,
+            "server_errors": endpoint.server_errors,
+            "timeouts": endpoint.timeouts,
+            "calls_per_second": round(endpoint.calls / max(1e-9, clock.monotonic()), 3),
+            "latency_p50": _percentile(latencies, 50, 3),
+            "latency_p95": _percentile(latencies, 95, 3),
+        },
+    }
+
+
+def main() -> None:
+    defaults = SimConfig()
+    parser = argparse.ArgumentParser(description="Simulate a gym day through the attendance scanner pipeline")
+    parser.add_argument("--hours", type=float, default=defaults.hours, help="Simulated duration (default: %(default)s)")
+    parser.add_argument("--arrivals-per-hour", type=float, default=defaults.arrivals_per_hour, help="Poisson arrival rate (default: %(default)s)")
+    parser.add_argument("--stay-minutes", type=float, default=defaults.stay_minutes, help="Mean time a member stays in range (default: %(default)s)")
+    parser.add_argument("--adv-interval", type=float, default=defaults.adv_interval, help="Seconds between advertisements seen per member (default: %(default)s)")
+    parser.add_argument("--rssi-mean", type=float, default=defaults.rssi_mean, help="Mean RSSI in dBm (default: %(default)s)")
+    parser.add_argument("--rssi-sd", type=float, default=defaults.rssi_sd, help="RSSI standard deviation (default: %(default)s)")
+    parser.add_argument("--min-rssi", type=int, default=defaults.min_rssi, help="Scanner --min-rssi (default: %(default)s)")
+    parser.add_argument("--throttle-seconds", type=float, default=defaults.throttle_seconds, help="Per (user, token) throttle window (default: %(default)s)")
+    parser.add_argument("--verify-rps", type=float, default=defaults.verify_rps, help="Scanner --verify-rps, 0 = unlimited (default: %(default)s)")
+    parser.add_argument("--verify-burst", type=float, default=defaults.verify_burst, help="Scanner --verify-burst (default: %(default)s)")
+    parser.add_argument("--per-user-pending", type=int, default=defaults.per_user_pending, help="Pending verifies kept per member (default: %(default)s)")
+    parser.add_argument("--queue-size", type=int, default=defaults.queue_size, help="Verify queue capacity (default: %(default)s)")
+    parser.add_argument("--verify-workers", type=int, default=defaults.verify_workers, help="Concurrent verify calls (default: %(default)s)")
+    parser.add_argument("--latency-ms", type=float, default=defaults.latency_ms, help="Median verify latency (default: %(default)s)")
+    parser.add_argument("--latency-sigma", type=float, default=defaults.latency_sigma, help="Log-normal latency spread (default: %(default)s)")
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate, help="Fraction of verifies answered with 500 (default: %(default)s)")
+    parser.add_argument("--http-timeout", type=float, default=defaults.http_timeout, help="Scanner --http-timeout (default: %(default)s)")
+    parser.add_argument("--tick", type=float, default=defaults.tick, help="Advertisement batching resolution in seconds (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=defaults.seed, help="Random seed (default: %(default)s)")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    config = SimConfig(**{name: getattr(args, name) for name in asdict(defaults)})
+    report = simulate(config)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(
+        f"Simulated {report['simulated_seconds'] / 3600.0:.2f} h in {report['wall_seconds']:.2f} s "
+        f"(seed {config.seed})"
+    )
+    for section in ("members", "pipeline", "verify"):
+        print(f"\n{section}:")
+        for name, value in report[section].items():
+            print(f"  {name:<28} {value}")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(130)
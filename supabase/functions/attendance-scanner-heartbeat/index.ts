@@ -0,0 +1,212 @@
+import "jsr:@supabase/functions-js/edge-runtime.d.ts";
+import { createClient } from "jsr:@supabase/supabase-js@2";
+
+const corsHeaders = {
+  "Access-Control-Allow-Origin": "*",
+  "Access-Control-Allow-Headers":
+    "authorization, x-client-info, apikey, content-type, content-encoding, x-scanner-key",
+  "Access-Control-Allow-Methods": "POST, OPTIONS",
+  "Access-Control-Max-Age": "86400",
+};
+
+// A scanner that was offline for a day at a 60 s interval has 1440 rows queued.
+const MAX_ROWS = 2000;
+const MAX_BODY_BYTES = 4 * 1024 * 1024;
+
+const INT_FIELDS = [
+  "scanner_stalls",
+  "adv_seen",
+  "frames_parsed",
+  "enqueued",
+  "dropped_queue_full",
+  "queue_depth",
+  "verifies_ok",
+  "verifies_err",
+  "verify_hedged",
+  "verify_hedge_wins",
+  "rss_kb",
+];
+const REAL_FIELDS = [
+  "window_seconds",
+  "uptime_seconds",
+  "adv_per_second",
+  "ibeacon_per_second",
+  "verify_p50_ms",
+  "verify_p95_ms",
+  "verify_p99_ms",
+  "verify_hedge_deadline_ms",
+];
+
+async function sha256Hex(input: string): Promise<string> {
+  const enc = new TextEncoder();
+  const digest = await crypto.subtle.digest("SHA-256", enc.encode(input));
+  const bytes = new Uint8Array(digest);
+  return Array.from(bytes)
+    .map((b) => b.toString(16).padStart(2, "0"))
+    .join("");
+}
+
+async function readBody(req: Request): Promise<unknown> {
+  let stream = req.body;
+  if (!stream) return {};
+  if ((req.headers.get("content-encoding") ?? "").toLowerCase() === "gzip") {
+    stream = stream.pipeThrough(new DecompressionStream("gzip"));
+  }
+
+  const reader = stream.getReader();
+  const chunks: Uint8Array[] = [];
+  let size = 0;
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    size += value.length;
+    if (size > MAX_BODY_BYTES) {
+      await reader.cancel();
+      throw new RangeError("Body too large");
+    }
+    chunks.push(value);
+  }
+  const bytes = new Uint8Array(size);
+  let offset = 0;
+  for (const chunk of chunks) {
+    bytes.set(chunk, offset);
+    offset += chunk.length;
+  }
+  return JSON.parse(new TextDecoder().decode(bytes));
+}
+
+function toRow(
+  raw: Record<string, unknown>,
+  gymId: number,
+  scannerId: string,
+): Record<string, unknown> | null {
+  const sampledAt = Number(raw.sampled_at);
+  if (!Number.isFinite(sampledAt) || sampledAt <= 0) return null;
+
+  const row: Record<string, unknown> = {
+    gym_id: gymId,
+    scanner_id: scannerId,
+    sampled_at: new Date(sampledAt * 1000).toISOString(),
+    idle: raw.idle === true,
+    scan_mode: typeof raw.scan_mode === "string" ? raw.scan_mode.slice(0, 16) : null,
+    adapter_ok: typeof raw.adapter_ok === "boolean" ? raw.adapter_ok : null,
+    last_error: typeof raw.last_error === "string" ? raw.last_error.slice(0, 500) : null,
+  };
+  for (const field of INT_FIELDS) {
+    const value = Number(raw[field]);
+    row[field] = Number.isFinite(value) ? Math.max(0, Math.trunc(value)) : null;
+  }
+  for (const field of REAL_FIELDS) {
+    const value = Number(raw[field]);
+    row[field] = Number.isFinite(value) ? value : null;
+  }
+  if (row.window_seconds === null) row.window_seconds = 0;
+  return row;
+}
+
+Deno.serve(async (req) => {
+  if (req.method === "OPTIONS") {
+    return new Response(null, { status: 204, headers: corsHeaders });
+  }
+
+  try {
+    const scannerKey = req.headers.get("x-scanner-key")?.trim();
+    if (!scannerKey) {
+      return new Response(JSON.stringify({ error: "Unauthorized" }), {
+        status: 401,
+        headers: { ...corsHeaders, "Content-Type": "application/json" },
+      });
+    }
+
+    let body: any;
+    try {
+      body = await readBody(req);
+    } catch (error) {
+      const status = error instanceof RangeError ? 413 : 400;
+      return new Response(JSON.stringify({ error: status === 413 ? "Body too large" : "Invalid body" }), {
+        status,
+        headers: { ...corsHeaders, "Content-Type": "application/json" },
+      });
+    }
+
+    const gymId = Number(body?.gym_id);
+    if (!Number.isFinite(gymId) || gymId <= 0) {
+      return new Response(JSON.stringify({ error: "Valid gym_id is required" }), {
+        status: 400,
+        headers: { ...corsHeaders, "Content-Type": "application/json" },
+      });
+    }
+
+    const scannerId = body?.scanner_id as string | undefined;
+    if (!scannerId || typeof scannerId !== "string" || scannerId.trim().length === 0) {
+      return new Response(JSON.stringify({ error: "Valid scanner_id is required" }), {
+        status: 400,
+        headers: { ...corsHeaders, "Content-Type": "application/json" },
+      });
+    }
+
+    const heartbeats = body?.heartbeats;
+    if (!Array.isArray(heartbeats) || heartbeats.length === 0 || heartbeats.length > MAX_ROWS) {
+      return new Response(JSON.stringify({ error: `heartbeats must be an array of 1..${MAX_ROWS} rows` }), {
+        status: 400,
+        headers: { ...corsHeaders, "Content-Type": "application/json" },
+      });
+    }
+
+    const serviceUrl = Deno.env.get("SUPABASE_URL") ?? "";
+    const serviceKey = Deno.env.get("SUPABASE_SERVICE_ROLE_KEY") ?? "";
+    if (!serviceUrl || !serviceKey) {
+      return new Response(
+        JSON.stringify({ error: "Server misconfigured" }),
+        { status: 500, headers: { ...corsHeaders, "Content-Type": "application/json" } },
+      );
+    }
+
+    const serviceClient = createClient(serviceUrl, serviceKey);
+
+    const scannerKeyHash = await sha256Hex(scannerKey);
+    const { data: scannerRow } = await serviceClient
+      .from("attendance_scanners")
+      .select("id")
+      .eq("gym_id", gymId)
+      .eq("scanner_id", scannerId)
+      .eq("is_active", true)
+      .eq("key_hash_sha256_hex", scannerKeyHash)
+      .maybeSingle();
+
+    if (!scannerRow) {
+      return new Response(JSON.stringify({ error: "Unauthorized" }), {
+        status: 401,
+        headers: { ...corsHeaders, "Content-Type": "application/json" },
+      });
+    }
+
+    const rows = heartbeats
+      .filter((raw) => raw && typeof raw === "object")
+      .map((raw) => toRow(raw as Record<string, unknown>, gymId, scannerId))
+      .filter((row): row is Record<string, unknown> => row !== null);
+
+    if (rows.length > 0) {
+      // Retried batches resend rows we already have; the unique key makes that a no-op.
+      const { error } = await serviceClient
+        .from("attendance_scanner_heartbeats")
+        .upsert(rows, { onConflict: "gym_id,scanner_id,sampled_at", ignoreDuplicates: true });
+      if (error) {
+        return new Response(
+          JSON.stringify({ error: "Failed to store heartbeats", details: error.message }),
+          { status: 500, headers: { ...corsHeaders, "Content-Type": "application/json" } },
+        );
+      }
+    }
+
+    return new Response(JSON.stringify({ ok: true, accepted: rows.length, rejected: heartbeats.length - rows.length }), {
+      status: 200,
+      headers: { ...corsHeaders, "Content-Type": "application/json" },
+    });
+  } catch (error) {
+    return new Response(
+      JSON.stringify({ error: "Internal server error", details: (error as Error).message }),
+      { status: 500, headers: { ...corsHeaders, "Content-Type": "application/json" } },
+    );
+  }
+});
@@ -4,7 +4,7 @@ import { createClient } from "jsr:@supabase/supabase-js@2";
 const corsHeaders = {
   "Access-Control-Allow-Origin": "*",
   "Access-Control-Allow-Headers":
-    "authorization, x-client-info, apikey, content-type, x-scanner-key",
+    "authorization, x-client-info, apikey, content-type, x-scanner-key, idempotency-key",
   "Access-Control-Allow-Methods": "POST, OPTIONS",
   "Access-Control-Max-Age": "86400",
 };
@@ -229,6 +229,9 @@ Deno.serve(async (req) => {
 
     const chosen = eligible[0];
 
+    // Scanners hedge slow verifies: a second copy with the same Idempotency-Key
+    // (scanner, user, token) can arrive while the first is still running. Both
+    // upsert the same (session_id, user_id) row, so the duplicate is harmless.
     const { data: attendanceRow, error: upsertErr } = await serviceClient
       .from("session_attendance")
       .upsert(
@@ -0,0 +1,52 @@
+begin;
+
+-- One row per scanner heartbeat window, written only by the
+-- attendance-scanner-heartbeat Edge Function (service role).
+create table if not exists public.attendance_scanner_heartbeats (
+  id bigint generated always as identity primary key,
+  gym_id bigint not null,
+  scanner_id text not null,
+  sampled_at timestamptz not null,
+  received_at timestamptz not null default now(),
+  window_seconds real not null,
+  uptime_seconds real,
+  idle boolean not null default false,
+  scan_mode text,
+  adapter_ok boolean,
+  scanner_stalls integer,
+  adv_seen bigint,
+  adv_per_second real,
+  ibeacon_per_second real,
+  frames_parsed bigint,
+  enqueued bigint,
+  dropped_queue_full bigint,
+  queue_depth integer,
+  verifies_ok integer,
+  verifies_err integer,
+  verify_p50_ms real,
+  verify_p95_ms real,
+  verify_p99_ms real,
+  rss_kb integer,
+  last_error text,
+  unique (gym_id, scanner_id, sampled_at)
+);
+
+create index if not exists attendance_scanner_heartbeats_scanner_time_idx
+  on public.attendance_scanner_heartbeats(gym_id, scanner_id, sampled_at desc);
+
+create index if not exists attendance_scanner_heartbeats_received_idx
+  on public.attendance_scanner_heartbeats(received_at);
+
+alter table public.attendance_scanner_heartbeats enable row level security;
+
+comment on table public.attendance_scanner_heartbeats is
+  'Scanner health samples (counters are per window, not cumulative). Inserted by the attendance-scanner-heartbeat function.';
+
+-- Latest heartbeat per scanner: the franchise-wide "is it alive" view.
+create or replace view public.attendance_scanner_latest_heartbeat
+with (security_invoker = true) as
+select distinct on (gym_id, scanner_id) *
+from public.attendance_scanner_heartbeats
+order by gym_id, scanner_id, sampled_at desc;
+
+commit;
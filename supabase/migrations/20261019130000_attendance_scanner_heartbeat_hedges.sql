@@ -0,0 +1,18 @@
+begin;
+
+-- Hedged verify stats per heartbeat window (see AttendanceGateway in
+-- attendance_scanner/scanner.py): copies sent because the first request was
+-- late, how many of those answered first, and the deadline at sample time.
+alter table public.attendance_scanner_heartbeats
+  add column if not exists verify_hedged integer,
+  add column if not exists verify_hedge_wins integer,
+  add column if not exists verify_hedge_deadline_ms real;
+
+-- The view's `*` was expanded when it was created; recreate it to include the new columns.
+create or replace view public.attendance_scanner_latest_heartbeat
+with (security_invoker = true) as
+select distinct on (gym_id, scanner_id) *
+from public.attendance_scanner_heartbeats
+order by gym_id, scanner_id, sampled_at desc;
+
+commit;